@@ -1,113 +1,303 @@
 # ai_helper.py (最終韌性增強版)
 
-import google.generativeai as genai
 import config
 import pandas as pd
-import streamlit as st
 from datetime import datetime
-import yfinance as yf
-
-# --- AI 模型初始化 ---
-try:
-    # 優先從 Streamlit 的 Secrets 讀取 API 金鑰 (用於雲端部署)
-    if 'GEMINI_API_KEY' in st.secrets:
-        api_key = st.secrets['GEMINI_API_KEY']
-        print("Gemini API Key loaded from Streamlit Secrets.")
-    # 如果 Secrets 中沒有，則從本地的 config.py 讀取 (用於本機開發)
-    else:
-        api_key = config.GEMINI_API_KEY
-        print("Gemini API Key loaded from local config.py.")
-    
-    genai.configure(api_key=api_key)
-    llm = genai.GenerativeModel('gemini-1.5-flash')
-    print("Gemini AI 模型初始化成功。")
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from llm_cache import ResponseCache
+from llm_client import LLMClient
+from chat_context import ConversationContext
+from instrumentation import count, record, span, traced
+
+# google.generativeai、yfinance 與 streamlit 皆延遲到第一次使用時才匯入，
+# 讓 app.py 在新的工作行程中不必等待這些 SDK 載入即可先畫出側邊欄。
+
+# --- AI 模型初始化 (延遲載入) ---
+llm = None  # 可直接指定替代模型 (例如 fake_llm.FakeGenerativeModel)；None 代表尚未初始化
+_llm_initialized = False
+_llm_lock = threading.Lock()
+
+def _init_llm():
+    import streamlit as st
+    try:
+        import google.generativeai as genai
+
+        # 優先從 Streamlit 的 Secrets 讀取 API 金鑰 (用於雲端部署)
+        if 'GEMINI_API_KEY' in st.secrets:
+            api_key = st.secrets['GEMINI_API_KEY']
+            print("Gemini API Key loaded from Streamlit Secrets.")
+        # 如果 Secrets 中沒有，則從本地的 config.py 讀取 (用於本機開發)
+        else:
+            api_key = config.GEMINI_API_KEY
+            print("Gemini API Key loaded from local config.py.")
+
+        genai.configure(api_key=api_key)
+        # 以 LLMClient 包裝：速率限制、併發上限、重試與逾時；介面與 GenerativeModel 相同
+        model = LLMClient(genai.GenerativeModel(config.LLM_MODEL_NAME))
+        print("Gemini AI 模型初始化成功。")
+        return model
+
+    except Exception as e:
+        print(f"AI 模型初始化失敗: {e}")
+        # 在 Streamlit 介面上顯示錯誤，方便除錯
+        st.error(f"AI 模型初始化失敗，請檢查 API 金鑰是否已正確設定在 Streamlit Secrets 中。錯誤訊息: {e}")
+        return None
+
+def get_llm():
+    """取得模組層級的模型；第一次呼叫時才匯入 Gemini SDK 並初始化 (失敗時回傳 None 且不再重試)"""
+    global llm, _llm_initialized
+    if llm is None and not _llm_initialized:
+        with _llm_lock:
+            if llm is None and not _llm_initialized:
+                llm = _init_llm()
+                _llm_initialized = True
+    return llm
+
+# --- LLM Response Cache ---
+_response_cache = None
+_response_cache_lock = threading.Lock()
+
+def get_response_cache():
+    """取得行程共用的 LLM 回應快取；停用或無法開啟 (例如唯讀磁碟) 時回傳 None"""
+    global _response_cache
+    if not config.LLM_CACHE_ENABLED:
+        return None
+    with _response_cache_lock:
+        if _response_cache is None:
+            try:
+                _response_cache = ResponseCache()
+            except Exception as e:
+                print(f"LLM 回應快取無法開啟，將不使用快取: {e}")
+                config.LLM_CACHE_ENABLED = False
+        return _response_cache
+
+def _model_name(model):
+    return getattr(model, 'model_name', type(model).__name__)
 
-except Exception as e:
-    print(f"AI 模型初始化失敗: {e}")
-    # 在 Streamlit 介面上顯示錯誤，方便除錯
-    st.error(f"AI 模型初始化失敗，請檢查 API 金鑰是否已正確設定在 Streamlit Secrets 中。錯誤訊息: {e}")
-    llm = None
+def _count(stats, key):
+    count(key)
+    if stats is not None:
+        stats[key] = stats.get(key, 0) + 1
+
+def _generate_text(model, prompt, stats=None):
+    """呼叫模型生成文字；相同模型與提示詞的回應會從快取取得。例外會直接拋出且不會被快取。"""
+    cache = get_response_cache()
+    start = time.perf_counter()
+    if cache is not None:
+        cached = cache.get(prompt, _model_name(model))
+        if cached is not None:
+            cache.record(True, time.perf_counter() - start)
+            _count(stats, 'llm_cache_hits')
+            return cached
+
+    _count(stats, 'llm_requests')
+    with span('llm.generate', model=_model_name(model), prompt_chars=len(prompt)):
+        text = model.generate_content(prompt).text
+    if cache is not None:
+        cache.put(prompt, _model_name(model), text)
+        cache.record(False, time.perf_counter() - start)
+    return text
+
+def _stream_text(model, prompt, stats=None):
+    """串流版 _generate_text：快取命中時一次輸出全文；未命中時邊串流邊累積，完整結束後才寫入快取。"""
+    cache = get_response_cache()
+    start = time.perf_counter()
+    if cache is not None:
+        cached = cache.get(prompt, _model_name(model))
+        if cached is not None:
+            cache.record(True, time.perf_counter() - start)
+            _count(stats, 'llm_cache_hits')
+            yield cached
+            return
+
+    _count(stats, 'llm_requests')
+    parts = []
+    first_token = None
+    for chunk in model.generate_content(prompt, stream=True):
+        if chunk.text:
+            first_token = first_token or time.perf_counter() - start
+            parts.append(chunk.text)
+            yield chunk.text
+    # 串流途中會交回控制權給呼叫端，因此不以 with span 包住，結束後一次記錄
+    record('llm.stream', time.perf_counter() - start, model=_model_name(model), prompt_chars=len(prompt),
+           first_token_ms=(first_token or 0.0) * 1000)
+    if cache is not None:
+        cache.put(prompt, _model_name(model), ''.join(parts))
+        cache.record(False, time.perf_counter() - start)
+
+async def _agenerate_text(model, prompt, stats=None):
+    """async 版 _generate_text：模型提供 agenerate (例如 LLMClient) 時直接在事件迴圈上等待，否則在執行緒中呼叫"""
+    cache = get_response_cache()
+    start = time.perf_counter()
+    if cache is not None:
+        cached = cache.get(prompt, _model_name(model))
+        if cached is not None:
+            cache.record(True, time.perf_counter() - start)
+            _count(stats, 'llm_cache_hits')
+            return cached
+
+    _count(stats, 'llm_requests')
+    with span('llm.generate', model=_model_name(model), prompt_chars=len(prompt)):
+        if hasattr(model, 'agenerate'):
+            text = await model.agenerate(prompt)
+        else:
+            text = (await asyncio.to_thread(model.generate_content, prompt)).text
+    if cache is not None:
+        cache.put(prompt, _model_name(model), text)
+        cache.record(False, time.perf_counter() - start)
+    return text
+
+# --- News Retrieval (concurrent + TTL cache) ---
+NEWS_CACHE_TTL_SECONDS = 900   # 同一 ticker 的新聞在此時間窗內只抓取一次
+NEWS_MAX_WORKERS = 8           # 同時進行的新聞請求上限
+NEWS_FETCH_TIMEOUT = 10        # 單一 ticker 的等待上限 (秒)
+
+# [擴充版] 產業名稱到代表性ETF的對照表
+INDUSTRY_ETF_MAP = {
+    "半導體業": "00891.TW",          # 中信關鍵半導體
+    "金融保險業": "0055.TW",          # 元大MSCI金融
+    "電腦及週邊設備業": "00929.TW",  # 復華台灣科技優息
+    "通信網路業": "00881.TW",          # 國泰台灣5G+
+    "航運業": "2603.TW",               # 以長榮作為航運業新聞代理
+    "生技醫療業": "00692.TW",          # 富邦臺灣生技
+    "其他電子業": "00929.TW",          # 範疇較廣，同樣用科技ETF代替
+    "文化創意業": "0050.TW"             # 無直接對應ETF，使用大盤作為代理
+}
+NEWS_THRESHOLD = 2 # 設定新聞數量的門檻值 (少於2條則觸發降級)
+MARKET_NEWS_TICKER = "0050.TW"
+
+_news_executor = ThreadPoolExecutor(max_workers=NEWS_MAX_WORKERS, thread_name_prefix='news')
+_news_cache = {}
+_news_cache_lock = threading.Lock()
+
+def yfinance_news_provider(ticker):
+    """預設的新聞來源：回傳 yfinance 的新聞列表"""
+    import yfinance as yf
+    return yf.Ticker(ticker).news or []
+
+def clear_news_cache():
+    with _news_cache_lock:
+        _news_cache.clear()
+
+def fetch_news(tickers, news_provider=None, ttl=NEWS_CACHE_TTL_SECONDS, timeout=NEWS_FETCH_TIMEOUT, stats=None):
+    """
+    併發抓取多個 ticker 的新聞，回傳 {ticker: 新聞列表 或 Exception}。
+    結果依 (news_provider, ticker) 快取 ttl 秒；失敗與逾時不會被快取。
+    news_provider 為 ticker -> list 的函式，預設為 yfinance，測試時可替換為本地假資料來源。
+    若提供 stats (dict)，會累加 'news_requests' (實際對外請求數) 與 'news_cache_hits'。
+    """
+    news_provider = news_provider or yfinance_news_provider
+    now = time.monotonic()
+    results, pending = {}, {}
+
+    with _news_cache_lock:
+        for ticker in dict.fromkeys(tickers):
+            cached = _news_cache.get((news_provider, ticker))
+            if cached is not None and cached[0] > now:
+                results[ticker] = cached[1]
+            else:
+                pending[ticker] = None
+
+    if stats is not None:
+        stats['news_requests'] = stats.get('news_requests', 0) + len(pending)
+        stats['news_cache_hits'] = stats.get('news_cache_hits', 0) + len(results)
+    count('news_requests', len(pending))
+    count('news_cache_hits', len(results))
+    if not pending:
+        return results
+
+    with span('news.fetch', requests=len(pending)) as fetch_span:
+        for ticker in pending:
+            pending[ticker] = _news_executor.submit(news_provider, ticker)
+
+        deadline = time.monotonic() + timeout
+        for ticker, future in pending.items():
+            try:
+                news = future.result(timeout=max(0.0, deadline - time.monotonic()))
+            except FutureTimeoutError:
+                future.cancel()
+                results[ticker] = TimeoutError(f"fetching news for {ticker} exceeded {timeout}s")
+                continue
+            except Exception as e:
+                results[ticker] = e
+                continue
+            results[ticker] = news
+            with _news_cache_lock:
+                _news_cache[(news_provider, ticker)] = (time.monotonic() + ttl, news)
+        fetch_span['attrs']['failures'] = sum(isinstance(results[ticker], Exception) for ticker in pending)
+    return results
+
+def _titled(news):
+    return [item for item in news if 'title' in item]
 
 # --- yfinance News Summary Function ---
-def get_yfinance_news_summary(portfolio_df, master_df):
+def _holding_news(stock_ids, master_df, news_provider=None, stats=None):
     """
-    完全使用 yfinance 獲取新聞摘要，並具備兩層備用方案：
-    1. 個股 -> 產業ETF
-    2. 如果最終無新聞 -> 整體市場ETF (0050)
+    逐檔取得個股的新聞摘錄，回傳 {StockID: [摘錄行]}：
+    新聞不足 NEWS_THRESHOLD 篇的個股降級為其產業ETF的新聞。每一層的請求皆併發送出，並共用 fetch_news 的 TTL 快取。
     """
-    # [擴充版] 產業名稱到代表性ETF的對照表
-    INDUSTRY_ETF_MAP = {
-        "半導體業": "00891.TW",          # 中信關鍵半導體
-        "金融保險業": "0055.TW",          # 元大MSCI金融
-        "電腦及週邊設備業": "00929.TW",  # 復華台灣科技優息
-        "通信網路業": "00881.TW",          # 國泰台灣5G+
-        "航運業": "2603.TW",               # 以長榮作為航運業新聞代理
-        "生技醫療業": "00692.TW",          # 富邦臺灣生技
-        "其他電子業": "00929.TW",          # 範疇較廣，同樣用科技ETF代替
-        "文化創意業": "0050.TW"             # 無直接對應ETF，使用大盤作為代理
-    }
-    NEWS_THRESHOLD = 2 # 設定新聞數量的門檻值 (少於2條則觸發降級)
-    all_news_extracts = []
-    
-    stock_tickers = {sid: master_df.loc[sid, '名稱'] 
-                     for sid in portfolio_df.index 
-                     if portfolio_df.loc[sid, 'AssetType'] == '個股'}
+    extracts = {sid: [] for sid in stock_ids}
+    if not extracts:
+        return extracts
 
-    if not stock_tickers:
-        return "本次投資組合未包含個股，無特定標的近期資訊。"
+    # 優先策略: yfinance 併發抓取所有個股新聞
+    print(f"Fetching yfinance news for {len(extracts)} stocks...")
+    stock_news = fetch_news([f"{ticker_id}.TW" for ticker_id in extracts], news_provider, stats=stats)
 
-    for ticker_id, stock_name in stock_tickers.items():
-        news_found_for_stock = False
-        try:
-            # 優先策略: yfinance 抓取個股新聞
-            print(f"Fetching yfinance news for {ticker_id}.TW ({stock_name})...")
-            ticker_obj = yf.Ticker(f"{ticker_id}.TW")
-            news = ticker_obj.news
-            news_with_titles = [item for item in news if 'title' in item]
-            
-            if len(news_with_titles) >= NEWS_THRESHOLD:
-                print(f"  -> Found {len(news_with_titles)} valid articles. Using stock-specific news.")
-                formatted_news = [f"- (個股新聞) **{stock_name}**: {item['title']}" for item in news_with_titles[:2]]
-                all_news_extracts.extend(formatted_news)
-                news_found_for_stock = True
-
-            # 備用策略: 降級為抓取產業ETF新聞
-            if not news_found_for_stock:
-                print(f"  -> Found only {len(news_with_titles)} valid articles. Falling back to industry ETF news.")
-                industry = master_df.loc[ticker_id, 'Industry']
-                
-                if pd.notna(industry) and industry in INDUSTRY_ETF_MAP:
-                    etf_ticker = INDUSTRY_ETF_MAP[industry]
-                    print(f"  -> Industry '{industry}' maps to ETF {etf_ticker}. Fetching news...")
-                    etf_obj = yf.Ticker(etf_ticker)
-                    etf_news = etf_obj.news
-                    etf_news_with_titles = [item for item in etf_news if 'title' in item]
-
-                    if etf_news_with_titles:
-                        formatted_news = [f"- (產業新聞) **{industry}**: {item['title']}" for item in etf_news_with_titles[:2]]
-                        all_news_extracts.extend(formatted_news)
-                else:
-                    print(f"  -> No representative ETF found for industry: '{industry}'.")
-                    if news_with_titles:
-                        formatted_news = [f"- (個股新聞) **{stock_name}**: {item['title']}" for item in news_with_titles[:1]]
-                        all_news_extracts.extend(formatted_news)
+    fallbacks = []
+    for ticker_id in extracts:
+        stock_name = master_df.loc[ticker_id, '名稱']
+        news = stock_news[f"{ticker_id}.TW"]
+        if isinstance(news, Exception):
+            print(f"Error fetching yfinance news for {ticker_id}: {news}")
+            continue
+        news_with_titles = _titled(news)
 
-        except Exception as e:
-            print(f"Error fetching yfinance news for {ticker_id}: {e}")
+        if len(news_with_titles) >= NEWS_THRESHOLD:
+            print(f"  -> {ticker_id}: found {len(news_with_titles)} valid articles. Using stock-specific news.")
+            extracts[ticker_id].extend(f"- (個股新聞) **{stock_name}**: {item['title']}" for item in news_with_titles[:2])
             continue
 
+        # 備用策略: 降級為抓取產業ETF新聞
+        industry = master_df.loc[ticker_id, 'Industry']
+        if pd.notna(industry) and industry in INDUSTRY_ETF_MAP:
+            print(f"  -> {ticker_id}: found only {len(news_with_titles)} valid articles. Falling back to {INDUSTRY_ETF_MAP[industry]} ({industry}).")
+            fallbacks.append((ticker_id, industry))
+        else:
+            print(f"  -> No representative ETF found for industry: '{industry}'.")
+            extracts[ticker_id].extend(f"- (個股新聞) **{stock_name}**: {item['title']}" for item in news_with_titles[:1])
+
+    # 同一產業ETF (例如 00929.TW) 只會抓取一次
+    if fallbacks:
+        etf_news = fetch_news([INDUSTRY_ETF_MAP[industry] for _, industry in fallbacks], news_provider, stats=stats)
+        for ticker_id, industry in fallbacks:
+            news = etf_news[INDUSTRY_ETF_MAP[industry]]
+            if isinstance(news, Exception):
+                print(f"Error fetching yfinance news for {ticker_id}: {news}")
+                continue
+            extracts[ticker_id].extend(f"- (產業新聞) **{industry}**: {item['title']}" for item in _titled(news)[:2])
+    return extracts
+
+def _stock_ids(portfolio_df):
+    return [sid for sid in portfolio_df.index if portfolio_df.loc[sid, 'AssetType'] == '個股']
+
+def _summarize_news(holding_news, news_provider=None, stats=None):
+    """把逐檔的新聞摘錄合併為摘要；所有個股皆無新聞時改抓大盤新聞"""
+    if not holding_news:
+        return "本次投資組合未包含個股，無特定標的近期資訊。"
+    all_news_extracts = [line for lines in holding_news.values() for line in lines]
+
     # 最終備用方案：如果遍歷完所有股票後仍然沒有任何新聞，就抓取大盤新聞
     if not all_news_extracts:
-        print("  -> No specific news found. Falling back to broad market news (0050.TW)...")
-        try:
-            market_obj = yf.Ticker("0050.TW")
-            market_news = market_obj.news
-            market_news_with_titles = [item for item in market_news if 'title' in item]
-            if market_news_with_titles:
-                formatted_news = [f"- (整體市場新聞) **台灣50**: {item['title']}" for item in market_news_with_titles[:3]]
-                all_news_extracts.extend(formatted_news)
-        except Exception as e:
-            print(f"Error fetching broad market news: {e}")
+        print(f"  -> No specific news found. Falling back to broad market news ({MARKET_NEWS_TICKER})...")
+        market_news = fetch_news([MARKET_NEWS_TICKER], news_provider, stats=stats)[MARKET_NEWS_TICKER]
+        if isinstance(market_news, Exception):
+            print(f"Error fetching broad market news: {market_news}")
+        else:
+            all_news_extracts.extend(f"- (整體市場新聞) **台灣50**: {item['title']}" for item in _titled(market_news)[:3])
 
     if not all_news_extracts:
         return "未能獲取與您投資組合相關的近期市場新聞。"
@@ -115,29 +305,77 @@ def get_yfinance_news_summary(portfolio_df, master_df):
     final_news_string = "\n".join(sorted(list(set(all_news_extracts))))
     return f"以下是與您投資組合相關的最新市場動態摘要：\n{final_news_string}"
 
-# --- RAG Report Generator ---
-def generate_rag_report(risk_profile, portfolio_type, portfolio_df, master_df, hhi_value):
-    """模組五：RAG文字報告生成器 (整合 yfinance 智慧策略)"""
-    if llm is None:
-        return "AI 模型未成功初始化，無法生成報告。"
+def get_yfinance_news_summary(portfolio_df, master_df, news_provider=None, stats=None):
+    """
+    完全使用 yfinance 獲取新聞摘要，並具備兩層備用方案：
+    1. 個股 -> 產業ETF
+    2. 如果最終無新聞 -> 整體市場ETF (0050)
+    """
+    holding_news = _holding_news(_stock_ids(portfolio_df), master_df, news_provider, stats=stats)
+    return _summarize_news(holding_news, news_provider, stats=stats)
 
-    # 1. 檢索 (Retrieve)
-    # (A) 從本地數據庫檢索詳細數據
-    retrieved_data_str = ""
-    for stock_id, row in portfolio_df.iterrows():
-        detail = master_df.loc[stock_id]
-        retrieved_data_str += f"""
+# --- RAG Retrieval ---
+def _holding_detail(stock_id, master_df):
+    """從本地數據庫檢索單一持股的詳細數據"""
+    detail = master_df.loc[stock_id]
+    return f"""
         - **{detail['名稱']} ({stock_id})**:
           - 類型: {detail['AssetType']}
           - 產業: {detail.get('Industry', 'N/A')}
           - 市值: {detail.get('MarketCap_Billions', 'N/A')} 億
           - Beta: {detail.get('Beta_1Y', 'N/A')}
         """
-    
-    # (B) 從 yfinance 智慧策略中檢索新聞
-    realtime_info_str = get_yfinance_news_summary(portfolio_df, master_df)
-    
-    # 2. 增強 (Augment)
+
+def _holding_details(portfolio_df, master_df):
+    """從本地數據庫檢索每個持股的詳細數據"""
+    return "".join(_holding_detail(stock_id, master_df) for stock_id in portfolio_df.index)
+
+def _new_stats():
+    return {'news_requests': 0, 'news_cache_hits': 0, 'llm_requests': 0, 'llm_cache_hits': 0}
+
+def _assemble_retrieval(portfolio_df, holding_details, holding_news, news_provider, stats):
+    # 依目前組合的持股順序組裝，保留逐檔結果供之後的增量更新使用
+    holding_news = {sid: holding_news[sid] for sid in _stock_ids(portfolio_df)}
+    return {
+        'details': "".join(holding_details[sid] for sid in portfolio_df.index),
+        'news': _summarize_news(holding_news, news_provider, stats=stats),
+        'stats': stats,
+        'holdings': {'details': holding_details, 'news': holding_news},
+    }
+
+@traced('rag.retrieve')
+def retrieve_portfolio_context(portfolio_df, master_df, news_provider=None):
+    """
+    RAG 檢索 (Retrieve)：一次取得持股詳細數據與新聞摘要，回傳可重複使用的檢索包 (retrieval bundle)：
+        {'details': 本地數據, 'news': 新聞摘要, 'stats': 本次建構的外部呼叫次數, 'holdings': 逐檔的數據與新聞}
+    同一個檢索包可同時供 UI 新聞區塊、generate_rag_report 與後續的 get_chat_response 使用。
+    """
+    stats = _new_stats()
+    holding_details = {sid: _holding_detail(sid, master_df) for sid in portfolio_df.index}
+    holding_news = _holding_news(_stock_ids(portfolio_df), master_df, news_provider, stats=stats)
+    return _assemble_retrieval(portfolio_df, holding_details, holding_news, news_provider, stats)
+
+@traced('rag.update')
+def update_portfolio_context(retrieval, portfolio_df, master_df, news_provider=None):
+    """
+    投資組合增量調整後 (rebalance_portfolio) 更新檢索包：只為新加入的持股檢索數據與新聞，
+    移除的持股直接捨棄，其餘沿用 retrieval 中的結果。回傳新的檢索包 (不修改傳入的 retrieval)。
+    """
+    if retrieval is None or 'holdings' not in retrieval:
+        return retrieve_portfolio_context(portfolio_df, master_df, news_provider)
+    stats = _new_stats()
+    previous = retrieval['holdings']
+    holding_details = {sid: previous['details'].get(sid) or _holding_detail(sid, master_df) for sid in portfolio_df.index}
+    new_stocks = [sid for sid in _stock_ids(portfolio_df) if sid not in previous['news']]
+    holding_news = {**previous['news'], **_holding_news(new_stocks, master_df, news_provider, stats=stats)}
+    return _assemble_retrieval(portfolio_df, holding_details, holding_news, news_provider, stats)
+
+# --- RAG Report Generator ---
+def _build_report_prompt(risk_profile, portfolio_df, hhi_value, retrieval):
+    """增強 (Augment)：把檢索包組成報告生成的提示詞"""
+    retrieved_data_str = retrieval['details']
+    realtime_info_str = retrieval['news']
+
     current_date = datetime.now().strftime("%Y年%m月%d日")
     hhi_calculation_str = ' + '.join([f"({w:.2%})²" for w in portfolio_df['Weight']])
 
@@ -174,24 +412,103 @@ def generate_rag_report(risk_profile, portfolio_type, portfolio_df, master_df, h
     請以 Markdown 格式輸出報告。
     """
 
+    return prompt_template
+
+@traced('rag.report')
+def generate_rag_report(risk_profile, portfolio_type, portfolio_df, master_df, hhi_value, retrieval=None, model=None):
+    """
+    模組五：RAG文字報告生成器 (整合 yfinance 智慧策略)
+    retrieval 為 retrieve_portfolio_context 的檢索包；未提供時才自行檢索。
+    model 預設為模組層級的 Gemini 模型，可替換為任何提供 generate_content 的物件 (例如 fake_llm)。
+    """
+    model = model or get_llm()
+    if model is None:
+        return "AI 模型未成功初始化，無法生成報告。"
+
+    # 1. 檢索 (Retrieve)
+    if retrieval is None:
+        retrieval = retrieve_portfolio_context(portfolio_df, master_df)
+    # 2. 增強 (Augment)
+    prompt_template = _build_report_prompt(risk_profile, portfolio_df, hhi_value, retrieval)
+
+    # 3. 生成 (Generate)
     try:
-        response = llm.generate_content(prompt_template)
-        return response.text
+        return _generate_text(model, prompt_template, retrieval['stats'])
     except Exception as e:
         return f"生成 AI 報告時發生錯誤: {e}"
 
+def generate_rag_report_stream(risk_profile, portfolio_type, portfolio_df, master_df, hhi_value, retrieval=None, model=None):
+    """
+    串流版的 generate_rag_report：以 generator 逐段 yield 報告內容，供 st.write_stream 漸進顯示。
+    串流在輸出任何內容前失敗時，自動退回非串流模式；輸出途中失敗則在已輸出內容後附上錯誤訊息。
+    """
+    model = model or get_llm()
+    if model is None:
+        yield "AI 模型未成功初始化，無法生成報告。"
+        return
+
+    if retrieval is None:
+        retrieval = retrieve_portfolio_context(portfolio_df, master_df)
+    prompt_template = _build_report_prompt(risk_profile, portfolio_df, hhi_value, retrieval)
+
+    emitted = False
+    try:
+        for text in _stream_text(model, prompt_template, retrieval['stats']):
+            emitted = True
+            yield text
+    except Exception as e:
+        if emitted:
+            yield f"\n\n生成 AI 報告時發生錯誤: {e}"
+            return
+        print(f"串流生成失敗，改用非串流模式: {e}")
+        try:
+            yield _generate_text(model, prompt_template, retrieval['stats'])
+        except Exception as e:
+            yield f"生成 AI 報告時發生錯誤: {e}"
+
+async def agenerate_rag_report(risk_profile, portfolio_type, portfolio_df, master_df, hhi_value, retrieval=None, model=None,
+                               news_provider=None):
+    """
+    async 版的 generate_rag_report (供 service.py 等事件迴圈使用)：新聞檢索在執行緒中進行，LLM 呼叫在事件迴圈上等待，
+    同一迴圈可同時處理多份報告。回傳 (報告文字, 檢索包)。
+    """
+    model = model or get_llm()
+    if retrieval is None:
+        retrieval = await asyncio.to_thread(retrieve_portfolio_context, portfolio_df, master_df, news_provider)
+    if model is None:
+        return "AI 模型未成功初始化，無法生成報告。", retrieval
+
+    prompt_template = _build_report_prompt(risk_profile, portfolio_df, hhi_value, retrieval)
+    try:
+        return await _agenerate_text(model, prompt_template, retrieval['stats']), retrieval
+    except Exception as e:
+        return f"生成 AI 報告時發生錯誤: {e}", retrieval
+
 # --- Chatbot Responder ---
-def get_chat_response(chat_history, user_query, portfolio_df, master_df):
-    """模組六：互動式AI聊天機器人"""
-    if llm is None:
+@traced('chat.response')
+def get_chat_response(chat_history, user_query, portfolio_df, master_df, retrieval=None, conversation=None):
+    """
+    模組六：互動式AI聊天機器人
+    retrieval 為建構組合時取得的檢索包，提供時會把持股數據與新聞一併放入上下文，不再重新檢索。
+    conversation 為該工作階段的 ConversationContext：只保留最近幾則訊息原文、較舊訊息以快取的摘要代替，
+    投資組合上下文也只渲染一次，讓提示詞大小不隨對話長度線性成長。每輪的大小記錄在 conversation.metrics_log。
+    """
+    model = get_llm()
+    if model is None:
         return "AI 模型未成功初始化，無法回應。"
-    
+
+    conversation = conversation or ConversationContext()
+    conversation.set_portfolio(portfolio_df, retrieval)
+    portfolio_context, summary, recent_history, metrics = conversation.render(chat_history, user_query)
+
     context = f"""
-    This is the current chat history:
-    {chat_history}
+    Summary of earlier conversation:
+    {summary or '(none)'}
 
-    This is the current portfolio on screen:
-    {portfolio_df[['名稱', 'Weight']].to_markdown()}
+    Most recent messages:
+    {recent_history or '(none)'}
+
+    {portfolio_context}
 
     This is the user's latest question:
     "{user_query}"
@@ -214,9 +531,11 @@ def get_chat_response(chat_history, user_query, portfolio_df, master_df):
 
     Please generate your response:
     """
+    metrics = conversation.record(metrics, prompt)
+    print(f"聊天提示詞大小 (第 {metrics['turn']} 輪): {metrics['prompt_tokens']} tokens, "
+          f"視窗 {metrics['messages_in_window']} 則 / 摘要 {metrics['messages_summarized']} 則")
     
     try:
-        response = llm.generate_content(prompt)
-        return response.text
+        return _generate_text(model, prompt, retrieval['stats'] if retrieval is not None else None)
     except Exception as e:
         return f"生成 AI 回應時發生錯誤: {e}"
\ No newline at end of file
@@ -2,16 +2,20 @@
 
 import streamlit as st
 import pandas as pd
-import plotly.express as px
-import re
+import json
 import numpy as np
 
 # 導入自訂模組
 import config
-from data_loader import load_and_preprocess_data
-from investment_analyzer import run_rule_zero, create_stock_pools, create_etf_pools, build_portfolio
+from data_store import DataStore, POOL_VIEWS
+from investment_analyzer import build_portfolio_cached, rebalance_portfolio, set_holding_weight
+from portfolio_analytics import analyze_portfolio
 # ▼▼▼ [修改] 從 ai_helper 導入正確的新函式名稱 ▼▼▼
-from ai_helper import generate_rag_report, get_chat_response, get_yfinance_news_summary
+from ai_helper import generate_rag_report_stream, get_chat_response, retrieve_portfolio_context, update_portfolio_context
+from chat_context import ConversationContext
+from security_lookup import get_security_index, parse_chat_intent
+import instrumentation
+from instrumentation import span
 
 # --- 頁面設定 ---
 st.set_page_config(layout="wide", page_title="AI 個人化投資組合分析")
@@ -25,21 +29,61 @@ if 'report' not in st.session_state:
     st.session_state.report = ""
 if 'news_summary' not in st.session_state:
     st.session_state.news_summary = ""
+if 'retrieval' not in st.session_state:
+    st.session_state.retrieval = None
+if 'report_pending' not in st.session_state:
+    st.session_state.report_pending = False
+if 'conversation' not in st.session_state:
+    st.session_state.conversation = ConversationContext()
 if "messages" not in st.session_state:
     st.session_state.messages = []
 if 'last_inputs' not in st.session_state:
     st.session_state.last_inputs = {}
-if 'data_pools' not in st.session_state:
-    st.session_state.data_pools = {}
+if 'data_version' not in st.session_state:
+    # 只記錄資料版本；標的池由行程共用的 DataStore 提供，不在每個工作階段複製
+    st.session_state.data_version = None
+if 'seed' not in st.session_state:
+    # 每個使用者工作階段固定一個隨機種子，重跑與聊天調整時可重現相同組合並命中快取
+    st.session_state.seed = int(np.random.default_rng().integers(2**31))
 
 
-# --- 數據載入 (加入快取) ---
-@st.cache_data(ttl=3600)
-def load_data():
-    master_df = load_and_preprocess_data()
-    return master_df
+# --- 數據載入 (行程共用、唯讀) ---
+@st.cache_resource
+def get_data_store():
+    return DataStore()
 
-master_df = load_data()
+data_store = get_data_store()
+current_screen = data_store.refresh_if_stale()
+master_df = current_screen.master_df if current_screen is not None else None
+
+def start_analysis(inputs):
+    """以目前的資料版本建構投資組合並檢索持股數據與新聞；報告稍後在 📝 區塊以串流生成"""
+    st.session_state.last_inputs = inputs
+
+    # 規則零與各標的池每個資料版本只計算一次，由所有工作階段共用
+    st.session_state.data_version = current_screen.version
+
+    st.session_state.portfolio, st.session_state.hhi = build_portfolio_cached(
+        master_df, inputs['risk'], inputs['type'], inputs['seed']
+    )
+
+    if not st.session_state.portfolio.empty:
+        # 一次檢索 (持股數據 + 新聞)，同時供新聞區塊、報告與後續聊天使用
+        retrieval = retrieve_portfolio_context(st.session_state.portfolio, master_df)
+        st.session_state.retrieval = retrieval
+        st.session_state.news_summary = retrieval['news']
+
+        # 報告改在 📝 區塊以串流方式生成，使用者可立即看到開頭內容
+        st.session_state.report = ""
+        st.session_state.report_pending = True
+    else:
+        st.session_state.report = ""
+        st.session_state.report_pending = False
+        st.session_state.hhi = 0
+        st.session_state.news_summary = ""
+        st.session_state.retrieval = None
+    st.session_state.messages = []
+    st.session_state.conversation = ConversationContext()
 
 # --- 主應用程式介面 ---
 st.title("🤖 AI 個人化投資組合分析報告")
@@ -51,67 +95,48 @@ with st.sidebar:
     risk_profile = st.selectbox('風險偏好:', ('保守型', '穩健型', '積極型'), index=1)
     portfolio_type = st.selectbox('組合類型:', ('純個股', '純ETF', '混合型'), index=0)
     total_amount = st.number_input('總投資金額 (TWD):', min_value=10000, value=100000, step=10000)
+    show_timings = st.checkbox('⏱️ 顯示效能計時面板', value=False, disabled=not config.INSTRUMENTATION_ENABLED)
 
     if st.button('🚀 開始建構 & AI分析', use_container_width=True, type="primary"):
         if master_df is not None:
-            with st.spinner('AI 引擎正在為您建構組合並撰寫報告...'):
-                st.session_state.last_inputs = {
-                    'risk': risk_profile, 'type': portfolio_type, 'amount': total_amount
-                }
-                
-                df_filtered = run_rule_zero(master_df)
-                df_stocks = df_filtered[df_filtered['AssetType'] == '個股'].copy()
-                df_etf = df_filtered[df_filtered['AssetType'] == 'ETF'].copy()
-                stock_pools = create_stock_pools(df_stocks)
-                etf_pools = create_etf_pools(df_etf)
-                
-                st.session_state.data_pools = {
-                    '篩選前的所有名單': master_df,
-                    '規則零篩選完的名單': df_filtered,
-                    '保守型個股池': stock_pools.get('conservative', pd.DataFrame()),
-                    '穩健型個股池': stock_pools.get('moderate', pd.DataFrame()),
-                    '積極型個股池': stock_pools.get('aggressive', pd.DataFrame()),
-                    '市值型ETF池': etf_pools.get('market_cap', pd.DataFrame()),
-                    '高股息ETF池': etf_pools.get('high_dividend', pd.DataFrame()),
-                    '主題/產業型ETF池': etf_pools.get('theme', pd.DataFrame()),
-                    '公債ETF池': etf_pools.get('gov_bond', pd.DataFrame()),
-                    '投資級公司債ETF池': etf_pools.get('corp_bond', pd.DataFrame())
-                }
-                
-                st.session_state.portfolio, st.session_state.hhi = build_portfolio(
-                    risk_profile, portfolio_type, stock_pools, etf_pools
-                )
-
-                if not st.session_state.portfolio.empty:
-                    # ▼▼▼ [修改] 呼叫正確的新函式名稱 ▼▼▼
-                    st.session_state.news_summary = get_yfinance_news_summary(st.session_state.portfolio, master_df)
-                    
-                    st.session_state.report = generate_rag_report(
-                        risk_profile, 
-                        portfolio_type, 
-                        st.session_state.portfolio, 
-                        master_df, 
-                        st.session_state.hhi
-                    )
-                else:
-                    st.session_state.report = ""
-                    st.session_state.hhi = 0
-                    st.session_state.news_summary = ""
-                st.session_state.messages = []
+            with st.spinner('AI 引擎正在為您建構組合並撰寫報告...'), span('app.build', risk=risk_profile, type=portfolio_type):
+                start_analysis({
+                    'risk': risk_profile, 'type': portfolio_type, 'amount': total_amount,
+                    'seed': st.session_state.seed
+                })
         else:
             st.error("數據載入失敗，無法執行分析。")
 
 # --- 結果展示區 ---
 if not st.session_state.portfolio.empty:
+    # plotly 只在有結果需要繪圖時才載入，縮短新工作行程的首次渲染時間
+    import plotly.express as px
+
     portfolio_with_amount = st.session_state.portfolio.copy()
     portfolio_with_amount['Investment_Amount'] = portfolio_with_amount['Weight'] * total_amount
     
     st.header("📈 您的個人化投資組合")
 
-    st.metric(
-        label="HHI 集中度指數 (越低越分散)",
-        value=f"{st.session_state.hhi:.4f}"
-    )
+    # 以建構當時的資料版本計算組合指標與曝險 (向量化分析模組，與批次報表共用同一套計算)
+    portfolio_screen = data_store.snapshot(st.session_state.data_version)
+    if portfolio_screen is None:
+        # 建構時的資料版本已被淘汰：以最新資料重新建構，避免組合與指標混用不同版本的資料
+        stale_version = st.session_state.data_version
+        with span('app.build', risk=st.session_state.last_inputs['risk'], type=st.session_state.last_inputs['type']):
+            start_analysis(st.session_state.last_inputs)
+        st.session_state.data_notice = (f"資料已更新 (建構時的版本 {stale_version} 已不再保留)，"
+                                        f"已以最新資料 (版本 {current_screen.version}) 重新建構投資組合與報告。")
+        st.rerun()
+    if st.session_state.get('data_notice'):
+        st.warning(st.session_state.pop('data_notice'))
+    metrics, exposures = analyze_portfolio(st.session_state.portfolio, portfolio_screen.master_df)
+
+    metric_cols = st.columns(5)
+    metric_cols[0].metric(label="HHI 集中度指數 (越低越分散)", value=f"{metrics['HHI']:.4f}")
+    metric_cols[1].metric(label="有效持股數", value=f"{metrics['Effective_N']:.1f}")
+    metric_cols[2].metric(label="加權 Beta", value="N/A" if pd.isna(metrics['Beta']) else f"{metrics['Beta']:.2f}")
+    metric_cols[3].metric(label="加權年化波動率", value="N/A" if pd.isna(metrics['Volatility']) else f"{metrics['Volatility']:.1f}%")
+    metric_cols[4].metric(label="加權現金殖利率", value="N/A" if pd.isna(metrics['Dividend_Yield']) else f"{metrics['Dividend_Yield']:.2f}%")
 
     st.dataframe(portfolio_with_amount[['名稱', 'AssetType', 'Industry', 'Weight', 'Investment_Amount']].style.format({
         'Weight': '{:.2%}', 'Investment_Amount': '{:,.0f} 元'
@@ -123,9 +148,9 @@ if not st.session_state.portfolio.empty:
         st.plotly_chart(fig_pie, use_container_width=True)
     with col2:
         st.subheader("結構分佈")
-        if 'Industry' in portfolio_with_amount.columns:
-            summary_data = portfolio_with_amount.dropna(subset=['Industry'])
-            summary = summary_data.groupby('Industry')['Weight'].sum().reset_index()
+        industry_exposure = exposures.get('Industry')
+        if industry_exposure is not None and not industry_exposure.empty:
+            summary = industry_exposure.rename('Weight').reset_index()
             fig_bar = px.bar(summary, 
                              x='Industry', 
                              y='Weight', 
@@ -143,7 +168,19 @@ if not st.session_state.portfolio.empty:
             st.info("目前無法獲取相關新聞。")
 
     st.header("📝 AI 深度分析報告")
-    if st.session_state.report:
+    if st.session_state.report_pending:
+        inputs = st.session_state.last_inputs
+        with span('app.report', risk=inputs['risk'], type=inputs['type']):
+            st.session_state.report = st.write_stream(generate_rag_report_stream(
+                inputs['risk'],
+                inputs['type'],
+                st.session_state.portfolio,
+                master_df,
+                st.session_state.hhi,
+                retrieval=st.session_state.retrieval
+            ))
+        st.session_state.report_pending = False
+    elif st.session_state.report:
         st.markdown(st.session_state.report)
     else:
         st.warning("無法生成AI報告。")
@@ -154,11 +191,11 @@ if not st.session_state.portfolio.empty:
     
     with st.expander("點擊展開或收合標的池檢視器", expanded=False):
         # 建立下拉選單 (邏輯不變)
-        pool_options = list(st.session_state.data_pools.keys())
+        pool_options = list(POOL_VIEWS.keys())
         selected_pool_name = st.selectbox("請選擇您想檢視的標的池：", options=pool_options)
 
-        # 根據使用者的選擇，從 session_state 中取出對應的 DataFrame
-        pool_to_display = st.session_state.data_pools.get(selected_pool_name)
+        # 根據使用者的選擇，從共用的 DataStore 取出建構當時資料版本的 DataFrame
+        pool_to_display = data_store.pool(st.session_state.data_version, selected_pool_name)
 
         if pool_to_display is not None and not pool_to_display.empty:
             st.write(f"### {selected_pool_name} ({len(pool_to_display)} 檔標的)")
@@ -206,38 +243,81 @@ if not st.session_state.portfolio.empty:
 
         with st.chat_message("assistant"):
             with st.spinner("AI 正在思考中..."):
-                match = re.search(r"(加入|納入|增加)\s*(\w+)\s*\(?(\d{4,6})\)?", prompt)
-                if match:
-                    stock_name, stock_id = match.group(2), match.group(3)
-                    if master_df is not None and stock_id in master_df.index:
+                # 調整指令 (加入 / 移除 / 調整權重) 先以本地的證券查詢索引解析，不需呼叫 LLM
+                intent = parse_chat_intent(prompt, get_security_index(master_df)) if master_df is not None else None
+                new_portfolio = None
+                if intent is not None and intent.match is None:
+                    suggestions = "、".join(f"{c.name}({c.stock_id})" for c in intent.candidates[:3])
+                    response = f"抱歉，在我的資料庫中找不到「{intent.query}」。您是指 {suggestions} 嗎？"
+                elif intent is not None:
+                    stock_id, stock_name = intent.match.stock_id, intent.match.name
+                    inputs = st.session_state.last_inputs
+                    portfolio = st.session_state.portfolio
+                    held = stock_id in portfolio.index
+                    # 只在既有組合上局部調整權重，並只為新加入的標的檢索數據與新聞
+                    if intent.action == 'add' and held:
+                        response = f"**{stock_name}({stock_id})** 已經在投資組合中了。"
+                    elif intent.action == 'add':
                         st.info(f"偵測到動態調整指令：正在嘗試將 **{stock_name}({stock_id})** 加入組合中...")
-                        stock_to_add = master_df.loc[stock_id]
-                        inputs = st.session_state.last_inputs
-                        
-                        df_filtered = run_rule_zero(master_df)
-                        df_stocks = df_filtered[df_filtered['AssetType'] == '個股'].copy()
-                        df_etf = df_filtered[df_filtered['AssetType'] == 'ETF'].copy()
-                        stock_pools = create_stock_pools(df_stocks)
-                        etf_pools = create_etf_pools(df_etf)
-
-                        new_portfolio, new_hhi = build_portfolio(
-                            inputs['risk'], inputs['type'], stock_pools, etf_pools, forced_include=stock_to_add
-                        )
-                        
+                        new_portfolio, new_hhi = rebalance_portfolio(portfolio, inputs['risk'], inputs['type'],
+                                                                     add=master_df.loc[[stock_id]])
+                    elif intent.action == 'remove' and not held:
+                        response = f"**{stock_name}({stock_id})** 不在目前的投資組合中。"
+                    elif intent.action == 'remove' and len(portfolio) == 1:
+                        response = "投資組合只剩這一檔標的，無法移除。"
+                    elif intent.action == 'remove':
+                        st.info(f"偵測到動態調整指令：正在將 **{stock_name}({stock_id})** 移出組合...")
+                        new_portfolio, new_hhi = rebalance_portfolio(portfolio, inputs['risk'], inputs['type'],
+                                                                     remove=stock_id)
+                    else:
+                        st.info(f"偵測到動態調整指令：正在將 **{stock_name}({stock_id})** 的權重調整為 {intent.weight:.1%}...")
+                        if not held:
+                            portfolio, _ = rebalance_portfolio(portfolio, inputs['risk'], inputs['type'],
+                                                               add=master_df.loc[[stock_id]])
+                        new_portfolio, new_hhi = set_holding_weight(portfolio, stock_id, intent.weight)
+
+                    if new_portfolio is not None:
                         st.session_state.portfolio = new_portfolio
                         st.session_state.hhi = new_hhi
-                        st.session_state.report = generate_rag_report(inputs['risk'], inputs['type'], new_portfolio, master_df, new_hhi)
-                        st.session_state.news_summary = get_tej_news_summary(new_portfolio)
+                        retrieval = update_portfolio_context(st.session_state.retrieval, new_portfolio, master_df)
+                        st.session_state.retrieval = retrieval
+                        st.session_state.news_summary = retrieval['news']
+                        st.session_state.report = ""
+                        st.session_state.report_pending = True
                         st.session_state.messages = []
+                        st.session_state.conversation = ConversationContext()
                         st.success("投資組合已動態調整！頁面將會刷新以顯示最新結果。")
                         st.rerun()
-                    else:
-                        response = f"抱歉，在我的資料庫中找不到股票代碼為 {stock_id} 的資料。"
                 else:
-                    response = get_chat_response(st.session_state.messages, prompt, st.session_state.portfolio, master_df)
+                    response = get_chat_response(st.session_state.messages, prompt, st.session_state.portfolio, master_df,
+                                                 retrieval=st.session_state.retrieval,
+                                                 conversation=st.session_state.conversation)
                 
                 st.markdown(response)
         st.session_state.messages.append({"role": "assistant", "content": response})
 
 else:
-    st.info("請在左側選擇您的偏好，然後點擊按鈕開始分析。")
\ No newline at end of file
+    st.info("請在左側選擇您的偏好，然後點擊按鈕開始分析。")
+
+# --- 效能計時面板 (選用) ---
+if show_timings:
+    st.header("⏱️ 效能計時")
+    st.caption("統計涵蓋本行程所有工作階段；完整紀錄同時寫入 " + (config.INSTRUMENTATION_LOG_PATH or "(未設定記錄檔)"))
+    stages = instrumentation.stage_stats()
+    if stages:
+        st.dataframe(pd.DataFrame.from_dict(stages, orient='index').style.format(
+            {'total_seconds': '{:.3f}', 'mean_ms': '{:.1f}', 'max_ms': '{:.1f}'}))
+    else:
+        st.info("尚無計時紀錄。")
+    counter_values = instrumentation.counters()
+    if counter_values:
+        st.json(counter_values)
+    traces = instrumentation.recent_traces(5)
+    for trace in traces:
+        with st.expander(f"{trace['name']} — {trace['seconds'] * 1000:.0f} ms", expanded=trace is traces[0]):
+            st.dataframe(pd.DataFrame(
+                [{'stage': '\u3000' * depth + name, 'ms': ms, 'attrs': str(attrs) if attrs else ''}
+                 for depth, name, ms, attrs in instrumentation.flatten(trace)]
+            ).style.format({'ms': '{:.1f}'}), hide_index=True)
+    st.download_button("下載計時紀錄 (JSON)", data=json.dumps(instrumentation.snapshot(), ensure_ascii=False, default=str),
+                       file_name="timings.json", mime="application/json")
@@ -0,0 +1,283 @@
+# backtest.py
+# 歷史回測引擎：讀取本機的日頻價格 / 報酬面板 (Parquet 或 CSV)，在每個再平衡日以當時的時點快照
+# (point-in-time snapshot) 重新執行篩選與 build_portfolio，計算報酬、回撤、週轉率與 HHI 的時間序列。
+# 報酬在「日期 × 標的」矩陣上以 NumPy 向量化計算：每個持有期間只對持股欄位做一次 cumprod，不逐日迴圈。
+# 用法：python backtest.py 穩健型 純個股 --prices backtest_data/prices.parquet --frequency M
+
+import argparse
+import os
+import re
+
+import numpy as np
+import pandas as pd
+
+import config
+from data_loader import _parse_source_files
+from investment_analyzer import ScreenIndex, build_portfolio, calculate_hhi
+
+TRADING_DAYS_PER_YEAR = 252
+# 再平衡頻率：每期最後一個交易日收盤時重新建構
+REBALANCE_FREQUENCIES = {'M': '每月', 'Q': '每季', 'Y': '每年'}
+
+# --- 價格面板 ---
+# 長格式：每列一個 (日期, 代號, 數值)；寬格式：第一欄為日期，其餘每欄一個代號。
+# 數值欄為收盤價 (含權息調整) 時會轉為日報酬；報酬率欄位須為小數 (0.01 代表 1%)。
+PRICE_DATE_COLUMNS = ['Date', '日期', '年月日']
+PRICE_ID_COLUMNS = ['StockID', '代號', '證券代碼']
+PRICE_VALUE_COLUMNS = {
+    'Return': 'return', '報酬率': 'return',
+    'Adj_Close': 'price', 'Close': 'price', '調整收盤價': 'price', '收盤價': 'price',
+}
+
+def _read_table(path):
+    if path.endswith('.parquet'):
+        return pd.read_parquet(path)
+    return pd.read_csv(path, dtype=str, thousands=',', na_values=['--', 'NA'])
+
+def load_price_panel(path=None, kind=None):
+    """
+    讀取價格或報酬面板，回傳日報酬的寬格式 DataFrame (DatetimeIndex × StockID，float64，缺值為 NaN)。
+    kind 為 'price' 或 'return'；長格式依數值欄名稱判斷，寬格式未指定時視為價格。
+    """
+    path = path or config.BACKTEST_PRICE_FILE
+    raw = _read_table(path)
+    date_col = next((col for col in PRICE_DATE_COLUMNS if col in raw.columns), raw.columns[0])
+    id_col = next((col for col in PRICE_ID_COLUMNS if col in raw.columns), None)
+    value_col = next((col for col in PRICE_VALUE_COLUMNS if col in raw.columns), None)
+
+    if id_col is not None and value_col is not None:
+        kind = kind or PRICE_VALUE_COLUMNS[value_col]
+        raw[id_col] = raw[id_col].astype(str).str.strip()
+        panel = raw.pivot_table(index=date_col, columns=id_col, values=value_col, aggfunc='last')
+    else:
+        kind = kind or 'price'
+        panel = raw.set_index(date_col)
+        panel.columns = panel.columns.astype(str).str.strip()
+
+    panel.index = pd.to_datetime(panel.index)
+    panel = panel.sort_index()
+    panel = panel[~panel.index.duplicated(keep='last')]
+    panel = panel.apply(pd.to_numeric, errors='coerce').astype(np.float64)
+    if kind == 'price':
+        panel = panel.pct_change(fill_method=None)
+    panel.index.name, panel.columns.name = 'Date', 'StockID'
+    print(f"已載入價格面板: {len(panel)} 個交易日 × {panel.shape[1]} 檔標的 ({panel.index[0]:%Y-%m-%d} ~ {panel.index[-1]:%Y-%m-%d})。")
+    return panel
+
+# --- 時點快照 ---
+# 快照目錄中的每個項目以日期命名 (2020-01-31 或 20200131)：
+# - <日期>.parquet：save_point_in_time_snapshot 寫出的 master_df
+# - <日期>/：當時的三個來源檔 (檔名與 config 相同)，以 data_loader 的解析流程讀入
+_SNAPSHOT_NAME = re.compile(r'^(\d{4})-?(\d{2})-?(\d{2})(\.parquet)?$')
+
+def list_snapshots(snapshot_dir=None):
+    """回傳依日期排序的 Series：快照日期 -> 路徑"""
+    snapshot_dir = snapshot_dir or config.BACKTEST_SNAPSHOT_DIR
+    if not os.path.isdir(snapshot_dir):
+        return pd.Series(dtype=object)
+    entries = {}
+    for name in os.listdir(snapshot_dir):
+        match = _SNAPSHOT_NAME.match(name)
+        path = os.path.join(snapshot_dir, name)
+        if match and (match.group(4) or os.path.isdir(path)):
+            entries[pd.Timestamp(f"{match.group(1)}-{match.group(2)}-{match.group(3)}")] = path
+    return pd.Series(entries, dtype=object).sort_index()
+
+def load_point_in_time_snapshot(path):
+    """讀入單一時點快照為 master_df"""
+    if os.path.isdir(path):
+        master_df = _parse_source_files(*(os.path.join(path, os.path.basename(name)) for name in
+                                          [config.ETF_FILE, config.LISTED_STOCK_FILE, config.OTC_STOCK_FILE]))
+    else:
+        master_df = pd.read_parquet(path).set_index('StockID', drop=False)
+    master_df.attrs['data_version'] = f"pit-{os.path.basename(path)}"
+    return master_df
+
+def save_point_in_time_snapshot(master_df, as_of=None, snapshot_dir=None):
+    """把目前的 master_df 存為 as_of (預設今天) 的時點快照，供日後回測使用"""
+    snapshot_dir = snapshot_dir or config.BACKTEST_SNAPSHOT_DIR
+    os.makedirs(snapshot_dir, exist_ok=True)
+    path = os.path.join(snapshot_dir, f"{pd.Timestamp(as_of or 'today'):%Y-%m-%d}.parquet")
+    master_df.reset_index(drop=True).to_parquet(path, index=False)
+    return path
+
+# --- 回測核心 ---
+def rebalance_positions(dates, frequency='M'):
+    """再平衡日在 dates 中的位置：第一個交易日，以及每期最後一個交易日 (不含面板的最後一天)"""
+    periods = dates.to_period(frequency)
+    period_ends = np.flatnonzero(periods[1:] != periods[:-1])
+    return np.unique(np.concatenate([[0], period_ends]))
+
+def simulate(returns, weights, positions, cost_bps=0.0):
+    """
+    向量化的投資組合模擬。
+    returns 為 (T × N) 日報酬矩陣 (NaN 視為 0，例如停牌)；weights 為 (K × N) 目標權重，
+    第 k 列在第 positions[k] 天收盤時建立，持有至下一個再平衡日；權重總和不足 1 的部分為現金 (報酬 0)。
+    回傳 {'returns': 日報酬 (T,), 'hhi': 每日漂移後持股的 HHI (T,), 'turnover': 各再平衡日的單邊週轉率 (K,),
+          'cost': 各再平衡日扣除的交易成本 (K,)}。
+    """
+    returns = np.asarray(returns, dtype=np.float64)
+    weights = np.asarray(weights, dtype=np.float64)
+    n_days = returns.shape[0]
+    daily_returns = np.zeros(n_days)
+    daily_hhi = np.full(n_days, np.nan)
+    turnover = np.zeros(len(positions))
+    cost = np.zeros(len(positions))
+    drifted = np.zeros(returns.shape[1])
+    ends = np.append(positions[1:], n_days - 1)
+
+    for k, (start, end) in enumerate(zip(positions, ends)):
+        target = weights[k]
+        # 單邊週轉率 = 買賣金額總和 / 2 (現金也視為一個部位，因此初次建倉為 1)
+        traded = np.abs(target - drifted).sum()
+        turnover[k] = (traded + abs(drifted.sum() - target.sum())) / 2
+        cost[k] = traded * cost_bps / 10000
+        held = np.flatnonzero(target)
+        daily_hhi[start] = np.dot(target, target)
+        if end == start:
+            drifted = target
+            continue
+
+        # 持有期間每檔持股的累積成長 (L × 持股數)；投資組合價值 = 持股價值 + 現金
+        growth = np.cumprod(1 + np.nan_to_num(returns[start + 1:end + 1, held]), axis=0)
+        holdings_value = growth * target[held]
+        value = holdings_value.sum(axis=1) + (1 - target.sum())
+        daily_hhi[start + 1:end + 1] = (holdings_value ** 2).sum(axis=1) / value ** 2
+        drifted = np.zeros_like(target)
+        drifted[held] = holdings_value[-1] / value[-1]
+
+        # 交易成本在建倉當下從淨值扣除，反映在持有期間第一天的報酬
+        daily_returns[start + 1:end + 1] = value / np.concatenate([[1.0], value[:-1]]) - 1
+        daily_returns[start + 1] = (1 + daily_returns[start + 1]) * (1 - cost[k]) - 1
+    return {'returns': daily_returns, 'hhi': daily_hhi, 'turnover': turnover, 'cost': cost}
+
+
+class BacktestResult:
+    """
+    回測結果：
+    - daily：每日的 Return、NAV、Drawdown、HHI (漂移後的持股集中度)
+    - rebalances：每個再平衡日的 Snapshot、Holdings、HHI (目標權重)、Turnover、Cost、Missing_Weight
+    - weights：再平衡日 × StockID 的目標權重
+    """
+
+    def __init__(self, daily, rebalances, weights, risk_profile, portfolio_type):
+        self.daily = daily
+        self.rebalances = rebalances
+        self.weights = weights
+        self.risk_profile = risk_profile
+        self.portfolio_type = portfolio_type
+
+    def summary(self):
+        """整體績效指標 (日報酬不含第一個建倉日)"""
+        returns = self.daily['Return'].iloc[1:]
+        nav = self.daily['NAV']
+        years = len(returns) / TRADING_DAYS_PER_YEAR
+        total_return = nav.iloc[-1] - 1
+        volatility = returns.std() * np.sqrt(TRADING_DAYS_PER_YEAR)
+        turnover = self.rebalances['Turnover'].iloc[1:]
+        return {
+            'Start': self.daily.index[0], 'End': self.daily.index[-1],
+            'Total_Return': float(total_return),
+            'CAGR': float((1 + total_return) ** (1 / years) - 1) if years > 0 and total_return > -1 else np.nan,
+            'Volatility': float(volatility),
+            'Sharpe': float(returns.mean() * TRADING_DAYS_PER_YEAR / volatility) if volatility > 0 else np.nan,
+            'Max_Drawdown': float(self.daily['Drawdown'].min()),
+            'Rebalances': len(self.rebalances),
+            'Avg_Turnover': float(turnover.mean()) if len(turnover) else 0.0,
+            'Annual_Turnover': float(turnover.sum() / years) if years > 0 else np.nan,
+            'Avg_HHI': float(self.daily['HHI'].mean()),
+            'Avg_Holdings': float(self.rebalances['Holdings'].mean()),
+        }
+
+
+def _default_builder(screen, risk_profile, portfolio_type, seed):
+    portfolio_df, _ = build_portfolio(risk_profile, portfolio_type, screen.stock_pools, screen.etf_pools, seed=seed)
+    return portfolio_df
+
+def run_backtest(returns, risk_profile, portfolio_type, snapshots=None, master_df=None, frequency='M',
+                 seed=0, cost_bps=None, start=None, end=None, builder=None, screen=None):
+    """
+    在 returns (load_price_panel 的結果) 上回測一種風險偏好 × 投資組合類型。
+    - snapshots：list_snapshots 的結果 (日期 -> 路徑)；每個再平衡日使用不晚於該日的最新快照
+    - master_df / screen：沒有快照時所有再平衡日都使用這份資料 (或已建立的 ScreenIndex)；
+      會有前視偏誤，僅供規則的快速比較
+    - builder：自訂建構函式 builder(screen, risk_profile, portfolio_type, seed) -> portfolio_df，預設為 build_portfolio
+    每個快照只建立一次 ScreenIndex 與投資組合；第一個快照之前的日期不納入回測。
+    """
+    cost_bps = config.BACKTEST_COST_BPS if cost_bps is None else cost_bps
+    builder = builder or _default_builder
+    snapshots = list_snapshots() if snapshots is None else snapshots
+    if len(snapshots) == 0 and master_df is None and screen is None:
+        raise ValueError("沒有可用的時點快照，也未提供 master_df")
+
+    returns = returns.loc[start:end]
+    if len(snapshots):
+        returns = returns.loc[snapshots.index[0]:]
+    if returns.empty:
+        raise ValueError("回測期間沒有價格資料")
+    dates = returns.index
+    positions = rebalance_positions(dates, frequency)
+
+    weights = np.zeros((len(positions), returns.shape[1]))
+    log = []
+    screen_path = None
+    for k, position in enumerate(positions):
+        as_of = dates[position]
+        path = snapshots.iloc[snapshots.index.searchsorted(as_of, side='right') - 1] if len(snapshots) else 'master_df'
+        if path != screen_path:
+            # 建構結果只取決於快照與 seed：同一快照期間的再平衡日沿用相同的目標權重
+            if len(snapshots):
+                screen = ScreenIndex(load_point_in_time_snapshot(path))
+            elif screen is None:
+                screen = ScreenIndex(master_df)
+            portfolio_df, screen_path = builder(screen, risk_profile, portfolio_type, seed), path
+            target, missing_weight = np.zeros(returns.shape[1]), 0.0
+            if not portfolio_df.empty:
+                columns = returns.columns.get_indexer(portfolio_df.index)
+                found = columns >= 0
+                portfolio_weights = portfolio_df['Weight'].to_numpy(dtype=np.float64)
+                # 價格面板中沒有的持股視為現金
+                missing_weight = float(portfolio_weights[~found].sum())
+                target[columns[found]] = portfolio_weights[found]
+            entry = {'Snapshot': os.path.basename(screen_path), 'Holdings': len(portfolio_df),
+                     'HHI': float(calculate_hhi(portfolio_weights)) if not portfolio_df.empty else 0.0,
+                     'Missing_Weight': missing_weight}
+
+        weights[k] = target
+        log.append({'Date': as_of, **entry})
+
+    result = simulate(returns.to_numpy(), weights, positions, cost_bps)
+    nav = np.cumprod(1 + result['returns'])
+    daily = pd.DataFrame({'Return': result['returns'], 'NAV': nav, 'Drawdown': nav / np.maximum.accumulate(nav) - 1,
+                          'HHI': result['hhi']}, index=dates)
+    rebalances = pd.DataFrame(log).set_index('Date')
+    rebalances['Turnover'] = result['turnover']
+    rebalances['Cost'] = result['cost']
+    held = weights.any(axis=0)
+    weights_df = pd.DataFrame(weights[:, held], index=rebalances.index, columns=returns.columns[held])
+    return BacktestResult(daily, rebalances, weights_df, risk_profile, portfolio_type)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='投資組合規則的歷史回測')
+    parser.add_argument('risk', choices=['保守型', '穩健型', '積極型'])
+    parser.add_argument('type', choices=['純個股', '純ETF', '混合型'])
+    parser.add_argument('--prices', default=config.BACKTEST_PRICE_FILE, help='價格或報酬面板 (Parquet / CSV)')
+    parser.add_argument('--snapshots', default=config.BACKTEST_SNAPSHOT_DIR, help='時點快照目錄')
+    parser.add_argument('--frequency', default=config.BACKTEST_FREQUENCY, choices=sorted(REBALANCE_FREQUENCIES))
+    parser.add_argument('--cost-bps', type=float, default=config.BACKTEST_COST_BPS, help='每單位交易金額的成本 (bps)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--start')
+    parser.add_argument('--end')
+    args = parser.parse_args()
+
+    snapshots = list_snapshots(args.snapshots)
+    master_df = None
+    if len(snapshots) == 0:
+        from data_loader import load_and_preprocess_data
+        master_df = load_and_preprocess_data()
+        print("警告：未提供時點快照，所有再平衡日皆使用目前的 master_df，結果含前視偏誤。")
+    result = run_backtest(load_price_panel(args.prices), args.risk, args.type, snapshots=snapshots, master_df=master_df,
+                          frequency=args.frequency, seed=args.seed, cost_bps=args.cost_bps, start=args.start, end=args.end)
+    for name, value in result.summary().items():
+        print(f"{name:>16}: {value:.4f}" if isinstance(value, float) else f"{name:>16}: {value}")
@@ -0,0 +1,768 @@
+# benchmarks.py
+# 效能基準量測腳本：python benchmarks.py load --scale 100
+# 回歸基準套件：python benchmarks.py suite --scales 1,10,100 [--save-baseline | --check]
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+import config
+import data_loader
+import investment_analyzer
+import portfolio_analytics
+from weight_optimizer import WeightOptimizer
+
+# --- 量測工具 ---
+def measure(func, *args, repeat=3, **kwargs):
+    """
+    執行 func 數次，回傳 (最佳耗時秒數, 峰值記憶體 MB, 回傳值)。
+    計時與記憶體分開量測，避免 tracemalloc 的追蹤成本灌水耗時。
+    """
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args, **kwargs)
+        best = min(best, time.perf_counter() - start)
+    tracemalloc.start()
+    result = func(*args, **kwargs)
+    peak = tracemalloc.get_traced_memory()[1] / 1024 ** 2
+    tracemalloc.stop()
+    return best, peak, result
+
+def print_table(rows):
+    print(pd.DataFrame(rows).to_string(index=False, float_format=lambda v: f"{v:,.4f}"))
+
+# --- 合成複本 ---
+def make_replica(factor, out_dir):
+    """
+    將三個來源檔的列複製 factor 倍 (代號加上序號避免被去重)，原樣保留 "1,763" 與 '--' 等字串格式。
+    回傳 (etf_file, listed_file, otc_file)。
+    """
+    paths = []
+    sources = [
+        (config.ETF_FILE, '代碼.y', lambda p: pd.read_excel(p, dtype=str, keep_default_na=False)),
+        (config.LISTED_STOCK_FILE, '代號', lambda p: pd.read_csv(p, dtype=str, keep_default_na=False)),
+        (config.OTC_STOCK_FILE, '代號', lambda p: pd.read_csv(p, dtype=str, keep_default_na=False)),
+    ]
+    for path, id_col, reader in sources:
+        df = reader(path)
+        copies = []
+        for i in range(factor):
+            copy = df.copy()
+            if i > 0:
+                copy[id_col] = copy[id_col] + f"R{i}"
+            copies.append(copy)
+        replica = pd.concat(copies, ignore_index=True)
+        out_path = os.path.join(out_dir, f"x{factor}_{os.path.basename(path)}")
+        if out_path.endswith('.xlsx'):
+            replica.to_excel(out_path, index=False)
+        else:
+            replica.to_csv(out_path, index=False)
+        paths.append(out_path)
+    return tuple(paths)
+
+# --- 數據載入 ---
+def legacy_parse_source_files(etf_file, listed_file, otc_file):
+    """重構前的載入流程 (rename → 重複欄位 bfill 合併 → 逐欄 clean_numeric_column)，作為比較基準"""
+    df_etf = pd.read_excel(etf_file)
+    df_listed = pd.read_csv(listed_file)
+    df_otc = pd.read_csv(otc_file)
+    df_etf = df_etf.rename(columns={'代碼.y': 'StockID', '名稱.y': '名稱'}).drop(columns=['代碼.x', '名稱.x'], errors='ignore')
+    df_etf['AssetType'] = 'ETF'
+    df_stocks = pd.concat([df_listed, df_otc], ignore_index=True).rename(columns={'代號': 'StockID'})
+    df_stocks['AssetType'] = '個股'
+    master_df = pd.concat([df_etf, df_stocks], ignore_index=True)
+    master_df['StockID'] = master_df['StockID'].astype(str).str.strip()
+    master_df = master_df.drop_duplicates(subset='StockID', keep='first')
+    master_df = master_df.rename(columns=data_loader.column_mapping)
+    for col_name in master_df.columns[master_df.columns.duplicated(keep=False)].unique():
+        merged_series = master_df[col_name].bfill(axis=1).iloc[:, 0]
+        master_df = master_df.drop(columns=col_name)
+        master_df[col_name] = merged_series
+    for col in data_loader.numeric_cols:
+        if col in master_df.columns:
+            master_df[col] = data_loader.clean_numeric_column(master_df[col])
+    return master_df.set_index('StockID', drop=False)
+
+def bench_load(scale=100, repeat=3):
+    """比較舊版逐欄清洗與綱要驅動單次解析的耗時與峰值記憶體 (原始檔與 scale 倍合成複本)"""
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        datasets = [('bundled x1', (config.ETF_FILE, config.LISTED_STOCK_FILE, config.OTC_STOCK_FILE))]
+        if scale > 1:
+            print(f"正在產生 {scale} 倍合成複本...")
+            datasets.append((f"replica x{scale}", make_replica(scale, tmp_dir)))
+
+        for label, files in datasets:
+            for name, func in [('legacy', legacy_parse_source_files), ('schema', data_loader._parse_source_files)]:
+                seconds, peak_mb, df = measure(func, *files, repeat=repeat)
+                rows.append({'dataset': label, 'loader': name, 'rows': len(df), 'seconds': seconds, 'peak_mb': peak_mb})
+    print_table(rows)
+    return rows
+
+def scale_master_df(master_df, factor):
+    """在記憶體中將 master_df 複製 factor 倍 (StockID 加上序號)，並給予新的資料版本"""
+    if factor <= 1:
+        return master_df
+    copies = []
+    for i in range(factor):
+        copy = master_df.copy()
+        if i > 0:
+            copy['StockID'] = copy['StockID'] + f"R{i}"
+        copies.append(copy)
+    scaled = pd.concat(copies, ignore_index=True).set_index('StockID', drop=False)
+    scaled.attrs['data_version'] = f"{master_df.attrs.get('data_version')}x{factor}"
+    return scaled
+
+# --- 篩選 ---
+def legacy_screen(master_df):
+    """每次請求都重新執行規則零與建池 (重構前 app.py 的流程)"""
+    df_filtered = investment_analyzer.run_rule_zero(master_df)
+    df_stocks = df_filtered[df_filtered['AssetType'] == '個股'].copy()
+    df_etf = df_filtered[df_filtered['AssetType'] == 'ETF'].copy()
+    return investment_analyzer.create_stock_pools(df_stocks), investment_analyzer.create_etf_pools(df_etf)
+
+def indexed_screen(master_df):
+    screen = investment_analyzer.get_screen_index(master_df)
+    return screen.stock_pools, screen.etf_pools
+
+def bench_screen(scale=100, repeat=3):
+    """比較每次重新篩選與 ScreenIndex 快取取用的單次請求延遲，觀察是否隨標的總數成長"""
+    master_df = data_loader.load_and_preprocess_data()
+    rows = []
+    for factor in sorted({1, 10, scale}):
+        df = scale_master_df(master_df, factor)
+        build_seconds, _, _ = measure(investment_analyzer.ScreenIndex, df, repeat=1)
+        investment_analyzer.get_screen_index(df)  # 預熱
+        for name, func in [('legacy', legacy_screen), ('indexed', indexed_screen)]:
+            seconds, peak_mb, _ = measure(func, df, repeat=repeat)
+            rows.append({'universe': len(df), 'screen': name, 'seconds': seconds, 'peak_mb': peak_mb,
+                         'index_build_seconds': build_seconds})
+    print_table(rows)
+    return rows
+
+# --- 批次建構 ---
+RISK_PROFILES = ['保守型', '穩健型', '積極型']
+PORTFOLIO_TYPES = ['純個股', '純ETF', '混合型']
+
+def make_client_requests(n, seed=0):
+    """產生 n 筆隨機的客戶請求 (風險偏好 × 組合類型 × 金額 × seed)"""
+    rng = np.random.default_rng(seed)
+    return [{'client_id': f"C{i:06d}",
+             'risk': RISK_PROFILES[rng.integers(3)],
+             'type': PORTFOLIO_TYPES[rng.integers(3)],
+             'amount': int(rng.integers(1, 100)) * 10000,
+             'seed': i}
+            for i in range(n)]
+
+def bench_batch(scale=100, repeat=3):
+    """批次建構吞吐量 (requests/s)：build_portfolios_batch 對比逐筆呼叫 build_portfolio"""
+    master_df = data_loader.load_and_preprocess_data()
+    screen = investment_analyzer.get_screen_index(master_df)
+    stock_pools, etf_pools = screen.stock_pools, screen.etf_pools
+    rows = []
+    for n in sorted({100 * scale, 10000}):
+        client_requests = make_client_requests(n)
+        seconds, peak_mb, result = measure(investment_analyzer.build_portfolios_batch,
+                                           client_requests, stock_pools, etf_pools, repeat=repeat)
+        rows.append({'mode': 'batch', 'requests': n, 'output_rows': len(result), 'seconds': seconds,
+                     'requests_per_sec': n / seconds, 'peak_mb': peak_mb})
+
+    sample = make_client_requests(200)
+    seconds, peak_mb, _ = measure(lambda: [investment_analyzer.build_portfolio(r['risk'], r['type'], stock_pools, etf_pools)
+                                           for r in sample], repeat=1)
+    rows.append({'mode': 'build_portfolio loop', 'requests': len(sample), 'output_rows': None, 'seconds': seconds,
+                 'requests_per_sec': len(sample) / seconds, 'peak_mb': peak_mb})
+    print_table(rows)
+    return rows
+
+# --- 報告生成 ---
+def bench_report_stream(scale=100, repeat=3):
+    """以假模型比較阻塞式與串流式報告的首個輸出時間 (time-to-first-token) 與總耗時"""
+    import ai_helper
+    from fake_llm import FakeGenerativeModel
+
+    master_df = data_loader.load_and_preprocess_data()
+    portfolio_df, hhi_value = investment_analyzer.build_portfolio_cached(master_df, '穩健型', '混合型', seed=0)
+    retrieval = ai_helper.retrieve_portfolio_context(portfolio_df, master_df, news_provider=lambda ticker: [])
+    model = FakeGenerativeModel(text='報告' * 400, first_token_delay=0.2, token_delay=0.002)
+
+    rows = []
+    for mode in ['blocking', 'stream']:
+        first, total = [], []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            if mode == 'blocking':
+                ai_helper.generate_rag_report('穩健型', '混合型', portfolio_df, master_df, hhi_value, retrieval, model=model)
+                first.append(time.perf_counter() - start)
+            else:
+                chunks = ai_helper.generate_rag_report_stream('穩健型', '混合型', portfolio_df, master_df, hhi_value, retrieval, model=model)
+                next(chunks)
+                first.append(time.perf_counter() - start)
+                for _ in chunks:
+                    pass
+            total.append(time.perf_counter() - start)
+        rows.append({'mode': mode, 'first_output_seconds': min(first), 'total_seconds': min(total)})
+    print_table(rows)
+    return rows
+
+# --- 匯入時間 ---
+IMPORT_TARGETS = ['data_loader', 'investment_analyzer', 'ai_helper']
+HEAVY_MODULES = ['google.generativeai', 'yfinance', 'streamlit', 'plotly']
+
+def import_profile(module_name):
+    """
+    以 `python -X importtime` 在全新的子行程中匯入 module_name，
+    回傳 (總累計微秒, {模組: 累計微秒})；與 -X importtime 的輸出欄位相同。
+    """
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module_name}'],
+                          capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    cumulative = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        cumulative[name.strip()] = int(cumulative_us)
+    return cumulative.get(module_name, 0), cumulative
+
+def bench_import(scale=100, repeat=3):
+    """匯入時間回歸基準：各模組的累計匯入時間，以及是否在匯入時就載入了重量級 SDK"""
+    rows = []
+    for module_name in IMPORT_TARGETS:
+        runs = [import_profile(module_name) for _ in range(repeat)]
+        total_us, modules = min(runs, key=lambda run: run[0])
+        eager = [heavy for heavy in HEAVY_MODULES if heavy in modules]
+        rows.append({'module': module_name, 'import_ms': total_us / 1000,
+                     'eager_heavy_imports': ', '.join(eager) or '-'})
+    print_table(rows)
+    return rows
+
+# --- 多工作階段記憶體 ---
+def _legacy_session_state(master_df):
+    """重構前每個工作階段保存的資料：cache_data 回傳的 master_df 副本、規則零結果、個股/ETF 副本與八個標的池"""
+    master_copy = master_df.copy()
+    df_filtered = investment_analyzer.run_rule_zero(master_copy)
+    df_stocks = df_filtered[df_filtered['AssetType'] == '個股'].copy()
+    df_etf = df_filtered[df_filtered['AssetType'] == 'ETF'].copy()
+    return {'master_df': master_copy, 'df_filtered': df_filtered, 'df_stocks': df_stocks, 'df_etf': df_etf,
+            'stock_pools': investment_analyzer.create_stock_pools(df_stocks),
+            'etf_pools': investment_analyzer.create_etf_pools(df_etf)}
+
+def bench_sessions(scale=100, repeat=1):
+    """
+    模擬 N 個同時在線的工作階段，比較各自複製 DataFrame 與共用 DataStore 的記憶體用量。
+    兩者皆不含行程中原本就有的那一份 master_df。
+    """
+    from data_store import DataStore, POOL_VIEWS
+
+    master_df = data_loader.load_and_preprocess_data()
+    rows = []
+    for n_sessions in sorted({1, 10, scale}):
+        tracemalloc.start()
+        sessions = [_legacy_session_state(master_df) for _ in range(n_sessions)]
+        legacy_mb = tracemalloc.get_traced_memory()[0] / 1024 ** 2
+        tracemalloc.stop()
+        del sessions
+
+        tracemalloc.start()
+        store = DataStore(loader=lambda: master_df)
+        screen = store.load()
+        for name in POOL_VIEWS:
+            store.pool(screen.version, name)  # 讓共用的標的池視圖全部實體化
+        sessions = [{'data_version': screen.version, 'seed': i} for i in range(n_sessions)]
+        shared_mb = tracemalloc.get_traced_memory()[0] / 1024 ** 2
+        tracemalloc.stop()
+        del sessions, store, screen
+        investment_analyzer._SCREEN_INDEX_CACHE.clear()
+
+        rows.append({'sessions': n_sessions, 'per_session_copies_mb': legacy_mb, 'shared_store_mb': shared_mb})
+    print_table(rows)
+    return rows
+
+# --- 欄位型態 ---
+def _industry_groupby(master_df):
+    """investment_analyzer 與 app.py 中的產業分組操作 (產業集中度限制、產業權重彙總)"""
+    by_industry = master_df.groupby('Industry', observed=True)
+    return by_industry.head(config.MAX_INDUSTRY_CONCENTRATION), by_industry['MarketCap_Billions'].sum()
+
+def bench_dtypes(scale=100, repeat=3):
+    """比較完整欄位 + object/float64 與精簡綱要 (欄位投影、category、float32) 的記憶體用量與篩選/分組耗時"""
+    files = (config.ETF_FILE, config.LISTED_STOCK_FILE, config.OTC_STOCK_FILE)
+    frames = [('legacy', legacy_parse_source_files(*files)), ('compact', data_loader._parse_source_files(*files))]
+    rows = []
+    for name, master_df in frames:
+        df = scale_master_df(master_df, scale)
+        row = {'schema': name, 'rows': len(df), 'columns': df.shape[1], 'memory_mb': data_loader.frame_memory_mb(df)}
+        row['screen_seconds'] = measure(legacy_screen, df, repeat=repeat)[0]
+        row['groupby_seconds'] = measure(_industry_groupby, df, repeat=repeat)[0]
+        rows.append(row)
+    print_table(rows)
+    return rows
+
+# --- 增量更新 ---
+def _delta_update(previous, delta_df):
+    master_df, changes = data_loader.apply_delta(previous.master_df, delta_df)
+    return investment_analyzer.ScreenIndex.from_changes(previous, master_df, changes)
+
+def _full_rebuild(previous, delta_df):
+    master_df, _ = data_loader.apply_delta(previous.master_df, delta_df)
+    return investment_analyzer.ScreenIndex(master_df)
+
+def bench_delta(scale=100, repeat=3):
+    """比較套用 20 筆增量後，增量重建與完整重建 ScreenIndex 的耗時 (皆含 apply_delta 本身)"""
+    master_df = data_loader.load_and_preprocess_data()
+    rows = []
+    for factor in sorted({1, 10, scale}):
+        previous = investment_analyzer.ScreenIndex(scale_master_df(master_df, factor))
+        sample = previous.master_df.sample(20, random_state=0)
+        deltas = {
+            'price only': sample[['StockID', 'AssetType']].assign(Close=sample['Close'] * 1.01),
+            'volatility': sample[['StockID', 'AssetType']].assign(StdDev_1Y=sample['StdDev_1Y'] * 1.1),
+        }
+        for label, delta_df in deltas.items():
+            full_seconds = measure(_full_rebuild, previous, delta_df, repeat=repeat)[0]
+            delta_seconds, _, screen = measure(_delta_update, previous, delta_df, repeat=repeat)
+            rows.append({'universe': len(previous.master_df), 'delta': label, 'full_seconds': full_seconds,
+                         'delta_seconds': delta_seconds, 'recomputed': ', '.join(screen.recomputed)})
+    print_table(rows)
+    return rows
+
+# --- 投資組合分析 ---
+def per_portfolio_analytics(batch_df, master_df):
+    """逐一投資組合以 pandas 計算 HHI、加權因子與產業曝險 (比較基準)"""
+    results = []
+    for _, portfolio in batch_df.groupby('request_index'):
+        holdings = master_df.loc[portfolio['StockID']]
+        weights = portfolio['Weight'].to_numpy()
+        row = {'HHI': investment_analyzer.calculate_hhi(weights)}
+        for name, col in portfolio_analytics.ANALYTICS_FACTORS.items():
+            values = holdings[col].to_numpy(dtype=float, na_value=np.nan)
+            known = ~np.isnan(values)
+            row[name] = (weights[known] * values[known]).sum() / weights[known].sum() if known.any() else np.nan
+        row['industry'] = pd.Series(weights, index=holdings['Industry'].to_numpy()).groupby(level=0).sum()
+        results.append(row)
+    return results
+
+def bench_analytics(scale=100, repeat=3):
+    """比較逐一投資組合計算與權重矩陣一次計算的耗時 (scale × 100 個投資組合)"""
+    master_df = data_loader.load_and_preprocess_data()
+    screen = investment_analyzer.get_screen_index(master_df)
+    batch_df = investment_analyzer.build_portfolios_batch(make_client_requests(scale * 100), screen.stock_pools, screen.etf_pools)
+    loop_seconds, _, expected = measure(per_portfolio_analytics, batch_df, master_df, repeat=1)
+    matrix_seconds, peak_mb, (summary, _) = measure(portfolio_analytics.analyze_batch, batch_df, master_df, repeat=repeat)
+    max_error = max(float(np.nanmax(np.abs(summary[name].to_numpy() - np.array([row[name] for row in expected]))))
+                    for name in ['HHI'] + list(portfolio_analytics.ANALYTICS_FACTORS))
+    rows = [{'portfolios': len(summary), 'method': 'per-portfolio pandas', 'seconds': loop_seconds, 'peak_mb': None},
+            {'portfolios': len(summary), 'method': 'weight matrix', 'seconds': matrix_seconds, 'peak_mb': peak_mb}]
+    print_table(rows)
+    print(f"兩種方法的最大差異: {max_error:.2e}")
+    return rows
+
+# --- 權重最佳化 ---
+def bench_optimizer(scale=100, repeat=3):
+    """10 檔投資組合的權重最佳化：冷啟動與 warm start (因子分數小幅變動) 的求解時間與迭代次數"""
+    rng = np.random.default_rng(0)
+    groups = rng.integers(0, 5, size=10)
+    rows = []
+    for label, warm in [('cold', False), ('warm', True)]:
+        optimizer = WeightOptimizer()
+        scores = rng.normal(size=10)
+        optimizer.solve(scores, config.HHI_CONSERVATIVE_MAX, config.MIN_POSITION_WEIGHT, config.MAX_POSITION_WEIGHT,
+                        groups, config.MAX_INDUSTRY_WEIGHT, warm_key='bench')
+        seconds, iterations = [], []
+        for _ in range(scale):
+            solver = optimizer if warm else WeightOptimizer()
+            _, info = solver.solve(scores + rng.normal(scale=0.05, size=10), config.HHI_CONSERVATIVE_MAX,
+                                   config.MIN_POSITION_WEIGHT, config.MAX_POSITION_WEIGHT, groups,
+                                   config.MAX_INDUSTRY_WEIGHT, warm_key='bench')
+            seconds.append(info['seconds'])
+            iterations.append(info['iterations'])
+        rows.append({'start': label, 'solves': scale, 'median_ms': float(np.median(seconds)) * 1000,
+                     'p99_ms': float(np.percentile(seconds, 99)) * 1000, 'mean_iterations': float(np.mean(iterations))})
+    print_table(rows)
+    return rows
+
+# --- 增量調整 ---
+def _slow_news(ticker):
+    # 模擬一次新聞 API 的網路延遲
+    time.sleep(0.05)
+    return [{'title': f'{ticker} news {i}'} for i in range(3)]
+
+def bench_rebalance(scale=100, repeat=3):
+    """聊天加入一檔個股：完整重建 (重新建構組合 + 全部重新檢索) 與增量調整 (rebalance + 只檢索新標的) 的耗時"""
+    import ai_helper
+
+    master_df = data_loader.load_and_preprocess_data()
+    screen = investment_analyzer.get_screen_index(master_df)
+    rows = []
+    for risk_profile, portfolio_type in [('穩健型', '純個股'), ('積極型', '混合型')]:
+        portfolio_df, _ = investment_analyzer.build_portfolio(risk_profile, portfolio_type, screen.stock_pools,
+                                                              screen.etf_pools, seed=0)
+        ai_helper.clear_news_cache()
+        retrieval = ai_helper.retrieve_portfolio_context(portfolio_df, master_df, news_provider=_slow_news)
+        candidates = master_df.index[(master_df['AssetType'] == '個股') & ~master_df.index.isin(portfolio_df.index)]
+        stock_id = candidates[0]
+
+        def full_rebuild():
+            ai_helper.clear_news_cache()
+            new_df, _ = investment_analyzer.build_portfolio(risk_profile, portfolio_type, screen.stock_pools,
+                                                            screen.etf_pools, forced_include=master_df.loc[stock_id],
+                                                            seed=0)
+            return ai_helper.retrieve_portfolio_context(new_df, master_df, news_provider=_slow_news)
+
+        def incremental():
+            ai_helper.clear_news_cache()
+            new_df, _ = investment_analyzer.rebalance_portfolio(portfolio_df, risk_profile, portfolio_type,
+                                                               add=master_df.loc[[stock_id]])
+            return ai_helper.update_portfolio_context(retrieval, new_df, master_df, news_provider=_slow_news)
+
+        for method, func in [('full rebuild', full_rebuild), ('incremental', incremental)]:
+            seconds, _, result = measure(func, repeat=repeat)
+            rows.append({'portfolio': f'{risk_profile}/{portfolio_type}', 'method': method, 'seconds': seconds,
+                         'news_requests': result['stats']['news_requests']})
+    print_table(rows)
+    return rows
+
+# --- 回測 ---
+def daily_loop_simulate(returns, weights, positions):
+    """逐日迴圈的參考實作 (不含交易成本)：每天以全部標的更新漂移後的權重"""
+    returns = np.nan_to_num(returns)
+    daily = np.zeros(len(returns))
+    rebalance_at = dict(zip(positions.tolist(), weights))
+    holdings, cash = np.zeros(returns.shape[1]), 1.0
+    for t in range(len(returns)):
+        if t > 0:
+            holdings = holdings * (1 + returns[t])
+            value = holdings.sum() + cash
+            daily[t] = value - 1
+            holdings, cash = holdings / value, cash / value
+        if t in rebalance_at:
+            holdings, cash = rebalance_at[t].copy(), 1 - rebalance_at[t].sum()
+    return daily
+
+def bench_backtest(scale=100, repeat=3):
+    """10 年日頻 (2520 個交易日) × 全部標的的合成報酬面板，每月再平衡：逐日迴圈與向量化模擬的耗時"""
+    import backtest
+
+    master_df = data_loader.load_and_preprocess_data()
+    rng = np.random.default_rng(0)
+    dates = pd.bdate_range('2015-01-01', periods=2520)
+    returns = pd.DataFrame(rng.normal(0.0003, 0.02, size=(len(dates), len(master_df))), index=dates, columns=master_df.index)
+    empty = pd.Series(dtype=object)
+
+    run_seconds, peak_mb, result = measure(backtest.run_backtest, returns, '穩健型', '混合型', snapshots=empty,
+                                           master_df=master_df, repeat=repeat)
+    positions = backtest.rebalance_positions(dates)
+    weights = result.weights.reindex(columns=returns.columns, fill_value=0.0).to_numpy()
+    loop_seconds, _, expected = measure(daily_loop_simulate, returns.to_numpy(), weights, positions, repeat=1)
+    vector_seconds, _, simulated = measure(backtest.simulate, returns.to_numpy(), weights, positions, repeat=repeat)
+    rows = [{'method': 'daily loop simulate', 'seconds': loop_seconds, 'peak_mb': None},
+            {'method': 'vectorized simulate', 'seconds': vector_seconds, 'peak_mb': None},
+            {'method': 'run_backtest (含建構)', 'seconds': run_seconds, 'peak_mb': peak_mb}]
+    print(f"面板: {returns.shape[0]} 日 × {returns.shape[1]} 檔，再平衡 {len(positions)} 次")
+    print_table(rows)
+    print(f"兩種模擬的最大差異: {np.abs(expected - simulated['returns']).max():.2e}")
+    return rows
+
+# --- 參數掃描 ---
+def bench_sweep(scale=100, repeat=1):
+    """scale 組隨機參數 × 9 種組合 (含 3 年日頻回測)：單一行程依序執行與行程池 + 共享記憶體的耗時"""
+    import sweep
+
+    master_df = data_loader.load_and_preprocess_data()
+    rng = np.random.default_rng(0)
+    dates = pd.bdate_range('2020-01-01', periods=750)
+    returns = pd.DataFrame(rng.normal(0.0003, 0.02, size=(len(dates), len(master_df))), index=dates, columns=master_df.index)
+    param_sets = sweep.sample_parameters(sweep.DEFAULT_SWEEP_SPACE, scale, seed=0)
+
+    rows, tables = [], {}
+    for workers in sorted({1, os.cpu_count() or 1, max(2, os.cpu_count() or 1)}):
+        seconds, _, tables[workers] = measure(sweep.run_sweep, param_sets, master_df, returns=returns, workers=workers,
+                                              repeat=repeat)
+        rows.append({'workers': workers, 'param_sets': scale, 'seconds': seconds, 'sets_per_second': scale / seconds})
+    print_table(rows)
+    # 各 worker 數的結果應完全一致 (權重最佳化不依賴求解歷史)
+    numeric = tables[1].select_dtypes('number').columns
+    max_error = max(float(np.nanmax(np.abs(table[numeric].to_numpy() - tables[1][numeric].to_numpy())))
+                    for table in tables.values())
+    print(f"各 worker 數結果的最大差異: {max_error:.2e}")
+    return rows
+
+# --- 證券查詢 ---
+LOOKUP_QUERIES = ['2330', '233', '台積', '台積電', '台泥乙特', '臺灣50', '元大台灣', '鴻', '0098', '美債20正二']
+LOOKUP_PROMPTS = ['如果我想加入台積電會如何？', '請移除鴻海', '把台積電的權重調到 20%', '加入 XYZ公司']
+
+def scan_lookup(master_df, query):
+    """逐列掃描的參考作法：代號或名稱包含查詢字串"""
+    names = master_df['名稱'].astype(str)
+    return master_df.index[master_df.index.str.contains(query, regex=False) | names.str.contains(query, regex=False)]
+
+def bench_lookup(scale=100, repeat=3):
+    """證券查詢：索引建立時間、每次查詢 / 指令解析的平均耗時，並與逐列掃描比較 (每項重複 scale 次)"""
+    import security_lookup
+
+    master_df = data_loader.load_and_preprocess_data()
+    build_seconds, build_mb, index = measure(security_lookup.SecurityIndex, master_df, repeat=repeat)
+    rows = [{'method': 'build index', 'per_call_ms': build_seconds * 1000, 'peak_mb': build_mb}]
+    cases = [
+        ('scan (str.contains)', lambda: [scan_lookup(master_df, q) for q in LOOKUP_QUERIES], len(LOOKUP_QUERIES)),
+        ('index lookup', lambda: [index.lookup(q) for q in LOOKUP_QUERIES], len(LOOKUP_QUERIES)),
+        ('parse chat intent', lambda: [security_lookup.parse_chat_intent(p, index) for p in LOOKUP_PROMPTS],
+         len(LOOKUP_PROMPTS)),
+    ]
+    for method, func, calls in cases:
+        seconds, peak_mb, _ = measure(lambda: [func() for _ in range(scale)], repeat=repeat)
+        rows.append({'method': method, 'per_call_ms': seconds * 1000 / (scale * calls), 'peak_mb': peak_mb})
+    print_table(rows)
+    return rows
+
+# --- 效能量測開銷 ---
+def bench_instrumentation(scale=100, repeat=3):
+    """
+    量測層的開銷：空的 span 每次進出的耗時，以及 build_portfolio 的耗時，比較三種設定：
+    停用量測、啟用但不寫記錄檔、啟用並寫入 JSON Lines 記錄檔 (預設設定，寫到暫存檔)。
+    """
+    import instrumentation
+
+    master_df = data_loader.load_and_preprocess_data()
+    screen = investment_analyzer.get_screen_index(master_df)
+    calls = scale * 100
+    saved = config.INSTRUMENTATION_ENABLED, config.INSTRUMENTATION_LOG_PATH
+    rows = []
+    try:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            log_path = os.path.join(tmp_dir, os.path.basename(saved[1] or 'timings.jsonl'))
+            for mode, enabled, path in [('off', False, None), ('on, no log', True, None), ('on, jsonl log', True, log_path)]:
+                config.INSTRUMENTATION_ENABLED, config.INSTRUMENTATION_LOG_PATH = enabled, path
+
+                def empty_spans():
+                    for _ in range(calls):
+                        with instrumentation.span('bench.empty'):
+                            pass
+
+                def builds():
+                    for seed in range(scale):
+                        investment_analyzer.build_portfolio('穩健型', '混合型', screen.stock_pools, screen.etf_pools, seed=seed)
+
+                span_seconds, _, _ = measure(empty_spans, repeat=repeat)
+                build_seconds, _, _ = measure(builds, repeat=repeat)
+                log_mb = os.path.getsize(path) / 1024 ** 2 if path and os.path.exists(path) else 0.0
+                rows.append({'instrumentation': mode, 'span_us': span_seconds / calls * 1e6,
+                             'build_portfolio_ms': build_seconds / scale * 1000, 'log_mb': log_mb})
+    finally:
+        config.INSTRUMENTATION_ENABLED, config.INSTRUMENTATION_LOG_PATH = saved
+        instrumentation.reset()
+    print_table(rows)
+    return rows
+
+# --- 分批載入 ---
+def bench_chunked(scale=100, repeat=1):
+    """合成 scale × 1000 筆標的 (ETF 檔為 CSV)：一次讀入與分批讀取 (每批 LOAD_CHUNK_ROWS 或 20000 列) 的耗時與峰值記憶體"""
+    import synthetic_data
+
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        print(f"正在產生 {scale * 1000:,} 筆合成標的...")
+        files = synthetic_data.generate_universe(scale * 1000, tmp_dir, etf_csv=True)
+        source_mb = sum(os.path.getsize(path) for path in files) / 1024 ** 2
+        for chunksize in (None, config.LOAD_CHUNK_ROWS or 20000):
+            seconds, peak_mb, df = measure(data_loader._parse_source_files, *files, chunksize=chunksize, repeat=repeat)
+            rows.append({'mode': f'chunks of {chunksize}' if chunksize else 'whole file', 'rows': len(df),
+                         'source_mb': source_mb, 'seconds': seconds, 'peak_mb': peak_mb,
+                         'result_mb': data_loader.frame_memory_mb(df)})
+    print_table(rows)
+    return rows
+
+# --- 回歸基準套件 ---
+# 以固定的案例集合在多個資料規模下量測耗時與峰值記憶體，並與記錄在 BASELINE_FILE 的基準比較。
+# python benchmarks.py suite --scales 1,10,100 --save-baseline   (建立 / 更新基準)
+# python benchmarks.py suite --scales 1,10 --check                 (超過容許範圍時以非零狀態結束)
+BASELINE_FILE = 'benchmarks_baseline.json'
+SUITE_SCALES = (1, 10, 100)
+REGRESSION_TOLERANCE = 0.5      # 耗時或記憶體超過基準 50% 視為退步 (共用機器上的計時雜訊約 ±30%)
+# 差距小於此絕對值時不視為退步 (毫秒級案例的計時雜訊、KB 級的記憶體差異)
+REGRESSION_MIN_SECONDS = 0.005
+REGRESSION_MIN_MB = 0.5
+SUITE_COMBINATIONS = [(risk, kind) for risk in ('保守型', '穩健型', '積極型') for kind in ('純個股', '純ETF', '混合型')]
+
+def _fake_news(ticker):
+    return [{'title': f'{ticker} news {i}'} for i in range(3)]
+
+def _load_cases(files):
+    """load_and_preprocess_data 的完整解析路徑 (含來源檔雜湊，不使用快照)，來源檔暫時指向 files"""
+    def load():
+        saved = config.ETF_FILE, config.LISTED_STOCK_FILE, config.OTC_STOCK_FILE
+        config.ETF_FILE, config.LISTED_STOCK_FILE, config.OTC_STOCK_FILE = files
+        try:
+            return data_loader.load_and_preprocess_data(use_snapshot=False)
+        finally:
+            config.ETF_FILE, config.LISTED_STOCK_FILE, config.OTC_STOCK_FILE = saved
+    return [('load_and_preprocess_data', load)]
+
+def _screen_cases(master_df):
+    df_filtered = investment_analyzer.run_rule_zero(master_df)
+    df_stocks = df_filtered[df_filtered['AssetType'] == '個股'].copy()
+    df_etf = df_filtered[df_filtered['AssetType'] == 'ETF'].copy()
+    stock_pools = investment_analyzer.create_stock_pools(df_stocks)
+    etf_pools = investment_analyzer.create_etf_pools(df_etf)
+    cases = [
+        ('run_rule_zero', lambda: investment_analyzer.run_rule_zero(master_df)),
+        ('create_stock_pools', lambda: investment_analyzer.create_stock_pools(df_stocks)),
+        ('create_etf_pools', lambda: investment_analyzer.create_etf_pools(df_etf)),
+    ]
+    for risk_profile, portfolio_type in SUITE_COMBINATIONS:
+        cases.append((f'build_portfolio {risk_profile}/{portfolio_type}',
+                      lambda r=risk_profile, t=portfolio_type: investment_analyzer.build_portfolio(
+                          r, t, stock_pools, etf_pools, seed=0)))
+    return cases, stock_pools, etf_pools
+
+def _retrieval_cases(master_df, stock_pools, etf_pools):
+    """新聞摘要與報告生成，皆使用本地假資料來源與假模型 (每次清空新聞快取、停用 LLM 快取)"""
+    import ai_helper
+    from fake_llm import FakeGenerativeModel
+
+    portfolio_df, hhi_value = investment_analyzer.build_portfolio('穩健型', '混合型', stock_pools, etf_pools, seed=0)
+    model = FakeGenerativeModel(text='報告' * 400)
+
+    def news_summary():
+        ai_helper.clear_news_cache()
+        return ai_helper.get_yfinance_news_summary(portfolio_df, master_df, news_provider=_fake_news)
+
+    def report():
+        ai_helper.clear_news_cache()
+        retrieval = ai_helper.retrieve_portfolio_context(portfolio_df, master_df, news_provider=_fake_news)
+        return ai_helper.generate_rag_report('穩健型', '混合型', portfolio_df, master_df, hhi_value, retrieval, model=model)
+
+    return [('get_yfinance_news_summary', news_summary), ('generate_rag_report', report)]
+
+def run_suite(scales=SUITE_SCALES, repeat=3):
+    """在每個規模下執行所有案例，回傳量測結果列表"""
+    saved_cache, saved_instrumentation = config.LLM_CACHE_ENABLED, config.INSTRUMENTATION_ENABLED
+    config.LLM_CACHE_ENABLED = False
+    config.INSTRUMENTATION_ENABLED = False
+    rows = []
+    try:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for scale in scales:
+                files = ((config.ETF_FILE, config.LISTED_STOCK_FILE, config.OTC_STOCK_FILE) if scale == 1
+                         else make_replica(scale, tmp_dir))
+                cases = _load_cases(files)
+                master_df = cases[0][1]()
+                screen_cases, stock_pools, etf_pools = _screen_cases(master_df)
+                cases += screen_cases + _retrieval_cases(master_df, stock_pools, etf_pools)
+                for name, func in cases:
+                    seconds, peak_mb, _ = measure(func, repeat=repeat)
+                    rows.append({'case': name, 'scale': scale, 'rows': len(master_df), 'seconds': seconds,
+                                 'peak_mb': peak_mb})
+                    print(f"  x{scale} {name}: {seconds * 1000:,.1f} ms, {peak_mb:,.1f} MB")
+    finally:
+        config.LLM_CACHE_ENABLED, config.INSTRUMENTATION_ENABLED = saved_cache, saved_instrumentation
+    return rows
+
+def _baseline_key(row):
+    return f"{row['case']} @x{row['scale']}"
+
+def load_baseline(path=BASELINE_FILE):
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+def save_baseline(rows, path=BASELINE_FILE):
+    """把量測結果寫成基準檔 (含量測環境，不同機器的基準不可直接比較)"""
+    baseline = {
+        'environment': {'python': platform.python_version(), 'pandas': pd.__version__, 'numpy': np.__version__,
+                        'machine': platform.machine(), 'cpus': os.cpu_count()},
+        'results': {_baseline_key(row): {'rows': row['rows'], 'seconds': row['seconds'], 'peak_mb': row['peak_mb']}
+                    for row in rows},
+    }
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(baseline, f, ensure_ascii=False, indent=2)
+    print(f"已寫入基準: {path} ({len(rows)} 項)")
+
+def compare_baseline(rows, baseline, tolerance=REGRESSION_TOLERANCE):
+    """在結果列加上與基準的比值；超過 1 + tolerance 的項目標記為 REGRESSION，回傳退步項目數"""
+    regressions = 0
+    results = baseline.get('results', {})
+    for row in rows:
+        base = results.get(_baseline_key(row))
+        if base is None:
+            row['status'] = 'new'
+            continue
+        row['time_ratio'] = row['seconds'] / base['seconds'] if base['seconds'] else np.nan
+        row['mem_ratio'] = row['peak_mb'] / base['peak_mb'] if base['peak_mb'] else np.nan
+        regressed = ((row['time_ratio'] > 1 + tolerance and row['seconds'] - base['seconds'] > REGRESSION_MIN_SECONDS)
+                     or (row['mem_ratio'] > 1 + tolerance and row['peak_mb'] - base['peak_mb'] > REGRESSION_MIN_MB))
+        row['status'] = 'REGRESSION' if regressed else 'ok'
+        regressions += regressed
+    return regressions
+
+def bench_suite(scale=100, repeat=3, scales=None, baseline_path=BASELINE_FILE, update_baseline=False, check=False,
+                tolerance=REGRESSION_TOLERANCE):
+    """
+    載入、規則零、建池、9 種組合的 build_portfolio、新聞摘要與報告生成 (假資料來源與假模型)，
+    在原始資料與 10x～1000x 合成複本上量測耗時與峰值記憶體，並與基準比較
+    """
+    scales = scales or tuple(sorted({1, 10, scale}))
+    rows = run_suite(scales, repeat)
+    baseline = load_baseline(baseline_path)
+    regressions = 0
+    if baseline is not None:
+        if baseline.get('environment', {}).get('cpus') != os.cpu_count():
+            print("注意：基準是在不同的機器上量測的，比值僅供參考。")
+        regressions = compare_baseline(rows, baseline, tolerance)
+    print_table(rows)
+    if update_baseline:
+        save_baseline(rows, baseline_path)
+    elif regressions:
+        print(f"{regressions} 項超過基準 {tolerance:.0%} 以上。")
+        if check:
+            sys.exit(1)
+    return rows
+
+BENCHMARKS = {
+    'load': bench_load,
+    'screen': bench_screen,
+    'batch': bench_batch,
+    'report_stream': bench_report_stream,
+    'import': bench_import,
+    'sessions': bench_sessions,
+    'dtypes': bench_dtypes,
+    'delta': bench_delta,
+    'analytics': bench_analytics,
+    'optimizer': bench_optimizer,
+    'rebalance': bench_rebalance,
+    'backtest': bench_backtest,
+    'sweep': bench_sweep,
+    'lookup': bench_lookup,
+    'instrumentation': bench_instrumentation,
+    'suite': bench_suite,
+    'chunked': bench_chunked,
+}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='AI 投資組合分析系統效能基準量測')
+    parser.add_argument('name', choices=sorted(BENCHMARKS), help='要執行的基準項目')
+    parser.add_argument('--scale', type=int, default=100, help='合成資料的放大倍數')
+    parser.add_argument('--repeat', type=int, default=3, help='每項量測的重複次數 (取最佳值)')
+    parser.add_argument('--scales', help='suite：以逗號分隔的資料規模 (例如 1,10,100,1000)')
+    parser.add_argument('--baseline', default=BASELINE_FILE, help='suite：基準檔路徑')
+    parser.add_argument('--save-baseline', action='store_true', help='suite：以本次結果更新基準檔')
+    parser.add_argument('--check', action='store_true', help='suite：有項目退步時以非零狀態結束')
+    parser.add_argument('--tolerance', type=float, default=REGRESSION_TOLERANCE, help='suite：容許的退步比例')
+    args = parser.parse_args()
+    if args.name == 'suite':
+        scales = tuple(int(value) for value in args.scales.split(',')) if args.scales else None
+        bench_suite(scale=args.scale, repeat=args.repeat, scales=scales, baseline_path=args.baseline,
+                    update_baseline=args.save_baseline, check=args.check, tolerance=args.tolerance)
+    else:
+        BENCHMARKS[args.name](scale=args.scale, repeat=args.repeat)
@@ -0,0 +1,121 @@
+# chat_context.py
+# 聊天上下文管理：在固定的 token 預算內組出聊天提示詞的上下文。
+# - 最近幾則訊息原文保留 (rolling window)
+# - 滑出視窗的舊訊息以增量方式濃縮為摘要並快取，不會每輪重算
+# - 投資組合與檢索資料只在組合變動時渲染一次
+
+import re
+
+import config
+
+_CJK_PATTERN = re.compile(r'[\u3000-\u9fff\uf900-\ufaff\uff00-\uffef]')
+
+def estimate_tokens(text):
+    """粗估 token 數：中日韓字元約 1 字 1 token，其餘約 4 字元 1 token"""
+    if not text:
+        return 0
+    cjk = len(_CJK_PATTERN.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+def summarize_message(message, max_chars=None):
+    """預設的單則訊息摘要：保留角色與內容開頭 (不呼叫 LLM，零延遲)"""
+    max_chars = max_chars or config.CHAT_SUMMARY_CHARS
+    role = '使用者' if message.get('role') == 'user' else 'AI'
+    content = ' '.join(str(message.get('content', '')).split())
+    if len(content) > max_chars:
+        content = content[:max_chars] + '…'
+    return f"- {role}: {content}"
+
+def _render_message(message):
+    role = 'User' if message.get('role') == 'user' else 'Assistant'
+    return f"{role}: {message.get('content', '')}"
+
+
+class ConversationContext:
+    """
+    每個聊天工作階段一個實例 (例如存放在 st.session_state)。
+    render() 回傳 (投資組合上下文, 舊對話摘要, 近期對話原文, 指標)；metrics_log 保留每一輪的提示詞大小，
+    可用來確認長對話下提示詞大小維持平穩。
+    """
+
+    def __init__(self, token_budget=None, recent_messages=None, summary_budget=None, summarizer=None):
+        self.token_budget = token_budget or config.CHAT_TOKEN_BUDGET
+        self.recent_messages = recent_messages or config.CHAT_RECENT_MESSAGES
+        self.summary_budget = summary_budget or self.token_budget // 4
+        self.summarizer = summarizer or summarize_message
+        self.portfolio_context = ""
+        self._portfolio_key = None
+        self.summary_lines = []
+        self.summarized_count = 0
+        self.metrics_log = []
+
+    def set_portfolio(self, portfolio_df, retrieval=None):
+        """渲染投資組合與檢索資料；同一組合 (持股、權重與檢索包皆相同) 只渲染一次"""
+        key = (tuple(portfolio_df.index), tuple(portfolio_df['Weight'].round(6)), id(retrieval))
+        if key == self._portfolio_key:
+            return
+        context = f"""This is the current portfolio on screen:
+{portfolio_df[['名稱', 'Weight']].to_markdown()}
+"""
+        if retrieval is not None:
+            context += f"""
+Holding details retrieved from the local database:
+{retrieval['details']}
+
+Recent market news for the holdings:
+{retrieval['news']}
+"""
+        self.portfolio_context = context
+        self._portfolio_key = key
+
+    def _summary_text(self):
+        lines = list(self.summary_lines)
+        # 摘要本身也有上限：超過時捨棄最舊的摘要行
+        while lines and estimate_tokens('\n'.join(lines)) > self.summary_budget:
+            lines.pop(0)
+        if len(lines) < len(self.summary_lines):
+            lines.insert(0, '- (更早的對話已省略)')
+        return '\n'.join(lines)
+
+    def render(self, messages, user_query):
+        """依預算切分對話，回傳 (portfolio_context, summary, recent_history, metrics)"""
+        history = list(messages)
+        # app.py 會先把本輪問題加入 messages；避免在歷史中重複出現
+        if history and history[-1].get('role') == 'user' and history[-1].get('content') == user_query:
+            history = history[:-1]
+
+        if len(history) < self.summarized_count:
+            # 對話已被清空重來：丟棄舊摘要
+            self.summary_lines, self.summarized_count = [], 0
+
+        fixed_tokens = estimate_tokens(self.portfolio_context) + estimate_tokens(user_query)
+        start = max(self.summarized_count, len(history) - self.recent_messages)
+        window = history[start:]
+        while window and fixed_tokens + self.summary_budget + estimate_tokens('\n'.join(map(_render_message, window))) > self.token_budget:
+            window = window[1:]
+            start += 1
+
+        # 增量摘要：只處理這一輪新滑出視窗的訊息
+        for message in history[self.summarized_count:start]:
+            self.summary_lines.append(self.summarizer(message))
+        self.summarized_count = max(self.summarized_count, start)
+
+        summary = self._summary_text()
+        recent_history = '\n'.join(map(_render_message, window))
+        metrics = {
+            'turn': len(self.metrics_log) + 1,
+            'messages_total': len(history),
+            'messages_in_window': len(window),
+            'messages_summarized': self.summarized_count,
+            'portfolio_tokens': estimate_tokens(self.portfolio_context),
+            'summary_tokens': estimate_tokens(summary),
+            'history_tokens': estimate_tokens(recent_history),
+        }
+        return self.portfolio_context, summary, recent_history, metrics
+
+    def record(self, metrics, prompt):
+        """記錄本輪最終提示詞的大小"""
+        metrics['prompt_tokens'] = estimate_tokens(prompt)
+        metrics['prompt_chars'] = len(prompt)
+        self.metrics_log.append(metrics)
+        return metrics
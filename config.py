@@ -5,6 +5,60 @@ ETF_FILE = 'ETFALL.xlsx'
 LISTED_STOCK_FILE = 'listed stock. without etf.csv'
 OTC_STOCK_FILE = 'OTC without etf.csv'
 
+# --- 快取設定 ---
+# 預處理後的 master_df 快照 (Parquet) 存放目錄，來源檔變動時會自動失效
+SNAPSHOT_DIR = '.cache'
+# 行程共用資料儲存：保留的資料版本數，以及檢查來源檔是否變動的間隔 (秒)
+DATA_STORE_MAX_VERSIONS = 2
+DATA_REFRESH_SECONDS = 60
+# 增量更新檔放置目錄：其中的 CSV/Excel 依檔名順序套用在來源檔資料之上 (不需重新解析來源檔)
+DATA_DELTA_DIR = 'data_updates'
+# 分批解析來源檔時每批的列數 (None 為一次讀入整個檔案；數十萬檔以上的標的清單建議設定，例如 50000)
+LOAD_CHUNK_ROWS = None
+# LLM 回應快取 (SQLite)：相同模型 + 相同提示詞直接回傳先前的回應
+LLM_CACHE_ENABLED = True
+LLM_CACHE_PATH = '.cache/llm_responses.sqlite3'
+LLM_CACHE_MAX_ENTRIES = 5000
+LLM_CACHE_MAX_BYTES = 50 * 1024 * 1024
+LLM_CACHE_TTL_SECONDS = 24 * 3600
+
+# --- LLM 用戶端設定 ---
+LLM_MODEL_NAME = 'gemini-1.5-flash'
+LLM_RATE_PER_SECOND = 0.25     # 平均每秒請求數 (免費方案約 15 RPM)
+LLM_BURST = 3                  # 允許的瞬間突發請求數
+LLM_MAX_CONCURRENCY = 4        # 同時進行中的請求上限
+LLM_MAX_RETRIES = 3
+LLM_RETRY_BASE_DELAY = 1.0     # 秒，指數退避的基準
+LLM_RETRY_MAX_DELAY = 20.0     # 秒，單次退避上限
+LLM_TIMEOUT_SECONDS = 60       # 單次呼叫 (或串流兩段之間) 的期限
+
+# --- 聊天上下文預算 ---
+CHAT_TOKEN_BUDGET = 3000       # 聊天提示詞上下文的 token 上限 (粗估)
+CHAT_RECENT_MESSAGES = 6       # 保留原文的最近訊息則數
+CHAT_SUMMARY_CHARS = 60        # 較舊訊息在摘要中保留的字元數
+
+# --- 回測設定 ---
+# 日頻價格 / 報酬面板，以及各日期的時點快照 (master_df Parquet 或當時的三個來源檔) 存放目錄
+BACKTEST_PRICE_FILE = 'backtest_data/prices.parquet'
+BACKTEST_SNAPSHOT_DIR = 'backtest_data/snapshots'
+BACKTEST_FREQUENCY = 'M'       # 再平衡頻率：M 每月、Q 每季、Y 每年
+BACKTEST_COST_BPS = 0.0        # 每單位交易金額的成本 (bps)
+
+# --- 參數掃描設定 ---
+SWEEP_WORKERS = None           # 參數掃描的 worker 行程數 (None 為 CPU 核心數)
+
+# --- HTTP 服務設定 (service.py) ---
+SERVICE_HOST = '127.0.0.1'
+SERVICE_PORT = 8000
+SERVICE_WORKERS = None         # CPU 工作的 worker 行程數 (None 為 CPU 核心數)
+
+# --- 效能量測設定 (instrumentation.py) ---
+INSTRUMENTATION_ENABLED = True
+INSTRUMENTATION_LOG_PATH = '.cache/timings.jsonl'   # 每次最外層 span 結束時附加一行 JSON (None 為不寫檔)
+INSTRUMENTATION_LOG_MAX_BYTES = 10 * 1024 * 1024    # 記錄檔超過此大小時輪替
+INSTRUMENTATION_TRACE_BUFFER = 50                   # 記憶體中保留的最近 span 筆數 (計時面板用)
+PROFILE_SPANS = ()             # 額外擷取 cProfile 熱點與 tracemalloc 峰值的 span 名稱，例如 ('portfolio.build',)
+
 # --- API 金鑰設定 ---
 # !! 重要 !!: 請將 'YOUR_API_KEY' 替換成你自己的 Google AI (Gemini) API 金鑰
 # 你可以從 Google AI Studio 免費取得: https://aistudio.google.com/app/apikey
@@ -25,6 +79,25 @@ MAX_INDUSTRY_CONCENTRATION = 2
 HHI_CONSERVATIVE_MAX = 0.20
 HHI_MODERATE_MAX = 0.25
 HHI_AGGRESSIVE_MAX = 0.35
+# 權重最佳化的限制：在 HHI 上限與下列限制內最大化因子曝險
+MIN_POSITION_WEIGHT = 0.03
+MAX_POSITION_WEIGHT = 0.30
+MAX_INDUSTRY_WEIGHT = 0.40
+
+# 個股池門檻：波動度以個股集合的 StdDev_1Y 分位數切分低 / 中 / 高
+LOW_VOL_QUANTILE = 0.30
+HIGH_VOL_QUANTILE = 0.70
+CONSERVATIVE_MAX_BETA = 1.0
+CONSERVATIVE_MIN_DIVIDEND_YEARS = 10
+MODERATE_MIN_ROE = 5
+MODERATE_MIN_REVENUE_YOY = 0
+AGGRESSIVE_MIN_BETA = 1.1
+AGGRESSIVE_MIN_REVENUE_YOY = 15
+
+# 混合型投資組合的衛星持股數量區間 [low, high)
+CONSERVATIVE_SATELLITE_COUNT = (3, 6)
+MODERATE_SATELLITE_COUNT = (3, 6)
+AGGRESSIVE_SATELLITE_COUNT = (2, 5)
 
 # ETF 資產配置藍圖 (%)
 CONSERVATIVE_ETF_ALLOC = {'stocks': 30, 'bonds': 70}
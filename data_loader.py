@@ -1,87 +1,448 @@
 # data_loader.py (最終版)
 
+import hashlib
+import json
+import os
 import pandas as pd
 import numpy as np
 import config
+from instrumentation import span, traced
+
+SNAPSHOT_MANIFEST = 'manifest.json'
+# 欄位綱要 (欄位集合或儲存型態) 變動時遞增，讓舊綱要的快照與依資料版本建立的快取一併失效
+SCHEMA_VERSION = 2
 
 def clean_numeric_column(series):
-    """將欄位轉換為數值型態，處理 '--', 'NA' 等無效值"""
+    """將欄位轉換為數值型態，處理 '--', 'NA' 等無效值 (逐欄字串清洗，供零散資料使用)"""
     return pd.to_numeric(series.astype(str).str.replace(',', '').replace('--', np.nan), errors='coerce')
 
-def load_and_preprocess_data():
-    """模組一：數據整合與預處理引擎 (最終版)"""
+# --- 快照 (Snapshot) 快取 ---
+def _source_files():
+    """master_df 依賴的三個來源檔"""
+    return [config.ETF_FILE, config.LISTED_STOCK_FILE, config.OTC_STOCK_FILE]
+
+def _file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _read_manifest():
+    path = os.path.join(config.SNAPSHOT_DIR, SNAPSHOT_MANIFEST)
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def compute_data_version():
+    """
+    計算來源檔的資料版本 (綱要版本與來源檔內容 SHA-256 的組合)。
+    mtime 與檔案大小皆未變動時直接沿用 manifest 內記錄的雜湊，避免每次重新讀檔。
+    """
+    known = _read_manifest().get('sources', {})
+    sources = {}
+    for path in _source_files():
+        stat = os.stat(path)
+        entry = known.get(path, {})
+        if entry.get('mtime_ns') == stat.st_mtime_ns and entry.get('size') == stat.st_size:
+            sha = entry['sha256']
+        else:
+            sha = _file_sha256(path)
+        sources[path] = {'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size, 'sha256': sha}
+    digest_input = f"schema-{SCHEMA_VERSION}" + ''.join(sources[p]['sha256'] for p in _source_files())
+    version = hashlib.sha256(digest_input.encode()).hexdigest()[:16]
+    return version, sources
+
+def _snapshot_path(version):
+    return os.path.join(config.SNAPSHOT_DIR, f"master_{version}.parquet")
+
+@traced('data.snapshot_read')
+def _load_snapshot(version):
+    path = _snapshot_path(version)
+    if not os.path.exists(path):
+        return None
+    try:
+        master_df = pd.read_parquet(path)
+    except Exception as e:
+        print(f"讀取快照失敗，將重新解析來源檔: {e}")
+        return None
+    return master_df.set_index('StockID', drop=False)
+
+@traced('data.snapshot_write')
+def _save_snapshot(master_df, version, sources):
+    """寫入 Parquet 快照與 manifest；寫入失敗 (例如唯讀磁碟) 不影響主流程。"""
+    try:
+        os.makedirs(config.SNAPSHOT_DIR, exist_ok=True)
+        snapshot_df = master_df.reset_index(drop=True)
+        # 未使用的原始欄位可能混雜數字與字串，統一為字串以符合 Parquet 的單一型別要求
+        for col in snapshot_df.columns:
+            if snapshot_df[col].dtype == object:
+                snapshot_df[col] = snapshot_df[col].where(snapshot_df[col].isna(), snapshot_df[col].astype(str))
+        tmp_path = _snapshot_path(version) + '.tmp'
+        snapshot_df.to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, _snapshot_path(version))
+
+        # 清除舊版本快照
+        for name in os.listdir(config.SNAPSHOT_DIR):
+            if name.startswith('master_') and name.endswith('.parquet') and name != os.path.basename(_snapshot_path(version)):
+                os.remove(os.path.join(config.SNAPSHOT_DIR, name))
+
+        _write_manifest(version, sources)
+    except Exception as e:
+        print(f"寫入快照失敗 (不影響本次載入): {e}")
+
+def _write_manifest(version, sources):
+    manifest_path = os.path.join(config.SNAPSHOT_DIR, SNAPSHOT_MANIFEST)
+    with open(manifest_path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump({'version': version, 'sources': sources}, f, ensure_ascii=False, indent=2)
+    os.replace(manifest_path + '.tmp', manifest_path)
+
+# --- 欄位綱要 (Schema) ---
+# (標準欄位名稱, 來源欄位別名, 儲存型態)
+# 同一標準欄位的多個別名 (ETF 檔與個股檔命名不同) 會依序合併，前者優先
+# 儲存型態：'float32' / 'float64' 為數值欄位；'category' 為重複值多的分類欄位；'text' 保留為字串
+# 只有綱要內的來源欄位會被讀入 (PER、僑外投資持股等未使用欄位在讀檔時即略過)
+COLUMN_SCHEMA = [
+    # 基本資料
+    ('名稱', ['名稱'], 'text'),
+    ('市場', ['市場'], 'category'),
+    ('AssetType', ['AssetType'], 'category'),
+    # 市值 (最大可達數十萬億且保留兩位小數，超出 float32 的有效位數)
+    ('MarketCap_Billions', ['市值.億.', '市值(億)'], 'float64'),
+    # Beta 風險係數
+    ('Beta_1Y', ['一年.β.', '一年(β)'], 'float32'),
+    # 標準差波動率
+    ('StdDev_1Y', ['一年(σ年)'], 'float32'),
+    # 配息
+    ('Dividend_Consecutive_Years', ['現金股利連配次數'], 'float32'),
+    ('Dividend_Yield', ['成交價現金殖利率'], 'float32'),
+    # 每股自由現金流
+    ('FCFPS_Last_4Q', ['最新近4Q每股自由金流(元)'], 'float32'),
+    # 獲利能力 ROE
+    ('ROE_Avg_3Y', ['近3年平均ROE(%)'], 'float32'),
+    ('ROE_Latest_Quarter', ['最新單季ROE(%)'], 'float32'),
+    # 成長性
+    ('Revenue_YoY_Accumulated', ['累月營收年增(%)'], 'float32'),
+    # 其他
+    ('Industry', ['產業別'], 'category'),
+    ('Close', ['市價'], 'float32'),
+    ('Age_Years', ['成立年齡', '成立年數'], 'float32'),
+    # 新增欄位
+    ('Expense_Ratio', ['內扣費用.保管.管理.'], 'float32'),
+    ('Annual_Return_Include_Dividend', ['年報酬率.含息.'], 'float32'),
+]
+
+NUMERIC_DTYPES = ('float32', 'float64')
+
+# 由綱要衍生的欄位對應與數值欄位清單
+column_mapping = {alias: name for name, aliases, _ in COLUMN_SCHEMA for alias in aliases}
+numeric_cols = [name for name, _, dtype in COLUMN_SCHEMA if dtype in NUMERIC_DTYPES]
+category_cols = [name for name, _, dtype in COLUMN_SCHEMA if dtype == 'category']
+
+# 讀檔時保留的來源欄位：代號欄位加上綱要內的所有別名
+ID_COLUMNS = ['代碼.y', '代號']
+SOURCE_COLUMNS = set(ID_COLUMNS) | set(column_mapping)
+
+# 來源檔中代表缺值的字串；千分位 ',' 由讀檔時的 thousands 參數處理
+NA_VALUES = ['--', 'NA']
+
+def frame_memory_mb(df):
+    """DataFrame 的實際記憶體用量 (MB，含字串內容與索引)"""
+    return df.memory_usage(deep=True).sum() / 1024 / 1024
+
+# --- 來源檔解析 ---
+READ_OPTIONS = {'thousands': ',', 'na_values': NA_VALUES, 'usecols': lambda col: col in SOURCE_COLUMNS}
+
+def _read_table(path, id_col, **kwargs):
+    """依副檔名以 read_csv 或 read_excel 讀取來源檔 (合成資料的 ETF 檔可為 CSV)"""
+    reader = pd.read_csv if str(path).lower().endswith('.csv') else pd.read_excel
+    return reader(path, dtype={id_col: str}, **READ_OPTIONS, **kwargs)
+
+def _read_source_files(etf_file=None, listed_file=None, otc_file=None):
+    """讀取三個來源檔 (僅綱要內的欄位)，數值欄位在讀檔時即完成千分位與缺值解析"""
+    df_etf = _read_table(etf_file or config.ETF_FILE, '代碼.y')
+    df_listed = _read_table(listed_file or config.LISTED_STOCK_FILE, '代號')
+    df_otc = _read_table(otc_file or config.OTC_STOCK_FILE, '代號')
+    return df_etf, df_listed, df_otc
+
+# --- 分批解析 (大型標的清單) ---
+# 來源檔逐批讀取並立即轉為綱要型態，記憶體中只同時存在一批原始字串；
+# 結果與一次讀入完全相同 (同一份快照與資料版本)。
+NUMERIC_SOURCE_COLUMNS = {alias for name, aliases, dtype in COLUMN_SCHEMA if dtype in NUMERIC_DTYPES
+                          for alias in aliases}
+
+def _iter_excel_chunks(path, chunksize):
+    """以 openpyxl 唯讀模式逐列串流 Excel，每 chunksize 列產生一個與 read_excel 相同解析規則的 DataFrame"""
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(path, read_only=True, data_only=True)
     try:
-        df_etf = pd.read_excel(config.ETF_FILE)
-        df_listed = pd.read_csv(config.LISTED_STOCK_FILE)
-        df_otc = pd.read_csv(config.OTC_STOCK_FILE)
-
-        # --- 資料整合 ---
-        df_etf = df_etf.rename(columns={'代碼.y': 'StockID', '名稱.y': '名稱'}).drop(columns=['代碼.x', '名稱.x'], errors='ignore')
-        df_etf['AssetType'] = 'ETF'
-        df_stocks = pd.concat([df_listed, df_otc], ignore_index=True).rename(columns={'代號': 'StockID'})
-        df_stocks['AssetType'] = '個股'
-        master_df = pd.concat([df_etf, df_stocks], ignore_index=True)
-        master_df['StockID'] = master_df['StockID'].astype(str).str.strip()
-        master_df = master_df.drop_duplicates(subset='StockID', keep='first')
-        
-        # ▼▼▼ [最終版] 根據你提供的清單，建立最精確的欄位對應 ▼▼▼
-        column_mapping = {
-            # 市值
-            '市值.億.': 'MarketCap_Billions', 
-            '市值(億)': 'MarketCap_Billions',
-            # Beta 風險係數
-            '一年.β.': 'Beta_1Y', 
-            '一年(β)': 'Beta_1Y',
-            # 標準差波動率
-            '一年(σ年)': 'StdDev_1Y',
-            # 配息
-            '現金股利連配次數': 'Dividend_Consecutive_Years',
-            '成交價現金殖利率': 'Dividend_Yield',
-            # 每股自由現金流
-            '最新近4Q每股自由金流(元)': 'FCFPS_Last_4Q',
-            # 獲利能力 ROE
-            '近3年平均ROE(%)': 'ROE_Avg_3Y',
-            '最新單季ROE(%)': 'ROE_Latest_Quarter',
-            # 成長性
-            '累月營收年增(%)': 'Revenue_YoY_Accumulated',
-            # 其他
-            '產業別': 'Industry',
-            '市價': 'Close', 
-            '成立年齡': 'Age_Years', 
-            '成立年數': 'Age_Years',
-            # 新增欄位
-            '內扣費用.保管.管理.': 'Expense_Ratio',
-            '年報酬率.含息.': 'Annual_Return_Include_Dividend'
-        }
-        master_df = master_df.rename(columns=column_mapping)
-
-        # --- 自動偵測並合併所有因 rename 產生的重複欄位 ---
-        duplicated_cols = master_df.columns[master_df.columns.duplicated(keep=False)].unique()
-        if not duplicated_cols.empty:
-            print(f"偵測到重複欄位: {duplicated_cols.tolist()}，將進行智慧合併...")
-            for col_name in duplicated_cols:
-                merged_series = master_df[col_name].bfill(axis=1).iloc[:, 0]
-                master_df = master_df.drop(columns=col_name)
-                master_df[col_name] = merged_series
-            print("重複欄位合併完成。")
-        
-        # --- 數據清洗 ---
-        numeric_cols = [
-            'MarketCap_Billions', 'StdDev_1Y', 'Beta_1Y', 'Dividend_Consecutive_Years',
-            'FCFPS_Last_4Q', 'Dividend_Yield', 'ROE_Avg_3Y', 'Revenue_YoY_Accumulated',
-            'ROE_Latest_Quarter', 'Close', 'Age_Years', 'Expense_Ratio', 'Annual_Return_Include_Dividend'
-        ]
-        
-        for col in numeric_cols:
-            if col in master_df.columns:
-                master_df[col] = clean_numeric_column(master_df[col])
-
-        master_df = master_df.set_index('StockID', drop=False)
-        print("數據整合與清洗完成。")
+        rows = workbook.active.iter_rows(values_only=True)
+        header = next(rows, None) or ()
+        keep = [(pos, col) for pos, col in enumerate(header) if col in SOURCE_COLUMNS]
+        batch = []
+        for row in rows:
+            batch.append([row[pos] if pos < len(row) else None for pos, _ in keep])
+            if len(batch) >= chunksize:
+                yield _excel_frame(batch, [col for _, col in keep])
+                batch = []
+        if batch:
+            yield _excel_frame(batch, [col for _, col in keep])
+    finally:
+        workbook.close()
+
+def _excel_frame(batch, columns):
+    frame = pd.DataFrame(batch, columns=columns, dtype=object)
+    for col in columns:
+        values = frame[col]
+        is_text = values.map(lambda v: isinstance(v, str))
+        if is_text.any():
+            text = values[is_text].str.strip()
+            values = values.mask(is_text, text.where(~text.isin(NA_VALUES + [''])))
+        if col in ID_COLUMNS:
+            frame[col] = values.map(lambda v: v if v is None or isinstance(v, str) else str(v)).astype('str')
+        elif col in NUMERIC_SOURCE_COLUMNS:
+            # 與 read_excel(thousands=',') 相同：'1,763' 轉為 1763，其他無法解析的字串 (例如 '24%') 由 _apply_schema 視為缺值
+            cleaned = values.mask(is_text, values[is_text].str.replace(',', '', regex=False)) if is_text.any() else values
+            frame[col] = pd.to_numeric(cleaned, errors='coerce')
+        else:
+            frame[col] = values
+    return frame
+
+def _iter_table_chunks(path, id_col, chunksize):
+    if str(path).lower().endswith('.csv'):
+        yield from pd.read_csv(path, dtype={id_col: str}, chunksize=chunksize, **READ_OPTIONS)
+    else:
+        yield from _iter_excel_chunks(path, chunksize)
+
+def _prepare_chunk(chunk, id_col, asset_type):
+    """一批原始資料 -> 統一欄位名稱並套用綱要型態的 master_df 片段"""
+    chunk = chunk.rename(columns={id_col: 'StockID', '名稱.y': '名稱'}).drop(columns=['代碼.x', '名稱.x'], errors='ignore')
+    chunk['AssetType'] = asset_type
+    chunk['StockID'] = chunk['StockID'].astype(str).str.strip()
+    return _apply_schema(chunk)
+
+def _combine_chunks(parts):
+    """合併各批結果：分類欄位以聯集重建類別，缺少某欄位的批次補值後恢復綱要型態"""
+    from pandas.api.types import union_categoricals
+
+    categories = {name for name in category_cols if any(name in part.columns for part in parts)}
+    combined = {}
+    for name in categories:
+        pieces = [part[name] if name in part.columns else pd.Series(pd.Categorical([None] * len(part))) for part in parts]
+        combined[name] = union_categoricals([pd.Categorical(piece) for piece in pieces], sort_categories=True)
+    master_df = pd.concat([part.drop(columns=[c for c in categories if c in part.columns]) for part in parts],
+                          ignore_index=True)
+    for name, values in combined.items():
+        master_df[name] = values
+    for name, _, dtype in COLUMN_SCHEMA:
+        if name not in master_df.columns:
+            continue
+        if dtype in NUMERIC_DTYPES and master_df[name].dtype != dtype:
+            master_df[name] = master_df[name].astype(dtype)
+        elif dtype == 'text' and master_df[name].dtype == object:
+            master_df[name] = master_df[name].astype('str')
+    schema_order = [name for name, _, _ in COLUMN_SCHEMA if name in master_df.columns]
+    return master_df[[col for col in master_df.columns if col not in schema_order] + schema_order]
+
+def _parse_source_chunks(etf_file=None, listed_file=None, otc_file=None, chunksize=None):
+    """分批版的 _parse_source_files：重複代號保留最先出現者 (ETF 檔優先，其次上市、上櫃)"""
+    sources = [(etf_file or config.ETF_FILE, '代碼.y', 'ETF'),
+               (listed_file or config.LISTED_STOCK_FILE, '代號', '個股'),
+               (otc_file or config.OTC_STOCK_FILE, '代號', '個股')]
+    parts, seen = [], set()
+    for path, id_col, asset_type in sources:
+        for chunk in _iter_table_chunks(path, id_col, chunksize):
+            part = _prepare_chunk(chunk, id_col, asset_type)
+            # 直接以 Python set 判斷 (Series.isin 每次都會把整個 set 轉成陣列)
+            ids = part['StockID'].tolist()
+            part = part[np.fromiter((sid not in seen for sid in ids), dtype=bool, count=len(ids))]
+            part = part.drop_duplicates(subset='StockID', keep='first')
+            seen.update(part['StockID'].tolist())
+            if len(part):
+                parts.append(part)
+    return _combine_chunks(parts)
+
+def _apply_schema(master_df):
+    """依 COLUMN_SCHEMA 一次完成欄位改名、別名合併與型態轉換"""
+    for name, aliases, dtype in COLUMN_SCHEMA:
+        present = [alias for alias in aliases if alias in master_df.columns]
+        if not present:
+            continue
+        merged = master_df[present[0]]
+        for alias in present[1:]:
+            merged = merged.combine_first(master_df[alias])
+        if dtype in NUMERIC_DTYPES:
+            # 讀檔時已是數值型態的欄位不需再解析；僅殘留字串 (例如 '24%') 的欄位才強制轉型
+            if not pd.api.types.is_numeric_dtype(merged):
+                merged = pd.to_numeric(merged, errors='coerce')
+            merged = merged.astype(dtype)
+        elif dtype == 'category':
+            merged = merged.astype('category')
+        master_df = master_df.drop(columns=present)
+        master_df[name] = merged
+    return master_df
+
+@traced('data.parse')
+def _parse_source_files(etf_file=None, listed_file=None, otc_file=None, chunksize=None):
+    """
+    讀取三個來源檔並完成整合、欄位對應與數據清洗。
+    chunksize (預設為 config.LOAD_CHUNK_ROWS) 有值時改為每次讀取 chunksize 列的分批模式，峰值記憶體不隨檔案大小成長。
+    """
+    chunksize = chunksize or config.LOAD_CHUNK_ROWS
+    if chunksize:
+        master_df = _parse_source_chunks(etf_file, listed_file, otc_file, chunksize)
+        print(f"master_df 共 {len(master_df)} 筆、{master_df.shape[1]} 欄 (分批讀取，每批 {chunksize} 列)，"
+              f"記憶體用量 {frame_memory_mb(master_df):.2f} MB。")
+        return master_df.set_index('StockID', drop=False)
+
+    df_etf, df_listed, df_otc = _read_source_files(etf_file, listed_file, otc_file)
+
+    # --- 資料整合 ---
+    df_etf = df_etf.rename(columns={'代碼.y': 'StockID', '名稱.y': '名稱'}).drop(columns=['代碼.x', '名稱.x'], errors='ignore')
+    df_etf['AssetType'] = 'ETF'
+    df_stocks = pd.concat([df_listed, df_otc], ignore_index=True).rename(columns={'代號': 'StockID'})
+    df_stocks['AssetType'] = '個股'
+    master_df = pd.concat([df_etf, df_stocks], ignore_index=True)
+    master_df['StockID'] = master_df['StockID'].astype(str).str.strip()
+    master_df = master_df.drop_duplicates(subset='StockID', keep='first')
+
+    # --- 欄位對應與數據清洗 ---
+    master_df = _apply_schema(master_df)
+    print(f"master_df 共 {len(master_df)} 筆、{master_df.shape[1]} 欄，記憶體用量 {frame_memory_mb(master_df):.2f} MB。")
+
+    return master_df.set_index('StockID', drop=False)
+
+def load_and_preprocess_data(use_snapshot=True, chunksize=None):
+    """
+    模組一：數據整合與預處理引擎 (最終版)
+    use_snapshot=True 時優先讀取以來源檔內容雜湊為鍵的 Parquet 快照，
+    略過 Excel 解析與字串清洗；任一來源檔變動時快照自動失效並重建。
+    chunksize 有值 (或設定 config.LOAD_CHUNK_ROWS) 時以分批模式解析來源檔，結果與一次讀入相同。
+    回傳的 master_df.attrs['data_version'] 即為該資料版本。
+    """
+    try:
+        with span('data.load') as load_span:
+            version, sources = compute_data_version()
+
+            master_df = _load_snapshot(version) if use_snapshot else None
+            source = 'snapshot' if master_df is not None else 'parse'
+            if master_df is not None:
+                print(f"已從快照載入數據 (版本 {version})。")
+                if _read_manifest().get('sources') != sources:
+                    # 來源檔僅被 touch 而內容未變：更新 mtime 紀錄，下次即可略過雜湊
+                    try:
+                        _write_manifest(version, sources)
+                    except OSError:
+                        pass
+            else:
+                master_df = _parse_source_files(chunksize=chunksize)
+                if use_snapshot:
+                    _save_snapshot(master_df, version, sources)
+                print("數據整合與清洗完成。")
+            load_span['attrs'].update(source=source, rows=len(master_df), version=version)
+
+        master_df.attrs['data_version'] = version
         return master_df
 
     except Exception as e:
         print(f"處理數據時發生未預期的錯誤: {e}")
         import traceback
         traceback.print_exc()
-        return None
\ No newline at end of file
+        return None
+
+# --- 增量更新 (Delta) ---
+# 增量檔為與來源檔同格式的 CSV (個股，代號欄位為 '代號') 或 Excel (ETF，代號欄位為 '代碼.y')，
+# 可只包含部分欄位；檔內出現的欄位 (含空白值) 即為新值。'刪除' 欄位為 1/Y/是 的列代表下市或移除。
+DELTA_DELETE_COLUMN = '刪除'
+DELTA_TRUE_VALUES = {'1', 'Y', 'YES', 'TRUE', '是'}
+DELTA_FILE_EXTENSIONS = ('.csv', '.xlsx', '.xls')
+
+def read_delta_file(path):
+    """讀取增量檔並套用欄位綱要，回傳以 StockID 為索引的 DataFrame (含布林欄位 DELTA_DELETE_COLUMN)"""
+    read_opts = {'thousands': ',', 'na_values': NA_VALUES,
+                 'usecols': lambda col: col in SOURCE_COLUMNS or col == DELTA_DELETE_COLUMN}
+    id_dtypes = {col: str for col in ID_COLUMNS + [DELTA_DELETE_COLUMN]}
+    if path.lower().endswith(('.xlsx', '.xls')):
+        delta_df = pd.read_excel(path, dtype=id_dtypes, **read_opts)
+    else:
+        delta_df = pd.read_csv(path, dtype=id_dtypes, **read_opts)
+
+    id_col = next((col for col in ID_COLUMNS if col in delta_df.columns), None)
+    if id_col is None:
+        raise ValueError(f"增量檔 {path} 缺少代號欄位 ({' / '.join(ID_COLUMNS)})")
+    if 'AssetType' not in delta_df.columns:
+        delta_df['AssetType'] = 'ETF' if id_col == '代碼.y' else '個股'
+    delete_flags = delta_df.pop(DELTA_DELETE_COLUMN) if DELTA_DELETE_COLUMN in delta_df.columns else None
+
+    delta_df = delta_df.rename(columns={id_col: 'StockID'})
+    delta_df['StockID'] = delta_df['StockID'].astype(str).str.strip()
+    delta_df = _apply_schema(delta_df)
+    delta_df[DELTA_DELETE_COLUMN] = (delete_flags.fillna('').str.strip().str.upper().isin(DELTA_TRUE_VALUES)
+                                     if delete_flags is not None else False)
+    # 同一檔案內重複的代號以最後一列為準
+    delta_df = delta_df.drop_duplicates(subset='StockID', keep='last')
+    return delta_df.set_index('StockID', drop=False)
+
+def _delta_digest(delta_df):
+    return hashlib.sha256(pd.util.hash_pandas_object(delta_df, index=True).to_numpy().tobytes()).hexdigest()
+
+def apply_delta(master_df, delta_df, delta_id=None):
+    """
+    將增量套用到 master_df，回傳 (新的 master_df, 變動摘要)。
+    不修改傳入的 master_df (其他工作階段可能仍在讀取)；新 DataFrame 與舊版共用未變動的欄位資料。
+    列順序的約定：既有列維持原順序、刪除的列移除、新增的列附加在最後 (ScreenIndex.from_changes 依此換算列位置)。
+    新版本號 = 雜湊(舊版本號 + 增量內容)，相同的增量序列必得到相同的版本號。
+    變動摘要：{'updated': [...], 'added': [...], 'deleted': [...], 'columns': [...]}
+    """
+    if DELTA_DELETE_COLUMN in delta_df.columns:
+        delete_mask = delta_df[DELTA_DELETE_COLUMN].to_numpy(dtype=bool)
+    else:
+        delete_mask = np.zeros(len(delta_df), dtype=bool)
+    upserts = delta_df[~delete_mask].drop(columns=[DELTA_DELETE_COLUMN], errors='ignore')
+    # 以 master_df 既有的索引雜湊表查找 (Index.isin 會逐一轉換整個 master_df 索引，大型資料時很慢)
+    exists = master_df.index.get_indexer(upserts.index) >= 0
+    deleted_ids = [sid for sid in delta_df.index[delete_mask] if sid in master_df.index]
+    changes = {
+        'updated': list(upserts.index[exists]),
+        'added': list(upserts.index[~exists]),
+        'deleted': deleted_ids,
+        'columns': [col for col in upserts.columns if col in master_df.columns and col != 'StockID'],
+    }
+
+    new_df = master_df.copy()
+    upserts = upserts.copy()
+    # 分類欄位出現新值 (例如新產業別) 時先擴充類別，兩邊統一為相同的 CategoricalDtype
+    for col in category_cols:
+        if col in new_df.columns and col in upserts.columns:
+            new_values = pd.Index(upserts[col].dropna().unique()).difference(new_df[col].cat.categories)
+            if len(new_values):
+                new_df[col] = new_df[col].cat.add_categories(new_values)
+            upserts[col] = upserts[col].astype(new_df[col].dtype)
+
+    if changes['updated']:
+        updated = upserts.loc[changes['updated']]
+        for col in changes['columns']:
+            new_df.loc[changes['updated'], col] = updated[col]
+    if changes['added']:
+        added = upserts.loc[changes['added']].reindex(columns=new_df.columns)
+        added['StockID'] = added.index
+        new_df = pd.concat([new_df, added.astype(new_df.dtypes.to_dict())])
+    if deleted_ids:
+        new_df = new_df.drop(index=deleted_ids)
+
+    base_version = master_df.attrs.get('data_version')
+    digest = delta_id or _delta_digest(delta_df)
+    new_df.attrs = dict(master_df.attrs)
+    new_df.attrs['data_version'] = hashlib.sha256(f"{base_version}+{digest}".encode()).hexdigest()[:16]
+    return new_df, changes
+
+def list_delta_files(delta_dir=None):
+    """增量目錄中的增量檔 (依檔名排序)；目錄不存在時回傳空串列"""
+    delta_dir = delta_dir or config.DATA_DELTA_DIR
+    if not os.path.isdir(delta_dir):
+        return []
+    return [os.path.join(delta_dir, name) for name in sorted(os.listdir(delta_dir))
+            if name.lower().endswith(DELTA_FILE_EXTENSIONS) and not name.startswith(('.', '~$'))]
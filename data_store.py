@@ -0,0 +1,146 @@
+# data_store.py
+# 行程共用的唯讀資料儲存：整個行程只保留一份 master_df 與其 ScreenIndex (依資料版本)，
+# 各使用者工作階段只需記住資料版本與標的池名稱，不再各自複製 DataFrame。
+# 增量更新檔 (config.DATA_DELTA_DIR) 直接套用在目前版本上，只重算受影響的標的池。
+
+import threading
+import time
+
+import config
+from data_loader import load_and_preprocess_data, compute_data_version, read_delta_file, apply_delta, list_delta_files, _file_sha256
+from investment_analyzer import get_screen_index, update_screen_index
+
+# 標的池檢視器的選項：名稱 -> 從 ScreenIndex 取出對應 DataFrame 的方式
+POOL_VIEWS = {
+    '篩選前的所有名單': lambda screen: screen.master_df,
+    '規則零篩選完的名單': lambda screen: screen.filtered,
+    '保守型個股池': lambda screen: screen.stock_pools['conservative'],
+    '穩健型個股池': lambda screen: screen.stock_pools['moderate'],
+    '積極型個股池': lambda screen: screen.stock_pools['aggressive'],
+    '市值型ETF池': lambda screen: screen.etf_pools['market_cap'],
+    '高股息ETF池': lambda screen: screen.etf_pools['high_dividend'],
+    '主題/產業型ETF池': lambda screen: screen.etf_pools['theme'],
+    '公債ETF池': lambda screen: screen.etf_pools['gov_bond'],
+    '投資級公司債ETF池': lambda screen: screen.etf_pools['corp_bond'],
+}
+
+
+class DataStore:
+    """
+    依資料版本保存 ScreenIndex (內含 master_df 與所有標的池的列位置)。
+    最新版本供新的請求使用；最近 max_versions 個舊版本會保留，讓進行中的工作階段仍能讀到一致的快照。
+    存放的 DataFrame 由所有工作階段共用，呼叫端不可就地修改 (需要時請先 .copy())。
+    """
+
+    def __init__(self, max_versions=None, loader=None, delta_dir=None):
+        self.max_versions = max_versions or config.DATA_STORE_MAX_VERSIONS
+        self._loader = loader or load_and_preprocess_data
+        self.delta_dir = delta_dir or config.DATA_DELTA_DIR
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._snapshots = {}
+        self._current_version = None
+        self._source_version = None
+        self._applied_deltas = {}
+        self._last_checked = 0.0
+
+    def _publish(self, screen):
+        """註冊新版本並原子性地切換為目前版本"""
+        with self._lock:
+            self._snapshots[screen.version] = screen
+            self._current_version = screen.version
+            while len(self._snapshots) > self.max_versions:
+                oldest = next(iter(self._snapshots))
+                if oldest == self._current_version:
+                    break
+                del self._snapshots[oldest]
+        return screen
+
+    def load(self):
+        """載入 (或重新載入) 來源資料；失敗時回傳 None 並保留既有版本"""
+        master_df = self._loader()
+        if master_df is None:
+            return None
+        self._source_version = master_df.attrs.get('data_version')
+        # 來源檔已重新載入：增量目錄中的檔案需重新套用在新的來源資料之上
+        self._applied_deltas = {}
+        return self._publish(get_screen_index(master_df))
+
+    def apply_delta(self, delta, delta_id=None):
+        """
+        將增量 (增量檔路徑或 read_delta_file 格式的 DataFrame) 套用到目前版本並發布為新版本。
+        舊版本保持不變，進行中的工作階段仍可依其資料版本讀到一致的快照。
+        """
+        current = self.current()
+        if current is None:
+            raise RuntimeError("尚未載入任何資料版本，無法套用增量")
+        start = time.perf_counter()
+        delta_df = read_delta_file(delta) if isinstance(delta, str) else delta
+        master_df, changes = apply_delta(current.master_df, delta_df, delta_id=delta_id)
+        screen = self._publish(update_screen_index(current, master_df, changes))
+        print(f"已套用增量 (更新 {len(changes['updated'])}、新增 {len(changes['added'])}、刪除 {len(changes['deleted'])} 筆)，"
+              f"重算: {', '.join(screen.recomputed)}，版本 {current.version} -> {screen.version}，"
+              f"耗時 {time.perf_counter() - start:.3f} 秒。")
+        return screen
+
+    def _apply_pending_deltas(self):
+        """
+        依檔名順序套用增量目錄中尚未套用的檔案。
+        已套用的檔案被修改或移除、或新檔案排在已套用的檔案之前時，重新載入來源資料後全部重套，
+        確保目前資料永遠等於「來源檔 + 增量目錄中所有檔案依序套用」的結果。
+        """
+        hashes = {path: _file_sha256(path) for path in list_delta_files(self.delta_dir)}
+        pending = [path for path in hashes if path not in self._applied_deltas]
+        stale = any(hashes.get(path) != sha for path, sha in self._applied_deltas.items())
+        if stale or (pending and self._applied_deltas and pending[0] < max(self._applied_deltas)):
+            if self.load() is None:
+                return
+            pending = list(hashes)
+        for path in pending:
+            try:
+                self.apply_delta(path, delta_id=hashes[path])
+            except Exception as e:
+                print(f"套用增量檔 {path} 失敗，略過: {e}")
+            self._applied_deltas[path] = hashes[path]
+
+    def refresh_if_stale(self, interval=None):
+        """每 interval 秒最多檢查一次：來源檔版本變動時完整重新載入，增量目錄有新檔案時只套用增量"""
+        interval = config.DATA_REFRESH_SECONDS if interval is None else interval
+        now = time.monotonic()
+        if self._current_version is not None and now - self._last_checked < interval:
+            return self.current()
+        with self._refresh_lock:
+            # 多個工作階段同時觸發時只需一個執行重新載入
+            if self._current_version is not None and now - self._last_checked < interval:
+                return self.current()
+            self._last_checked = now
+            if self._current_version is None or compute_data_version()[0] != self._source_version:
+                self.load()
+            if self._current_version is not None:
+                self._apply_pending_deltas()
+        return self.current()
+
+    def current(self):
+        """目前版本的 ScreenIndex；尚未載入任何資料時回傳 None"""
+        with self._lock:
+            return self._snapshots.get(self._current_version)
+
+    def snapshot(self, version):
+        """
+        取得指定版本；該版本已被淘汰 (或從未載入) 時回傳 None，不以其他版本代替，
+        呼叫端需自行決定以目前版本重新建構或回報錯誤，避免混用不同版本的資料。
+        """
+        with self._lock:
+            return self._snapshots.get(version)
+
+    @property
+    def versions(self):
+        with self._lock:
+            return list(self._snapshots)
+
+    def pool(self, version, pool_name):
+        """依 (資料版本, 標的池名稱) 取出共用的標的池 DataFrame；version 為 None 時取目前版本，版本已淘汰時回傳 None"""
+        screen = self.current() if version is None else self.snapshot(version)
+        if screen is None or pool_name not in POOL_VIEWS:
+            return None
+        return POOL_VIEWS[pool_name](screen)
@@ -0,0 +1,55 @@
+# fake_llm.py
+# 本地假 LLM：介面與 google.generativeai 的 GenerativeModel.generate_content 相容，
+# 不需網路與 API 金鑰，用於離線測試、串流延遲量測與基準測試。
+
+import time
+
+
+class FakeResponse:
+    """模擬 generate_content 的回應 (只提供 .text)"""
+
+    def __init__(self, text):
+        self.text = text
+
+
+class FakeGenerativeModel:
+    """
+    以固定文字 (或依 prompt 產生的文字) 回應的假模型。
+    - first_token_delay: 第一個 chunk 前的延遲秒數 (模擬模型排隊與 prefill)
+    - token_delay: 之後每個 chunk 之間的延遲秒數
+    - chunk_chars: 每個 chunk 的字元數 (中文沒有空白分詞，因此以字元切分)
+    - fail_after: 串流輸出 fail_after 個 chunk 後拋出例外；0 代表串流一開始就失敗，None 代表不失敗
+    """
+
+    def __init__(self, text=None, first_token_delay=0.0, token_delay=0.0, chunk_chars=4, fail_after=None,
+                 model_name='fake-model'):
+        self.text = text
+        self.first_token_delay = first_token_delay
+        self.token_delay = token_delay
+        self.chunk_chars = chunk_chars
+        self.fail_after = fail_after
+        self.model_name = model_name
+        self.calls = []
+
+    def _reply(self, prompt):
+        if self.text is not None:
+            return self.text
+        return f"# 假模型回應\n\n收到長度 {len(prompt)} 字元的提示詞。"
+
+    def _chunks(self, text):
+        return [text[i:i + self.chunk_chars] for i in range(0, len(text), self.chunk_chars)]
+
+    def generate_content(self, prompt, stream=False):
+        self.calls.append({'prompt': prompt, 'stream': stream})
+        text = self._reply(prompt)
+        if stream:
+            return self._stream(text)
+        time.sleep(self.first_token_delay + self.token_delay * max(len(self._chunks(text)) - 1, 0))
+        return FakeResponse(text)
+
+    def _stream(self, text):
+        for i, chunk in enumerate(self._chunks(text)):
+            if self.fail_after is not None and i >= self.fail_after:
+                raise RuntimeError("fake model stream failure")
+            time.sleep(self.first_token_delay if i == 0 else self.token_delay)
+            yield FakeResponse(chunk)
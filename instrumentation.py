@@ -0,0 +1,196 @@
+# instrumentation.py
+# 輕量的效能量測：以 context manager 量測各階段耗時 (span)，累計各階段統計與計數器，
+# 完整的一次呼叫 (最外層 span 及其巢狀子 span) 以 JSON Lines 寫入記錄檔，並保留最近幾筆供 app 的計時面板顯示。
+# 指定的 span 可另外擷取 cProfile 熱點與 tracemalloc 記憶體峰值。
+# 用法：
+#   with span('portfolio.build', risk=risk_profile) as s:
+#       ...
+#       s['attrs']['holdings'] = len(portfolio_df)
+#   @traced('screen.rule_zero')
+#   def run_rule_zero(df): ...
+#   count('news.cache_hits')
+
+import contextvars
+import cProfile
+import functools
+import io
+import json
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+from collections import deque
+
+import config
+
+PROFILE_TOP_FUNCTIONS = 15
+
+_lock = threading.Lock()
+_stages = {}            # span 名稱 -> {'count', 'total', 'max', 'errors'}
+_counters = {}
+_traces = deque(maxlen=getattr(config, 'INSTRUMENTATION_TRACE_BUFFER', 50))
+# 目前開啟中的 span (巢狀結構)；contextvars 讓 asyncio 的各個 task 與各執行緒各自獨立
+_open_spans = contextvars.ContextVar('open_spans', default=())
+
+
+def enabled():
+    return config.INSTRUMENTATION_ENABLED
+
+class _NullSpan:
+    """停用時的 span：不計時也不配置物件"""
+
+    def __enter__(self):
+        return {'attrs': {}}
+
+    def __exit__(self, *exc):
+        return False
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    __slots__ = ('record', 'token', 'start', 'profiler', 'tracing')
+
+    def __init__(self, name, attrs):
+        self.record = {'name': name, 'start': time.time(), 'seconds': None, 'attrs': attrs, 'children': []}
+
+    def __enter__(self):
+        parents = _open_spans.get()
+        self.token = _open_spans.set(parents + (self.record,))
+        self.profiler = self.tracing = None
+        if self.record['name'] in config.PROFILE_SPANS:
+            self.profiler = cProfile.Profile()
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self.tracing = True
+            tracemalloc.reset_peak()
+            self.profiler.enable()
+        self.start = time.perf_counter()
+        return self.record
+
+    def __exit__(self, exc_type, exc, tb):
+        seconds = time.perf_counter() - self.start
+        record = self.record
+        if self.profiler is not None:
+            self.profiler.disable()
+            record['peak_memory_mb'] = tracemalloc.get_traced_memory()[1] / 1024 ** 2
+            if self.tracing:
+                tracemalloc.stop()
+            record['profile'] = _profile_text(self.profiler)
+        record['seconds'] = seconds
+        if exc_type is not None:
+            record['error'] = exc_type.__name__
+        _open_spans.reset(self.token)
+        _finish(record, _open_spans.get())
+        return False
+
+
+def span(name, **attrs):
+    """量測一個階段；回傳的紀錄 (dict) 可在區塊內補充 attrs"""
+    if not config.INSTRUMENTATION_ENABLED:
+        return _NULL_SPAN
+    return _Span(name, attrs)
+
+def traced(name=None):
+    """以 span 包住整個函式呼叫的裝飾器 (名稱預設為 模組.函式)"""
+    def decorator(func):
+        span_name = name or f"{func.__module__}.{func.__name__}"
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not config.INSTRUMENTATION_ENABLED:
+                return func(*args, **kwargs)
+            with _Span(span_name, {}):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def record(name, seconds, **attrs):
+    """記錄一段已在別處量測的耗時 (例如串流輸出，無法以 with 區塊包住)"""
+    if config.INSTRUMENTATION_ENABLED:
+        entry = {'name': name, 'start': time.time() - seconds, 'seconds': seconds, 'attrs': attrs, 'children': []}
+        _finish(entry, _open_spans.get())
+
+def count(name, value=1):
+    if config.INSTRUMENTATION_ENABLED:
+        with _lock:
+            _counters[name] = _counters.get(name, 0) + value
+
+def _finish(entry, parents):
+    with _lock:
+        stage = _stages.get(entry['name'])
+        if stage is None:
+            stage = _stages[entry['name']] = {'count': 0, 'total': 0.0, 'max': 0.0, 'errors': 0}
+        stage['count'] += 1
+        stage['total'] += entry['seconds']
+        stage['max'] = max(stage['max'], entry['seconds'])
+        stage['errors'] += 'error' in entry
+        if parents:
+            parents[-1]['children'].append(entry)
+            return
+        _traces.append(entry)
+    if config.INSTRUMENTATION_LOG_PATH:
+        _append_log(entry)
+
+def _profile_text(profiler):
+    buffer = io.StringIO()
+    pstats.Stats(profiler, stream=buffer).sort_stats('cumulative').print_stats(PROFILE_TOP_FUNCTIONS)
+    return buffer.getvalue()
+
+# --- 匯出 ---
+def _append_log(entry):
+    """最外層 span 結束時附加一行 JSON；超過大小上限時輪替為 .1"""
+    path = config.INSTRUMENTATION_LOG_PATH
+    line = json.dumps(entry, ensure_ascii=False, default=str) + '\n'
+    try:
+        with _lock:
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            if os.path.exists(path) and os.path.getsize(path) > config.INSTRUMENTATION_LOG_MAX_BYTES:
+                os.replace(path, path + '.1')
+            with open(path, 'a', encoding='utf-8') as f:
+                f.write(line)
+    except OSError as e:
+        print(f"寫入效能記錄失敗: {e}")
+
+def stage_stats():
+    """各階段統計：{名稱: {'count', 'total_seconds', 'mean_ms', 'max_ms', 'errors'}}，依總耗時排序"""
+    with _lock:
+        stages = {name: dict(stage) for name, stage in _stages.items()}
+    return {
+        name: {'count': s['count'], 'total_seconds': s['total'], 'mean_ms': s['total'] / s['count'] * 1000,
+               'max_ms': s['max'] * 1000, 'errors': s['errors']}
+        for name, s in sorted(stages.items(), key=lambda item: -item[1]['total'])
+    }
+
+def counters():
+    with _lock:
+        return dict(_counters)
+
+def recent_traces(n=None):
+    """最近完成的最外層 span (新到舊)"""
+    with _lock:
+        traces = list(_traces)[::-1]
+    return traces[:n] if n else traces
+
+def flatten(trace, depth=0):
+    """把一筆巢狀 span 展開為 (深度, 名稱, 毫秒, attrs) 的列表，供表格顯示"""
+    rows = [(depth, trace['name'], trace['seconds'] * 1000, trace['attrs'])]
+    for child in trace['children']:
+        rows.extend(flatten(child, depth + 1))
+    return rows
+
+def snapshot():
+    return {'stages': stage_stats(), 'counters': counters(), 'traces': recent_traces()}
+
+def export_json(path):
+    """把目前的統計、計數器與最近的 span 寫成一個 JSON 檔"""
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(snapshot(), f, ensure_ascii=False, indent=2, default=str)
+    return path
+
+def reset():
+    with _lock:
+        _stages.clear()
+        _counters.clear()
+        _traces.clear()
@@ -2,8 +2,11 @@
 
 import pandas as pd
 import numpy as np
+from collections import OrderedDict
 from datetime import datetime, timedelta
 import config
+from weight_optimizer import WeightOptimizer
+from instrumentation import count, span, traced
 
 # --- Helper Functions ---
 def calculate_hhi(weights):
@@ -14,77 +17,279 @@ def apply_factor_weighting(df, factor_column):
     """應用因子加權"""
     # 確保因子欄位存在且為數值型態
     if factor_column in df.columns and pd.api.types.is_numeric_dtype(df[factor_column]):
-        weights = df[factor_column].clip(lower=0.0001)
+        # 因子欄位可能以 float32 儲存；權重一律以 float64 計算，避免 HHI 與金額出現捨入誤差
+        weights = df[factor_column].astype('float64').clip(lower=0.0001)
         if weights.sum() > 0:
             return weights / weights.sum()
     # 如果因子不存在或總和為0，則返回均等權重
     return pd.Series([1 / len(df)] * len(df), index=df.index)
 
+# 各風險偏好的 HHI 上限 (config 參數名稱)；策略參數一律在呼叫時才從 config 讀取，參數掃描 (sweep.py) 可在執行期間調整
+HHI_MAX_SETTINGS = {
+    '保守型': 'HHI_CONSERVATIVE_MAX',
+    '穩健型': 'HHI_MODERATE_MAX',
+    '積極型': 'HHI_AGGRESSIVE_MAX',
+}
+
+# 行程共用的最佳化器；不使用 warm start，讓同一 seed 的建構結果與呼叫順序無關 (逐位元一致)
+_WEIGHT_OPTIMIZER = WeightOptimizer()
+
+def apply_optimized_weighting(df, factor_column, risk_profile):
+    """在該風險偏好的 HHI 上限、單檔上下限與產業權重上限內，最大化因子曝險的權重"""
+    if factor_column not in df.columns or not pd.api.types.is_numeric_dtype(df[factor_column]):
+        return apply_factor_weighting(df, factor_column)
+    weights, _ = _WEIGHT_OPTIMIZER.solve(
+        df[factor_column].to_numpy(dtype='float64', na_value=np.nan),
+        hhi_max=getattr(config, HHI_MAX_SETTINGS.get(risk_profile, ''), None),
+        min_weight=config.MIN_POSITION_WEIGHT,
+        max_weight=config.MAX_POSITION_WEIGHT,
+        groups=df['Industry'].to_numpy(dtype=object) if 'Industry' in df.columns else None,
+        group_max=config.MAX_INDUSTRY_WEIGHT,
+    )
+    return pd.Series(weights, index=df.index)
+
 # --- Core Logic Functions ---
-def run_rule_zero(df):
-    """執行基礎排雷篩選"""
-    df_filtered = df.copy()
+LEVERAGED_ETF_PATTERN = '槓桿|反向|正2|反1'
+
+STOCK_POOL_SORT = {
+    'conservative': (['Dividend_Yield', 'MarketCap_Billions'], [False, False]),
+    'moderate': (['ROE_Avg_3Y', 'MarketCap_Billions'], [False, False]),
+    'aggressive': (['Revenue_YoY_Accumulated', 'ROE_Latest_Quarter'], [False, False]),
+}
+
+ETF_POOL_PATTERNS = {
+    'market_cap': '台灣50|公司治理|S&P 500|市值',
+    'high_dividend': '高股息|高息',
+    'theme': '半導體|科技|AI|電動車|綠能',
+    'gov_bond': '公債|政府債',
+    'corp_bond': '公司債|投資級',
+}
+
+STOCK_POOL_REQUIRED = {
+    'conservative': ['StdDev_1Y', 'Beta_1Y', 'Dividend_Consecutive_Years', 'FCFPS_Last_4Q', 'Dividend_Yield', 'MarketCap_Billions'],
+    'moderate': ['StdDev_1Y', 'ROE_Avg_3Y', 'Revenue_YoY_Accumulated', 'MarketCap_Billions'],
+    'aggressive': ['StdDev_1Y', 'Beta_1Y', 'Revenue_YoY_Accumulated', 'ROE_Latest_Quarter'],
+}
+
+# 各組標的池依賴的欄位：增量更新只動到其他欄位時，該組標的池可直接沿用
+STOCK_POOL_COLUMNS = ({col for cols in STOCK_POOL_REQUIRED.values() for col in cols}
+                      | {col for cols, _ in STOCK_POOL_SORT.values() for col in cols})
+ETF_POOL_COLUMNS = {'名稱'}
+
+def rule_zero_mask(df):
+    """規則零的布林遮罩 (True 代表保留)"""
+    mask = pd.Series(True, index=df.index)
     # 排除槓桿型、反向型ETF
-    if '名稱' in df_filtered.columns:
-        df_filtered = df_filtered[~df_filtered['名稱'].str.contains('槓桿|反向|正2|反1', na=False)]
+    if '名稱' in df.columns:
+        mask &= ~df['名稱'].str.contains(LEVERAGED_ETF_PATTERN, na=False)
     # 排除規模小於50億的標的
-    if 'MarketCap_Billions' in df_filtered.columns:
-        df_filtered = df_filtered[df_filtered['MarketCap_Billions'] >= config.MIN_MARKET_CAP_BILLIONS]
+    if 'MarketCap_Billions' in df.columns:
+        mask &= df['MarketCap_Billions'] >= config.MIN_MARKET_CAP_BILLIONS
     # 排除上市/成立未滿一年
-    if 'Age_Years' in df_filtered.columns:
-        df_filtered = df_filtered[df_filtered['Age_Years'] >= 1]
+    if 'Age_Years' in df.columns:
+        mask &= df['Age_Years'] >= config.MIN_LISTING_DAYS / 365
     # 排除最新近4季自由現金流為負的個股
-    if 'FCFPS_Last_4Q' in df_filtered.columns:
-        stock_mask = (df_filtered['AssetType'] == '個股') & (df_filtered['FCFPS_Last_4Q'] < 0)
-        df_filtered = df_filtered[~stock_mask]
-    return df_filtered
+    if 'FCFPS_Last_4Q' in df.columns:
+        mask &= ~((df['AssetType'] == '個股') & (df['FCFPS_Last_4Q'] < 0))
+    return mask
 
-def create_stock_pools(df_stocks):
-    """建立個股標的池"""
-    pools = {}
+@traced('screen.rule_zero')
+def run_rule_zero(df):
+    """執行基礎排雷篩選"""
+    return df[rule_zero_mask(df)].copy()
+
+def stock_pool_masks(df_stocks):
+    """各風險等級個股池的布林遮罩；缺少必要欄位的池回傳 None"""
+    masks = {'conservative': None, 'moderate': None, 'aggressive': None}
     # 確保欄位存在以避免錯誤
     if 'StdDev_1Y' not in df_stocks.columns:
-        return {'conservative': pd.DataFrame(), 'moderate': pd.DataFrame(), 'aggressive': pd.DataFrame()}
-        
-    low_vol_threshold = df_stocks['StdDev_1Y'].quantile(0.30)
-    high_vol_threshold = df_stocks['StdDev_1Y'].quantile(0.70)
+        return masks
+
+    low_vol_threshold = df_stocks['StdDev_1Y'].quantile(config.LOW_VOL_QUANTILE)
+    high_vol_threshold = df_stocks['StdDev_1Y'].quantile(config.HIGH_VOL_QUANTILE)
 
     # 確保篩選所需的所有欄位都存在
-    cons_cols = ['StdDev_1Y', 'Beta_1Y', 'Dividend_Consecutive_Years', 'FCFPS_Last_4Q', 'Dividend_Yield', 'MarketCap_Billions']
-    mod_cols = ['StdDev_1Y', 'ROE_Avg_3Y', 'Revenue_YoY_Accumulated', 'MarketCap_Billions']
-    agg_cols = ['StdDev_1Y', 'Beta_1Y', 'Revenue_YoY_Accumulated', 'ROE_Latest_Quarter']
+    cons_cols, mod_cols, agg_cols = (STOCK_POOL_REQUIRED[name] for name in ('conservative', 'moderate', 'aggressive'))
 
     if all(col in df_stocks.columns for col in cons_cols):
-        pools['conservative'] = df_stocks[(df_stocks['StdDev_1Y'] <= low_vol_threshold) & (df_stocks['Beta_1Y'] < 1.0) & (df_stocks['Dividend_Consecutive_Years'] > 10) & (df_stocks['FCFPS_Last_4Q'] > 0)].sort_values(by=['Dividend_Yield', 'MarketCap_Billions'], ascending=[False, False])
-    else:
-        pools['conservative'] = pd.DataFrame()
-
+        masks['conservative'] = (df_stocks['StdDev_1Y'] <= low_vol_threshold) & (df_stocks['Beta_1Y'] < config.CONSERVATIVE_MAX_BETA) & (df_stocks['Dividend_Consecutive_Years'] > config.CONSERVATIVE_MIN_DIVIDEND_YEARS) & (df_stocks['FCFPS_Last_4Q'] > 0)
     if all(col in df_stocks.columns for col in mod_cols):
-        pools['moderate'] = df_stocks[(df_stocks['StdDev_1Y'].between(low_vol_threshold, high_vol_threshold)) & (df_stocks['ROE_Avg_3Y'] > 5) & (df_stocks['Revenue_YoY_Accumulated'] > 0)].sort_values(by=['ROE_Avg_3Y', 'MarketCap_Billions'], ascending=[False, False])
-    else:
-        pools['moderate'] = pd.DataFrame()
-
+        masks['moderate'] = (df_stocks['StdDev_1Y'].between(low_vol_threshold, high_vol_threshold)) & (df_stocks['ROE_Avg_3Y'] > config.MODERATE_MIN_ROE) & (df_stocks['Revenue_YoY_Accumulated'] > config.MODERATE_MIN_REVENUE_YOY)
     if all(col in df_stocks.columns for col in agg_cols):
-        pools['aggressive'] = df_stocks[(df_stocks['StdDev_1Y'] > high_vol_threshold) & (df_stocks['Beta_1Y'] > 1.1) & (df_stocks['Revenue_YoY_Accumulated'] > 15)].sort_values(by=['Revenue_YoY_Accumulated', 'ROE_Latest_Quarter'], ascending=[False, False])
-    else:
-        pools['aggressive'] = pd.DataFrame()
-        
+        masks['aggressive'] = (df_stocks['StdDev_1Y'] > high_vol_threshold) & (df_stocks['Beta_1Y'] > config.AGGRESSIVE_MIN_BETA) & (df_stocks['Revenue_YoY_Accumulated'] > config.AGGRESSIVE_MIN_REVENUE_YOY)
+    return masks
+
+@traced('screen.stock_pools')
+def create_stock_pools(df_stocks):
+    """建立個股標的池"""
+    pools = {}
+    for name, mask in stock_pool_masks(df_stocks).items():
+        if mask is None:
+            pools[name] = pd.DataFrame()
+        else:
+            sort_cols, ascending = STOCK_POOL_SORT[name]
+            pools[name] = df_stocks[mask].sort_values(by=sort_cols, ascending=ascending)
     return pools
 
+def etf_pool_masks(df_etf):
+    """各類型ETF池的布林遮罩；缺少名稱欄位時回傳 None"""
+    if '名稱' not in df_etf.columns:
+        return {name: None for name in ETF_POOL_PATTERNS}
+    return {name: df_etf['名稱'].str.contains(pattern, na=False) for name, pattern in ETF_POOL_PATTERNS.items()}
+
+@traced('screen.etf_pools')
 def create_etf_pools(df_etf):
     """建立ETF標的池"""
-    pools = {}
-    if '名稱' not in df_etf.columns:
-        return {
-            'market_cap': pd.DataFrame(), 'high_dividend': pd.DataFrame(), 'theme': pd.DataFrame(),
-            'gov_bond': pd.DataFrame(), 'corp_bond': pd.DataFrame()
+    return {name: (df_etf[mask] if mask is not None else pd.DataFrame())
+            for name, mask in etf_pool_masks(df_etf).items()}
+
+# --- Screening Index ---
+class ScreenIndex:
+    """
+    規則零與所有標的池的預先計算結果 (每個資料版本計算一次)。
+    以列位置陣列 (row positions) 記錄每個篩選結果，標的池 DataFrame 於首次取用時建立並快取，
+    之後每次請求皆為 O(1) 取用，不再隨標的總數成長。
+    標的池為共用的唯讀視圖，呼叫端如需修改請自行 .copy()。
+    """
+
+    def __init__(self, master_df):
+        with span('screen.index', rows=len(master_df)):
+            self._set_frame(master_df)
+            with span('screen.rule_zero'):
+                self._filtered_mask = rule_zero_mask(master_df).to_numpy()
+                self._index_positions()
+            with span('screen.stock_pools'):
+                self._compute_stock_pools()
+            with span('screen.etf_pools'):
+                self._compute_etf_pools()
+        self.recomputed = ['rule_zero', 'stock_pools', 'etf_pools']
+
+    def _set_frame(self, master_df):
+        self.master_df = master_df
+        self.version = master_df.attrs.get('data_version')
+        self._views = {}
+
+    def _index_positions(self):
+        # 在 Series 上比較 (分類欄位只需比對類別代碼)，避免先轉成逐列字串的 object 陣列
+        asset_type = self.master_df['AssetType']
+        is_stock = (asset_type == '個股').to_numpy(dtype=bool, na_value=False)
+        is_etf = (asset_type == 'ETF').to_numpy(dtype=bool, na_value=False)
+        self.positions = {
+            'filtered': np.flatnonzero(self._filtered_mask),
+            'stocks': np.flatnonzero(self._filtered_mask & is_stock),
+            'etf': np.flatnonzero(self._filtered_mask & is_etf),
         }
-    pools['market_cap'] = df_etf[df_etf['名稱'].str.contains('台灣50|公司治理|S&P 500|市值', na=False)]
-    pools['high_dividend'] = df_etf[df_etf['名稱'].str.contains('高股息|高息', na=False)]
-    pools['theme'] = df_etf[df_etf['名稱'].str.contains('半導體|科技|AI|電動車|綠能', na=False)]
-    pools['gov_bond'] = df_etf[df_etf['名稱'].str.contains('公債|政府債', na=False)]
-    pools['corp_bond'] = df_etf[df_etf['名稱'].str.contains('公司債|投資級', na=False)]
-    return pools
+
+    def _compute_stock_pools(self):
+        # 以列位置 (而非 StockID) 作為索引，排序後即可直接換算回 master_df 的列位置
+        df_stocks = self.master_df.iloc[self.positions['stocks']].reset_index(drop=True)
+        self.stock_pool_positions = {}
+        for name, mask in stock_pool_masks(df_stocks).items():
+            if mask is None:
+                self.stock_pool_positions[name] = None
+                continue
+            sort_cols, ascending = STOCK_POOL_SORT[name]
+            ordered = df_stocks[mask].sort_values(by=sort_cols, ascending=ascending)
+            self.stock_pool_positions[name] = self.positions['stocks'][ordered.index.to_numpy()]
+
+    def _compute_etf_pools(self):
+        df_etf = self.master_df.iloc[self.positions['etf']]
+        self.etf_pool_positions = {name: (self.positions['etf'][np.flatnonzero(mask.to_numpy())] if mask is not None else None)
+                                   for name, mask in etf_pool_masks(df_etf).items()}
+
+    @classmethod
+    def from_changes(cls, previous, master_df, changes):
+        """
+        由前一版本的 ScreenIndex 與 data_loader.apply_delta 的變動摘要增量建立新版本。
+        規則零只對變動的列重新判斷；個股池 (分位數門檻依整個個股集合而定) 與ETF池各自只在
+        成員集合或其依賴欄位有變動時才整組重算，否則沿用舊結果並換算列位置。
+        """
+        old_ids = previous.master_df.index
+        if changes['deleted']:
+            keep = ~old_ids.isin(changes['deleted'])
+        else:
+            keep = np.ones(len(old_ids), dtype=bool)
+        if len(master_df) != int(keep.sum()) + len(changes['added']):
+            # 不符合 apply_delta 的列順序約定：退回完整計算
+            return cls(master_df)
+
+        # 舊列位置 -> 新列位置 (刪除的列為 -1)
+        remap = np.full(len(old_ids), -1, dtype=np.int64)
+        remap[keep] = np.arange(int(keep.sum()))
+
+        screen = cls.__new__(cls)
+        screen._set_frame(master_df)
+        changed = master_df.index.get_indexer(changes['updated'] + changes['added'])
+        screen._filtered_mask = np.zeros(len(master_df), dtype=bool)
+        screen._filtered_mask[remap[keep]] = previous._filtered_mask[keep]
+        if len(changed):
+            screen._filtered_mask[changed] = rule_zero_mask(master_df.iloc[changed]).to_numpy()
+        screen._index_positions()
+        screen.recomputed = ['rule_zero']
+
+        changed_columns = set(changes['columns'])
+        for group, pool_columns, attr, compute in [
+                ('stocks', STOCK_POOL_COLUMNS, 'stock_pool_positions', screen._compute_stock_pools),
+                ('etf', ETF_POOL_COLUMNS, 'etf_pool_positions', screen._compute_etf_pools)]:
+            members_changed = not np.array_equal(remap[previous.positions[group]], screen.positions[group])
+            values_changed = bool(changed_columns & pool_columns) and np.isin(changed, screen.positions[group]).any()
+            if members_changed or values_changed:
+                compute()
+                screen.recomputed.append(f"{'stock' if group == 'stocks' else 'etf'}_pools")
+            else:
+                setattr(screen, attr, {name: (remap[pos] if pos is not None else None)
+                                       for name, pos in getattr(previous, attr).items()})
+        return screen
+
+    def _view(self, key, positions):
+        if key not in self._views:
+            self._views[key] = self.master_df.iloc[positions] if positions is not None else pd.DataFrame()
+        return self._views[key]
+
+    @property
+    def filtered(self):
+        return self._view('filtered', self.positions['filtered'])
+
+    @property
+    def stocks(self):
+        return self._view('stocks', self.positions['stocks'])
+
+    @property
+    def etf(self):
+        return self._view('etf', self.positions['etf'])
+
+    @property
+    def stock_pools(self):
+        return {name: self._view(('stock', name), pos) for name, pos in self.stock_pool_positions.items()}
+
+    @property
+    def etf_pools(self):
+        return {name: self._view(('etf', name), pos) for name, pos in self.etf_pool_positions.items()}
+
+_SCREEN_INDEX_CACHE = {}
+SCREEN_INDEX_CACHE_SIZE = 4
+
+def get_screen_index(master_df):
+    """依資料版本取得 (或建立) ScreenIndex；同一版本只計算一次"""
+    version = master_df.attrs.get('data_version')
+    key = version if version is not None else id(master_df)
+    screen = _SCREEN_INDEX_CACHE.get(key)
+    # 沒有資料版本時以物件身分為鍵，需確認確實為同一個 DataFrame
+    if screen is None or (version is None and screen.master_df is not master_df):
+        screen = _cache_screen_index(key, ScreenIndex(master_df))
+    return screen
+
+def update_screen_index(previous, master_df, changes):
+    """由前一版本的 ScreenIndex 增量建立 master_df (apply_delta 的結果) 的 ScreenIndex 並加入快取"""
+    version = master_df.attrs.get('data_version')
+    return _cache_screen_index(version if version is not None else id(master_df),
+                               ScreenIndex.from_changes(previous, master_df, changes))
+
+def _cache_screen_index(key, screen):
+    _SCREEN_INDEX_CACHE[key] = screen
+    while len(_SCREEN_INDEX_CACHE) > SCREEN_INDEX_CACHE_SIZE:
+        _SCREEN_INDEX_CACHE.pop(next(iter(_SCREEN_INDEX_CACHE)))
+    return screen
 
 # --- Portfolio Construction Logic ---
 
@@ -139,8 +344,27 @@ def _build_etf_component(risk_profile, etf_pools):
     return portfolio_df.dropna(subset=['Weight'])
 
 
-def build_portfolio(risk_profile, portfolio_type, stock_pools, etf_pools, forced_include=None):
-    """主函數：根據精煉版規則建構投資組合。"""
+# 各 (組合類型, 風險偏好) 的個股/衛星持股數量區間 [low, high) (config 參數名稱)，以及對應的個股池
+STOCK_COUNT_SETTINGS = {
+    ('純個股', '保守型'): 'CONSERVATIVE_STOCK_COUNT',
+    ('純個股', '穩健型'): 'MODERATE_STOCK_COUNT',
+    ('純個股', '積極型'): 'AGGRESSIVE_STOCK_COUNT',
+    ('混合型', '保守型'): 'CONSERVATIVE_SATELLITE_COUNT',
+    ('混合型', '穩健型'): 'MODERATE_SATELLITE_COUNT',
+    ('混合型', '積極型'): 'AGGRESSIVE_SATELLITE_COUNT',
+}
+RISK_STOCK_POOL = {'保守型': 'conservative', '穩健型': 'moderate', '積極型': 'aggressive'}
+
+def _draw_stock_count(risk_profile, portfolio_type, stock_pools, rng):
+    """以 rng (numpy.random.Generator) 抽出本次的持股數量；不需抽樣 (純ETF) 或個股池為空時回傳 None"""
+    count_range = getattr(config, STOCK_COUNT_SETTINGS.get((portfolio_type, risk_profile), ''), None)
+    pool = stock_pools.get(RISK_STOCK_POOL.get(risk_profile), pd.DataFrame())
+    if count_range is None or pool.empty:
+        return None
+    return int(rng.integers(*count_range))
+
+def _construct_portfolio(risk_profile, portfolio_type, stock_pools, etf_pools, count):
+    """依規則建構給定持股數量的投資組合 (尚未正規化權重)"""
     portfolio_df = pd.DataFrame()
 
     # --- 純個股投資組合 ---
@@ -148,25 +372,22 @@ def build_portfolio(risk_profile, portfolio_type, stock_pools, etf_pools, forced
         if risk_profile == '保守型':
             pool = stock_pools.get('conservative', pd.DataFrame())
             if not pool.empty:
-                count = np.random.randint(*config.CONSERVATIVE_STOCK_COUNT)
                 portfolio_df = pool.sort_values(by=['Dividend_Yield', 'MarketCap_Billions'], ascending=[False, False])
-                portfolio_df = portfolio_df.groupby('Industry').head(config.MAX_INDUSTRY_CONCENTRATION).head(count).copy()
-                if not portfolio_df.empty: portfolio_df['Weight'] = apply_factor_weighting(portfolio_df, 'Dividend_Yield')
+                portfolio_df = portfolio_df.groupby('Industry', observed=True).head(config.MAX_INDUSTRY_CONCENTRATION).head(count).copy()
+                if not portfolio_df.empty: portfolio_df['Weight'] = apply_optimized_weighting(portfolio_df, 'Dividend_Yield', risk_profile)
         
         elif risk_profile == '穩健型':
             pool = stock_pools.get('moderate', pd.DataFrame())
             if not pool.empty:
-                count = np.random.randint(*config.MODERATE_STOCK_COUNT)
                 portfolio_df = pool.sort_values(by=['ROE_Avg_3Y', 'MarketCap_Billions'], ascending=[False, False])
-                portfolio_df = portfolio_df.groupby('Industry').head(config.MAX_INDUSTRY_CONCENTRATION).head(count).copy()
-                if not portfolio_df.empty: portfolio_df['Weight'] = apply_factor_weighting(portfolio_df, 'ROE_Avg_3Y')
+                portfolio_df = portfolio_df.groupby('Industry', observed=True).head(config.MAX_INDUSTRY_CONCENTRATION).head(count).copy()
+                if not portfolio_df.empty: portfolio_df['Weight'] = apply_optimized_weighting(portfolio_df, 'ROE_Avg_3Y', risk_profile)
 
         elif risk_profile == '積極型':
             pool = stock_pools.get('aggressive', pd.DataFrame())
             if not pool.empty:
-                count = np.random.randint(*config.AGGRESSIVE_STOCK_COUNT)
                 portfolio_df = pool.sort_values(by=['Revenue_YoY_Accumulated', 'ROE_Latest_Quarter'], ascending=[False, False]).head(count).copy()
-                if not portfolio_df.empty: portfolio_df['Weight'] = apply_factor_weighting(portfolio_df, 'Revenue_YoY_Accumulated')
+                if not portfolio_df.empty: portfolio_df['Weight'] = apply_optimized_weighting(portfolio_df, 'Revenue_YoY_Accumulated', risk_profile)
 
     # --- 純ETF投資組合 ---
     elif portfolio_type == '純ETF':
@@ -182,7 +403,6 @@ def build_portfolio(risk_profile, portfolio_type, stock_pools, etf_pools, forced
             core_portfolio = _build_etf_component(risk_profile, etf_pools)
             satellite_pool = stock_pools.get('conservative', pd.DataFrame())
             if not satellite_pool.empty:
-                count = np.random.randint(3, 6)
                 satellite_portfolio = satellite_pool.sort_values(by='MarketCap_Billions', ascending=False).head(count).copy()
                 if not satellite_portfolio.empty: satellite_portfolio['Weight'] = apply_factor_weighting(satellite_portfolio, 'Dividend_Yield')
 
@@ -191,7 +411,6 @@ def build_portfolio(risk_profile, portfolio_type, stock_pools, etf_pools, forced
             core_portfolio = _build_etf_component(risk_profile, etf_pools)
             satellite_pool = stock_pools.get('moderate', pd.DataFrame())
             if not satellite_pool.empty:
-                count = np.random.randint(3, 6)
                 satellite_portfolio = satellite_pool.sort_values(by='ROE_Avg_3Y', ascending=False).head(count).copy()
                 if not satellite_portfolio.empty: satellite_portfolio['Weight'] = apply_factor_weighting(satellite_portfolio, 'ROE_Avg_3Y')
 
@@ -200,7 +419,6 @@ def build_portfolio(risk_profile, portfolio_type, stock_pools, etf_pools, forced
             core_portfolio = _build_etf_component(risk_profile, etf_pools)
             satellite_pool = stock_pools.get('aggressive', pd.DataFrame())
             if not satellite_pool.empty:
-                count = np.random.randint(2, 5)
                 satellite_portfolio = satellite_pool.sort_values(by='Revenue_YoY_Accumulated', ascending=False).head(count).copy()
                 if not satellite_portfolio.empty: satellite_portfolio['Weight'] = apply_factor_weighting(satellite_portfolio, 'Revenue_YoY_Accumulated')
             
@@ -211,7 +429,10 @@ def build_portfolio(risk_profile, portfolio_type, stock_pools, etf_pools, forced
             
         portfolio_df = pd.concat([core_portfolio, satellite_portfolio])
 
-    # --- 後續處理 ---
+    return portfolio_df
+
+def _finalize_portfolio(portfolio_df):
+    """正規化權重、依權重排序並計算 HHI"""
     if portfolio_df.empty or 'Weight' not in portfolio_df.columns:
         return pd.DataFrame(), 0 
 
@@ -221,11 +442,265 @@ def build_portfolio(risk_profile, portfolio_type, stock_pools, etf_pools, forced
     else: # 如果權重總和為0，則均等分配
         portfolio_df['Weight'] = 1 / len(portfolio_df) if len(portfolio_df) > 0 else 0
 
-    if forced_include is not None:
-        # 動態調整邏輯
-        pass
-    
     final_portfolio = portfolio_df.sort_values('Weight', ascending=False)
     hhi_value = calculate_hhi(final_portfolio['Weight'])
     
-    return final_portfolio, hhi_value
\ No newline at end of file
+    return final_portfolio, hhi_value
+
+def _resolve_forced_include(forced_include, master_df=None):
+    """
+    forced_include 可為 None、StockID、StockID 的串列，或 master_df 的一列 (Series) / 多列 (DataFrame)。
+    StockID 以 master_df 轉為對應的列；找不到的代號拋出 KeyError。回傳 None、Series 或 DataFrame。
+    """
+    if forced_include is None or isinstance(forced_include, (pd.Series, pd.DataFrame)):
+        return forced_include
+    ids = [forced_include] if isinstance(forced_include, str) else list(dict.fromkeys(map(str, forced_include)))
+    if not ids:
+        return None
+    if master_df is None:
+        raise ValueError("以 StockID 指定 forced_include 時必須提供 master_df")
+    missing = [sid for sid in ids if sid not in master_df.index]
+    if missing:
+        raise KeyError(f"找不到代號: {', '.join(missing)}")
+    return master_df.loc[ids]
+
+@traced('portfolio.build')
+def build_portfolio(risk_profile, portfolio_type, stock_pools, etf_pools, forced_include=None, seed=None, rng=None,
+                    master_df=None):
+    """
+    主函數：根據精煉版規則建構投資組合。
+    持股數量 (純個股與混合型的衛星部位) 由 rng 抽樣；未提供 rng 時以 np.random.default_rng(seed) 建立，
+    因此相同的 seed 與輸入必定得到相同的投資組合。seed 與 rng 皆未提供時每次結果可能不同。
+    forced_include 為 StockID、StockID 的串列 (需提供 master_df)，或 master_df 的一列 / 多列，
+    建構完成後以 rebalance_portfolio 納入組合。
+    """
+    forced_include = _resolve_forced_include(forced_include, master_df)
+    if rng is None:
+        rng = np.random.default_rng(seed)
+    count = _draw_stock_count(risk_profile, portfolio_type, stock_pools, rng)
+    portfolio_df = _construct_portfolio(risk_profile, portfolio_type, stock_pools, etf_pools, count)
+    portfolio_df, hhi_value = _finalize_portfolio(portfolio_df)
+    if forced_include is not None and not portfolio_df.empty:
+        portfolio_df, hhi_value = rebalance_portfolio(portfolio_df, risk_profile, portfolio_type, add=forced_include)
+    return portfolio_df, hhi_value
+
+# --- Incremental Rebalance ---
+# 各風險偏好用於個股 (純個股與混合型衛星部位) 權重的因子，與 _construct_portfolio 相同
+RISK_WEIGHT_FACTOR = {
+    '保守型': 'Dividend_Yield',
+    '穩健型': 'ROE_Avg_3Y',
+    '積極型': 'Revenue_YoY_Accumulated',
+}
+
+def _as_holdings(rows, template):
+    """master_df 的一列 (Series) 或多列 (DataFrame) -> 與 template 欄位型態一致的 DataFrame"""
+    frame = rows.to_frame().T if isinstance(rows, pd.Series) else rows
+    columns = [col for col in template.columns if col in frame.columns and col != 'Weight']
+    frame = frame[columns]
+    # 直接取自 master_df 的列型態已一致，只轉換不同的欄位 (Series 轉成的列皆為 object)
+    mismatched = {col: dtype for col, dtype in template[columns].dtypes.items() if frame[col].dtype != dtype}
+    return frame.astype(mismatched) if mismatched else frame.copy()
+
+def _sleeves(portfolio_df):
+    """每個持股所屬的部位：'stock' (個股) 或 'etf'"""
+    is_stock = (portfolio_df['AssetType'] == '個股').to_numpy(dtype=bool, na_value=False)
+    return np.where(is_stock, 'stock', 'etf')
+
+def _reweight_stock_sleeve(sleeve, risk_profile, portfolio_type, budget):
+    """依建構時的規則重新計算個股部位的權重 (總和為 budget)"""
+    factor = RISK_WEIGHT_FACTOR.get(risk_profile)
+    if portfolio_type == '純個股':
+        weights = apply_optimized_weighting(sleeve, factor, risk_profile)
+    else:
+        weights = apply_factor_weighting(sleeve, factor)
+    return weights * budget
+
+@traced('portfolio.rebalance')
+def rebalance_portfolio(portfolio_df, risk_profile, portfolio_type, add=None, remove=None):
+    """
+    在既有投資組合上增量加入或移除標的，只在局部重新計算權重，不重新篩選或建構整個組合。
+    add 為 master_df 的一列或多列；remove 為 StockID 或其串列。回傳 (新的投資組合, HHI)。
+    規則：
+    - 個股部位維持原本的總權重，依建構時的規則重新求解
+      (純個股以 apply_optimized_weighting 在 HHI、單檔與產業上限內最佳化；混合型衛星部位以因子加權)
+    - ETF 部位的配置比例是固定的：新加入的 ETF 在 ETF 部位內分得平均一份，其他 ETF 等比例縮減；
+      移除時其權重依比例分給其餘 ETF
+    - 組合中沒有同類部位時 (例如純ETF組合加入個股)，新標的分得全組合的平均一份，其餘等比例縮減
+    """
+    portfolio_df = portfolio_df.copy()
+    budgets = portfolio_df.groupby(_sleeves(portfolio_df))['Weight'].sum().to_dict()
+    reweight_stocks = False
+
+    if remove is not None:
+        removed = [remove] if isinstance(remove, str) else list(remove)
+        removed = [sid for sid in removed if sid in portfolio_df.index]
+        reweight_stocks = bool((_sleeves(portfolio_df.loc[removed]) == 'stock').any())
+        portfolio_df = portfolio_df.drop(index=removed)
+        etf = _sleeves(portfolio_df) == 'etf'
+        if etf.any():
+            portfolio_df.loc[etf, 'Weight'] *= budgets['etf'] / portfolio_df.loc[etf, 'Weight'].sum()
+
+    if add is not None:
+        added = _as_holdings(add, portfolio_df)
+        for stock_id in added.index[~added.index.isin(portfolio_df.index)]:
+            new_row = added.loc[[stock_id]]
+            sleeve = _sleeves(new_row)[0]
+            members = _sleeves(portfolio_df) == sleeve
+            if members.any() and sleeve == 'stock':
+                # 稍後與整個個股部位一起重新求解
+                new_row['Weight'] = 0.0
+                reweight_stocks = True
+            elif members.any():
+                k = int(members.sum())
+                portfolio_df.loc[members, 'Weight'] *= k / (k + 1)
+                new_row['Weight'] = budgets[sleeve] / (k + 1)
+            else:
+                n = len(portfolio_df)
+                portfolio_df['Weight'] *= n / (n + 1)
+                budgets = {name: budget * n / (n + 1) for name, budget in budgets.items()}
+                budgets[sleeve] = new_row['Weight'] = 1 / (n + 1)
+            portfolio_df = pd.concat([portfolio_df, new_row])
+
+    stocks = _sleeves(portfolio_df) == 'stock'
+    if reweight_stocks and stocks.any():
+        portfolio_df.loc[stocks, 'Weight'] = _reweight_stock_sleeve(
+            portfolio_df[stocks], risk_profile, portfolio_type, budgets['stock']).to_numpy()
+
+    return _finalize_portfolio(portfolio_df)
+
+def set_holding_weight(portfolio_df, stock_id, weight):
+    """
+    把單一持股的權重設為 weight (0 < weight < 1)，其餘持股等比例縮放使總和為 1。回傳 (新的投資組合, HHI)。
+    weight <= 0 等同移除；組合只有一檔時權重固定為 100%。
+    """
+    if stock_id not in portfolio_df.index:
+        raise KeyError(stock_id)
+    portfolio_df = portfolio_df.copy()
+    if weight <= 0:
+        return _finalize_portfolio(portfolio_df.drop(index=stock_id))
+    others = portfolio_df.index != stock_id
+    other_total = portfolio_df.loc[others, 'Weight'].sum()
+    if other_total > 0:
+        weight = min(weight, 1.0)
+        portfolio_df.loc[others, 'Weight'] *= (1 - weight) / other_total
+        portfolio_df.loc[stock_id, 'Weight'] = weight
+    return _finalize_portfolio(portfolio_df)
+
+# --- Portfolio Memo ---
+PORTFOLIO_CACHE_SIZE = 256
+_PORTFOLIO_CACHE = OrderedDict()
+_PORTFOLIO_CACHE_STATS = {'hits': 0, 'misses': 0}
+
+def _forced_include_key(forced_include):
+    """已解析的 forced_include (None、Series 或 DataFrame) -> 可雜湊的鍵 (StockID 的 tuple)"""
+    if forced_include is None:
+        return None
+    if isinstance(forced_include, pd.Series):
+        return (str(forced_include.name),)
+    return tuple(map(str, forced_include.index))
+
+def build_portfolio_cached(master_df, risk_profile, portfolio_type, seed, forced_include=None):
+    """
+    帶 LRU 記憶的 build_portfolio：以 (資料版本, 風險偏好, 組合類型, seed, forced_include) 為鍵，
+    命中時直接回傳先前的投資組合與 HHI 而不重新建構。seed 為 None 時結果不具決定性，因此不快取。
+    回傳的 DataFrame 為副本，呼叫端可自由修改。
+    """
+    screen = get_screen_index(master_df)
+    forced_include = _resolve_forced_include(forced_include, master_df)
+    if seed is None:
+        return build_portfolio(risk_profile, portfolio_type, screen.stock_pools, screen.etf_pools, forced_include=forced_include)
+
+    key = (screen.version, risk_profile, portfolio_type, seed, _forced_include_key(forced_include))
+    cached = _PORTFOLIO_CACHE.get(key) if screen.version is not None else None
+    if cached is not None:
+        _PORTFOLIO_CACHE.move_to_end(key)
+        _PORTFOLIO_CACHE_STATS['hits'] += 1
+        count('portfolio_cache_hits')
+        return cached[0].copy(), cached[1]
+
+    _PORTFOLIO_CACHE_STATS['misses'] += 1
+    count('portfolio_cache_misses')
+    portfolio_df, hhi_value = build_portfolio(risk_profile, portfolio_type, screen.stock_pools, screen.etf_pools,
+                                              forced_include=forced_include, seed=seed)
+    if screen.version is not None:
+        _PORTFOLIO_CACHE[key] = (portfolio_df.copy(), hhi_value)
+        while len(_PORTFOLIO_CACHE) > PORTFOLIO_CACHE_SIZE:
+            _PORTFOLIO_CACHE.popitem(last=False)
+    return portfolio_df, hhi_value
+
+def portfolio_cache_info():
+    """回傳投資組合快取的命中/未命中次數與目前大小"""
+    return {**_PORTFOLIO_CACHE_STATS, 'size': len(_PORTFOLIO_CACHE), 'max_size': PORTFOLIO_CACHE_SIZE}
+
+# --- Batch Portfolio Construction ---
+BATCH_OUTPUT_COLUMNS = ['StockID', '名稱', 'AssetType', 'Industry']
+
+class _PortfolioVariant:
+    """某個 (風險偏好, 組合類型, 持股數量) 的已完成投資組合，以 NumPy 陣列保存供批次組裝"""
+
+    def __init__(self, portfolio_df, hhi_value):
+        self.size = len(portfolio_df)
+        self.columns = {col: (portfolio_df[col].to_numpy(dtype=object) if col in portfolio_df.columns
+                              else np.full(self.size, None, dtype=object))
+                        for col in BATCH_OUTPUT_COLUMNS}
+        self.weights = portfolio_df['Weight'].to_numpy(dtype=float) if self.size else np.empty(0)
+        self.hhi = float(hhi_value)
+
+@traced('portfolio.batch')
+def build_portfolios_batch(client_requests, stock_pools, etf_pools, master_df=None):
+    """
+    批次建構多位客戶的投資組合，回傳單一長格式 (long-format) DataFrame。
+
+    client_requests 為 dict 的序列，欄位：
+        risk (必填)、type (必填)、amount (預設 0)、forced_include (預設 None)、seed (預設 None)、client_id (選填)
+    forced_include 可為 StockID、StockID 的串列 (兩者皆需提供 master_df)，或 master_df 的一列 (Series) / 多列 (DataFrame)；
+    找不到的代號拋出 KeyError。
+    同一 (風險偏好, 組合類型, 持股數量) 的組合只會以共用的標的池建構一次，
+    之後每筆請求僅需抽出持股數量並引用已完成的結果。
+    有 seed 的請求以 np.random.default_rng(seed) 抽樣；其餘共用同一個 Generator。
+    帶有 forced_include 的請求逐筆交由 build_portfolio 處理。
+    """
+    variants = {}
+    shared_rng = np.random.default_rng()
+    request_variants = []
+
+    for request in client_requests:
+        risk_profile, portfolio_type = request['risk'], request['type']
+        forced_include = _resolve_forced_include(request.get('forced_include'), master_df)
+
+        seed = request.get('seed')
+        rng = shared_rng if seed is None else np.random.default_rng(seed)
+
+        if forced_include is not None:
+            request_variants.append(_PortfolioVariant(*build_portfolio(
+                risk_profile, portfolio_type, stock_pools, etf_pools, forced_include=forced_include, rng=rng)))
+            continue
+
+        count = _draw_stock_count(risk_profile, portfolio_type, stock_pools, rng)
+
+        key = (risk_profile, portfolio_type, count)
+        variant = variants.get(key)
+        if variant is None:
+            portfolio_df = _construct_portfolio(risk_profile, portfolio_type, stock_pools, etf_pools, count)
+            variant = variants[key] = _PortfolioVariant(*_finalize_portfolio(portfolio_df))
+        request_variants.append(variant)
+
+    # --- 組裝長格式輸出 ---
+    sizes = np.array([variant.size for variant in request_variants], dtype=np.int64)
+    request_index = np.repeat(np.arange(len(request_variants)), sizes)
+    weights = np.concatenate([variant.weights for variant in request_variants]) if len(request_variants) else np.empty(0)
+    amounts = np.array([request.get('amount', 0) for request in client_requests], dtype=float)
+
+    result = pd.DataFrame({'request_index': request_index})
+    if any('client_id' in request for request in client_requests):
+        client_ids = np.array([request.get('client_id') for request in client_requests], dtype=object)
+        result['client_id'] = client_ids[request_index]
+    result['risk'] = np.array([request['risk'] for request in client_requests], dtype=object)[request_index]
+    result['type'] = np.array([request['type'] for request in client_requests], dtype=object)[request_index]
+    for col in BATCH_OUTPUT_COLUMNS:
+        result[col] = (np.concatenate([variant.columns[col] for variant in request_variants])
+                       if len(request_variants) else np.empty(0, dtype=object))
+    result['Weight'] = weights
+    result['Investment_Amount'] = weights * amounts[request_index]
+    result['HHI'] = np.array([variant.hhi for variant in request_variants])[request_index] if len(request_variants) else np.empty(0)
+    return result
@@ -0,0 +1,110 @@
+# llm_cache.py
+# LLM 回應快取：以「正規化後提示詞的雜湊 + 模型名稱」為鍵，存放於 SQLite，
+# 具備 TTL 過期、容量上限 (筆數與位元組) 的 LRU 淘汰，以及命中/未命中/延遲統計。
+
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+
+import config
+
+
+def normalize_prompt(prompt):
+    """去除每行首尾空白並壓縮連續空白行，讓僅縮排不同的相同提示詞得到相同的鍵"""
+    lines = [line.strip() for line in prompt.strip().splitlines()]
+    return re.sub(r'\n{3,}', '\n\n', '\n'.join(lines))
+
+
+def prompt_key(prompt, model_name):
+    return hashlib.sha256(f"{model_name}\x00{normalize_prompt(prompt)}".encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    """
+    以 SQLite 儲存的 LLM 回應快取 (跨行程、跨重新啟動共用)。
+    get() 命中時會更新 last_access；put() 後依 LRU 淘汰直到不超過 max_entries 與 max_bytes。
+    超過 ttl_seconds 的項目視同未命中並在淘汰時刪除。
+    """
+
+    def __init__(self, path=None, max_entries=None, max_bytes=None, ttl_seconds=None):
+        self.path = path or config.LLM_CACHE_PATH
+        self.max_entries = max_entries or config.LLM_CACHE_MAX_ENTRIES
+        self.max_bytes = max_bytes or config.LLM_CACHE_MAX_BYTES
+        self.ttl_seconds = ttl_seconds or config.LLM_CACHE_TTL_SECONDS
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'hit_seconds': 0.0, 'miss_seconds': 0.0, 'evictions': 0}
+
+        if self.path != ':memory:':
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL' if self.path != ':memory:' else 'PRAGMA journal_mode=MEMORY')
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                response TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )""")
+        self._conn.execute('CREATE INDEX IF NOT EXISTS idx_responses_last_access ON responses (last_access)')
+
+    def get(self, prompt, model_name):
+        """回傳快取的回應文字；未命中或已過期時回傳 None"""
+        key = prompt_key(prompt, model_name)
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute('SELECT response, created_at FROM responses WHERE key = ?', (key,)).fetchone()
+            if row is None or now - row[1] > self.ttl_seconds:
+                return None
+            self._conn.execute('UPDATE responses SET last_access = ? WHERE key = ?', (now, key))
+            return row[0]
+
+    def put(self, prompt, model_name, response):
+        key = prompt_key(prompt, model_name)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO responses (key, model, response, size, created_at, last_access) VALUES (?, ?, ?, ?, ?, ?)',
+                (key, model_name, response, len(response.encode('utf-8')), now, now))
+            self._evict(now)
+
+    def _evict(self, now):
+        expired = self._conn.execute('DELETE FROM responses WHERE created_at < ?', (now - self.ttl_seconds,)).rowcount
+        count, total = self._conn.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses').fetchone()
+        evicted = 0
+        if count > self.max_entries or total > self.max_bytes:
+            for key, size in self._conn.execute('SELECT key, size FROM responses ORDER BY last_access').fetchall():
+                if count <= self.max_entries and total <= self.max_bytes:
+                    break
+                self._conn.execute('DELETE FROM responses WHERE key = ?', (key,))
+                count, total, evicted = count - 1, total - size, evicted + 1
+        self._stats['evictions'] += expired + evicted
+
+    def record(self, hit, seconds):
+        """記錄一次查詢的結果與端到端延遲 (命中為讀快取時間，未命中為含模型生成的時間)"""
+        with self._lock:
+            if hit:
+                self._stats['hits'] += 1
+                self._stats['hit_seconds'] += seconds
+            else:
+                self._stats['misses'] += 1
+                self._stats['miss_seconds'] += seconds
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'], stats['bytes'] = self._conn.execute(
+                'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses').fetchone()
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+        stats['avg_hit_seconds'] = stats['hit_seconds'] / stats['hits'] if stats['hits'] else 0.0
+        stats['avg_miss_seconds'] = stats['miss_seconds'] / stats['misses'] if stats['misses'] else 0.0
+        return stats
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute('DELETE FROM responses')
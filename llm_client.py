@@ -0,0 +1,240 @@
+# llm_client.py
+# LLM 用戶端抽象層：在任何提供 generate_content(prompt, stream=False) 的後端
+# (google.generativeai 的 GenerativeModel 或 fake_llm.FakeGenerativeModel) 之上，
+# 加上 async API、token bucket 速率限制、併發上限、含抖動的指數退避重試與單次呼叫期限。
+
+import asyncio
+import contextlib
+import random
+import threading
+import time
+import weakref
+
+import config
+
+# 可重試的錯誤 (以類別名稱判斷，避免在此模組強制匯入 google SDK)
+RETRYABLE_ERROR_NAMES = {
+    'ResourceExhausted',      # 429 配額/速率限制
+    'TooManyRequests',
+    'ServiceUnavailable',     # 503
+    'InternalServerError',    # 500
+    'DeadlineExceeded',       # 504
+    'TimeoutError',
+    'ConnectionError',
+}
+
+
+class TokenBucket:
+    """
+    非同步 token bucket：平均每秒 rate 次，最多累積 capacity 次的突發量。
+    同一個 bucket 會被不同事件迴圈 (背景迴圈、服務的迴圈) 使用，因此以執行緒鎖保護狀態，不使用綁定迴圈的 asyncio.Lock。
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    async def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            await asyncio.sleep(wait)
+
+
+class _TextResponse:
+    """與 generate_content 回應相容的最小物件"""
+
+    def __init__(self, text):
+        self.text = text
+
+
+# --- 背景事件迴圈 ---
+# 同步呼叫端 (例如 Streamlit 腳本執行緒) 的請求都送到同一個事件迴圈，
+# 讓速率限制與併發上限在整個行程內共用。
+_background_loop = None
+_background_loop_lock = threading.Lock()
+
+def _get_background_loop():
+    global _background_loop
+    with _background_loop_lock:
+        if _background_loop is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name='llm-client-loop', daemon=True).start()
+            _background_loop = loop
+        return _background_loop
+
+def _release_when_done(future, slot):
+    """工作執行緒無法中斷：逾時或取消後仍佔用併發名額，直到執行緒真正結束才釋出"""
+    def release(done):
+        if not done.cancelled():
+            done.exception()        # 取出例外，避免 "exception was never retrieved" 警告
+        slot.release()
+
+    if future.done():
+        slot.release()
+    else:
+        future.add_done_callback(release)
+
+
+class LLMClient:
+    """
+    包裝 LLM 後端的用戶端。
+    - async API：agenerate(prompt) 與 astream(prompt)
+    - 同步 API：generate_content(prompt, stream=False)，介面與 GenerativeModel 相同，可直接取代原本的模型物件
+    每次呼叫先取得 token bucket 與併發名額；可重試的錯誤以 base_delay * 2^n (上限 max_delay) 加上全幅抖動後重試；
+    單次呼叫超過 timeout 秒視為 TimeoutError (同樣可重試)。串流只在尚未輸出任何內容前重試。
+    逾時的呼叫在工作執行緒結束前持續佔用併發名額，重試不會在背景疊加超過 max_concurrency 個阻塞呼叫。
+    併發名額依事件迴圈各自建立 (asyncio.Semaphore 只能在建立它的迴圈中使用)；速率限制則為整個行程共用。
+    """
+
+    def __init__(self, backend, rate_per_second=None, burst=None, max_concurrency=None, max_retries=None,
+                 base_delay=None, max_delay=None, timeout=None):
+        self.backend = backend
+        self.model_name = getattr(backend, 'model_name', type(backend).__name__)
+        self.max_retries = config.LLM_MAX_RETRIES if max_retries is None else max_retries
+        self.base_delay = config.LLM_RETRY_BASE_DELAY if base_delay is None else base_delay
+        self.max_delay = config.LLM_RETRY_MAX_DELAY if max_delay is None else max_delay
+        self.timeout = config.LLM_TIMEOUT_SECONDS if timeout is None else timeout
+        self.max_concurrency = max_concurrency or config.LLM_MAX_CONCURRENCY
+        self._bucket = TokenBucket(rate_per_second or config.LLM_RATE_PER_SECOND, burst or config.LLM_BURST)
+        self._semaphores = weakref.WeakKeyDictionary()     # 事件迴圈 -> asyncio.Semaphore
+        self._semaphores_lock = threading.Lock()
+        self.stats = {'calls': 0, 'attempts': 0, 'retries': 0, 'timeouts': 0, 'failures': 0}
+
+    # --- async API ---
+    def _slot(self):
+        loop = asyncio.get_running_loop()
+        with self._semaphores_lock:
+            semaphore = self._semaphores.get(loop)
+            if semaphore is None:
+                semaphore = self._semaphores[loop] = asyncio.Semaphore(self.max_concurrency)
+        return semaphore
+
+    async def _generate_once(self, prompt):
+        slot = self._slot()
+        await slot.acquire()
+        call = None
+        try:
+            await self._bucket.acquire()
+            self.stats['attempts'] += 1
+            call = asyncio.ensure_future(asyncio.to_thread(self.backend.generate_content, prompt))
+            # shield：逾時只停止等待，名額交由 _release_when_done 在執行緒結束後釋出
+            response = await asyncio.wait_for(asyncio.shield(call), self.timeout)
+            return response.text
+        finally:
+            if call is None:
+                slot.release()
+            else:
+                _release_when_done(call, slot)
+
+    def _retry_delay(self, attempt):
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+    def _should_retry(self, error, attempt):
+        return attempt < self.max_retries and type(error).__name__ in RETRYABLE_ERROR_NAMES
+
+    async def agenerate(self, prompt):
+        """非同步生成完整回應文字"""
+        self.stats['calls'] += 1
+        attempt = 0
+        while True:
+            try:
+                return await self._generate_once(prompt)
+            except asyncio.TimeoutError:
+                self.stats['timeouts'] += 1
+                error = TimeoutError(f"LLM call exceeded {self.timeout}s")
+            except Exception as e:
+                error = e
+            if not self._should_retry(error, attempt):
+                self.stats['failures'] += 1
+                raise error
+            self.stats['retries'] += 1
+            await asyncio.sleep(self._retry_delay(attempt))
+            attempt += 1
+
+    async def astream(self, prompt):
+        """非同步串流，逐段 yield 文字；每段之間等待超過 timeout 秒視為逾時"""
+        self.stats['calls'] += 1
+        attempt = 0
+        while True:
+            emitted = False
+            try:
+                slot = self._slot()
+                await slot.acquire()
+                try:
+                    await self._bucket.acquire()
+                except BaseException:
+                    slot.release()
+                    raise
+                self.stats['attempts'] += 1
+                # aclosing：串流提前結束時立即關閉內層產生器，釋出名額
+                async with contextlib.aclosing(self._stream_once(prompt, slot)) as chunks:
+                    async for text in chunks:
+                        emitted = True
+                        yield text
+                return
+            except asyncio.TimeoutError:
+                self.stats['timeouts'] += 1
+                error = TimeoutError(f"LLM stream stalled for more than {self.timeout}s")
+            except Exception as e:
+                error = e
+            if emitted or not self._should_retry(error, attempt):
+                self.stats['failures'] += 1
+                raise error
+            self.stats['retries'] += 1
+            await asyncio.sleep(self._retry_delay(attempt))
+            attempt += 1
+
+    async def _stream_once(self, prompt, slot):
+        """在工作執行緒中迭代後端的同步串流，透過 asyncio.Queue 交給事件迴圈；slot 在工作執行緒結束後釋出"""
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+
+        def produce():
+            try:
+                for chunk in self.backend.generate_content(prompt, stream=True):
+                    loop.call_soon_threadsafe(queue.put_nowait, ('chunk', chunk.text))
+                loop.call_soon_threadsafe(queue.put_nowait, ('done', None))
+            except Exception as e:
+                loop.call_soon_threadsafe(queue.put_nowait, ('error', e))
+
+        producer = loop.run_in_executor(None, produce)
+        try:
+            while True:
+                kind, value = await asyncio.wait_for(queue.get(), self.timeout)
+                if kind == 'done':
+                    return
+                if kind == 'error':
+                    raise value
+                if value:
+                    yield value
+        finally:
+            _release_when_done(producer, slot)
+
+    # --- 同步 API (與 GenerativeModel.generate_content 相容) ---
+    def generate_content(self, prompt, stream=False):
+        loop = _get_background_loop()
+        if stream:
+            return self._sync_stream(prompt, loop)
+        return _TextResponse(asyncio.run_coroutine_threadsafe(self.agenerate(prompt), loop).result())
+
+    def _sync_stream(self, prompt, loop):
+        agen = self.astream(prompt)
+        try:
+            while True:
+                try:
+                    text = asyncio.run_coroutine_threadsafe(agen.__anext__(), loop).result()
+                except StopAsyncIteration:
+                    return
+                yield _TextResponse(text)
+        finally:
+            asyncio.run_coroutine_threadsafe(agen.aclose(), loop).result()
@@ -0,0 +1,178 @@
+# loadtest.py
+# service.py 的負載測試：以固定併發數的 keep-alive 連線送出混合請求，回報各端點的 p50 / p90 / p99 延遲與吞吐量。
+# 未指定 --url 時自動以假 LLM 與假新聞來源 (--fake-llm --stub-news) 啟動一個本地服務行程。
+# 用法：python loadtest.py --requests 500 --concurrency 16 --mix portfolio=6,analytics=3,report=1
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+from urllib.parse import urlsplit
+
+import numpy as np
+import pandas as pd
+
+RISK_PROFILES = ['保守型', '穩健型', '積極型']
+PORTFOLIO_TYPES = ['純個股', '純ETF', '混合型']
+ENDPOINT_METHODS = {'portfolio': 'POST', 'analytics': 'POST', 'report': 'POST', 'health': 'GET'}
+
+
+class HTTPConnection:
+    """單一 keep-alive 連線的最小 HTTP/1.1 用戶端 (只支援 Content-Length 回應)"""
+
+    def __init__(self, host, port):
+        self.host, self.port = host, port
+        self.reader = self.writer = None
+
+    async def request(self, method, path, payload=None):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8') if payload is not None else b''
+        self.writer.write((f"{method} {path} HTTP/1.1\r\nHost: {self.host}\r\n"
+                           f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n\r\n").encode('latin-1') + body)
+        await self.writer.drain()
+        status = int((await self.reader.readline()).split()[1])
+        headers = {}
+        while True:
+            line = await self.reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        data = await self.reader.readexactly(int(headers.get('content-length', 0)))
+        if headers.get('connection', '').lower() == 'close':
+            self.close()
+        return status, json.loads(data) if data else None
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.reader = self.writer = None
+
+
+def parse_mix(text):
+    """'portfolio=6,analytics=3,report=1' -> {端點: 比重}"""
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        if name.strip() not in ENDPOINT_METHODS:
+            raise ValueError(f"未知的端點: {name}")
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+def make_requests(n, mix, seeds, seed=0):
+    """依比重隨機產生 n 個請求 (端點, 請求內容)"""
+    rng = random.Random(seed)
+    names, weights = list(mix), list(mix.values())
+    requests = []
+    for _ in range(n):
+        name = rng.choices(names, weights)[0]
+        payload = None if name == 'health' else {
+            'risk': rng.choice(RISK_PROFILES), 'type': rng.choice(PORTFOLIO_TYPES), 'seed': rng.randrange(seeds)}
+        requests.append((name, payload))
+    return requests
+
+async def run_load(host, port, requests, concurrency):
+    """以 concurrency 條連線消化請求佇列，回傳每個請求的 (端點, 狀態碼, 延遲秒數)"""
+    queue = asyncio.Queue()
+    for item in requests:
+        queue.put_nowait(item)
+    results = []
+
+    async def worker():
+        connection = HTTPConnection(host, port)
+        try:
+            while not queue.empty():
+                name, payload = queue.get_nowait()
+                start = time.perf_counter()
+                try:
+                    status, _ = await connection.request(ENDPOINT_METHODS[name], f"/{name}", payload)
+                except (ConnectionError, asyncio.IncompleteReadError, ValueError, IndexError):
+                    connection.close()
+                    status = 0
+                results.append((name, status, time.perf_counter() - start))
+        finally:
+            connection.close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return results, time.perf_counter() - start
+
+def summarize(results, elapsed):
+    """各端點與整體的延遲百分位數 (毫秒) 與吞吐量"""
+    frame = pd.DataFrame(results, columns=['endpoint', 'status', 'seconds'])
+    rows = []
+    for name, group in list(frame.groupby('endpoint')) + [('ALL', frame)]:
+        ms = group['seconds'].to_numpy() * 1000
+        rows.append({'endpoint': name, 'requests': len(group), 'errors': int((group['status'] != 200).sum()),
+                     'p50_ms': np.percentile(ms, 50), 'p90_ms': np.percentile(ms, 90), 'p99_ms': np.percentile(ms, 99),
+                     'max_ms': ms.max(), 'rps': len(group) / elapsed})
+    return pd.DataFrame(rows)
+
+# --- 本地服務 ---
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def start_local_service(port, workers=None, llm_latency=0.5, news_latency=0.05, timeout=120):
+    """以假後端啟動 service.py 子行程，等待 /health 回應後回傳 Popen"""
+    command = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'service.py'),
+               '--port', str(port), '--fake-llm', '--stub-news', '--no-llm-cache',
+               '--llm-latency', str(llm_latency), '--news-latency', str(news_latency)]
+    if workers:
+        command += ['--workers', str(workers)]
+    process = subprocess.Popen(command, cwd=os.path.dirname(os.path.abspath(__file__)),
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("本地服務啟動失敗")
+        try:
+            status, _ = asyncio.run(HTTPConnection('127.0.0.1', port).request('GET', '/health'))
+            if status == 200:
+                return process
+        except OSError:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError("等待本地服務就緒逾時")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='service.py 負載測試')
+    parser.add_argument('--url', help='既有服務的網址 (例如 http://127.0.0.1:8000)；未指定時以假後端啟動本地服務')
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--mix', default='portfolio=6,analytics=3,report=1')
+    parser.add_argument('--seeds', type=int, default=50, help='請求中 seed 的取值個數 (影響投資組合快取命中率)')
+    parser.add_argument('--warmup', type=int, default=20, help='正式量測前的暖機請求數')
+    parser.add_argument('--workers', type=int, default=None, help='本地服務的 worker 行程數')
+    parser.add_argument('--llm-latency', type=float, default=0.5)
+    parser.add_argument('--news-latency', type=float, default=0.05)
+    args = parser.parse_args()
+
+    process = None
+    if args.url:
+        parts = urlsplit(args.url)
+        host, port = parts.hostname, parts.port or 80
+    else:
+        host, port = '127.0.0.1', _free_port()
+        print(f"以假後端啟動本地服務 (port {port})...")
+        process = start_local_service(port, args.workers, args.llm_latency, args.news_latency)
+    try:
+        mix = parse_mix(args.mix)
+        if args.warmup:
+            asyncio.run(run_load(host, port, make_requests(args.warmup, mix, args.seeds, seed=1), args.concurrency))
+        results, elapsed = asyncio.run(run_load(host, port, make_requests(args.requests, mix, args.seeds),
+                                                args.concurrency))
+        print(f"{args.requests} 個請求，併發 {args.concurrency}，總耗時 {elapsed:.2f} 秒")
+        print(summarize(results, elapsed).to_string(index=False, float_format=lambda v: f"{v:,.1f}"))
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
@@ -0,0 +1,155 @@
+# portfolio_analytics.py
+# 向量化投資組合分析：以「投資組合 × 標的宇宙」的權重矩陣一次計算數千個投資組合的
+# HHI、有效持股數、加權 Beta、加權波動率、加權殖利率，以及產業別 / 資產類型曝險。
+# 權重矩陣可為 NumPy 密集陣列、SparseWeights (COO 三元組)，或任何提供 tocoo() 的稀疏矩陣 (例如 scipy.sparse)。
+
+import numpy as np
+import pandas as pd
+
+# 加權平均的因子：輸出欄位名稱 -> master_df 欄位
+ANALYTICS_FACTORS = {
+    'Beta': 'Beta_1Y',
+    'Volatility': 'StdDev_1Y',
+    'Dividend_Yield': 'Dividend_Yield',
+}
+# 曝險維度 (分類欄位)
+EXPOSURE_COLUMNS = ['Industry', 'AssetType']
+
+SUMMARY_COLUMNS = ['Holdings', 'Total_Weight', 'HHI', 'Effective_N'] + list(ANALYTICS_FACTORS)
+
+
+class SparseWeights:
+    """COO 格式的權重矩陣：第 rows[i] 個投資組合持有標的宇宙第 cols[i] 檔，權重 values[i]"""
+
+    def __init__(self, rows, cols, values, shape):
+        self.rows = np.asarray(rows, dtype=np.int64)
+        self.cols = np.asarray(cols, dtype=np.int64)
+        self.values = np.asarray(values, dtype=np.float64)
+        self.shape = shape
+
+
+class AnalyticsUniverse:
+    """
+    標的宇宙的分析用陣列 (每個資料版本建立一次)：
+    factors 為 (標的數 × 因子數) 的 float64 矩陣 (缺值為 NaN)；exposures 為各分類欄位的 (類別代碼, 類別名稱)。
+    """
+
+    def __init__(self, master_df):
+        self.version = master_df.attrs.get('data_version')
+        self.ids = master_df.index
+        self.factor_names = list(ANALYTICS_FACTORS)
+        self.factors = np.column_stack([
+            master_df[col].to_numpy(dtype=np.float64, na_value=np.nan) if col in master_df.columns
+            else np.full(len(master_df), np.nan)
+            for col in ANALYTICS_FACTORS.values()])
+        self.exposures = {}
+        for col in EXPOSURE_COLUMNS:
+            if col not in master_df.columns:
+                continue
+            categorical = master_df[col].astype('category')
+            self.exposures[col] = (categorical.cat.codes.to_numpy(), categorical.cat.categories)
+
+    @property
+    def size(self):
+        return len(self.ids)
+
+    def positions(self, stock_ids):
+        """StockID -> 標的宇宙的列位置；找不到的代號回傳 -1"""
+        return self.ids.get_indexer(stock_ids)
+
+_UNIVERSE_CACHE = {}
+UNIVERSE_CACHE_SIZE = 4
+
+def get_universe(master_df):
+    """依資料版本取得 (或建立) AnalyticsUniverse"""
+    version = master_df.attrs.get('data_version')
+    universe = _UNIVERSE_CACHE.get(version) if version is not None else None
+    if universe is None:
+        universe = AnalyticsUniverse(master_df)
+        if version is not None:
+            _UNIVERSE_CACHE[version] = universe
+            while len(_UNIVERSE_CACHE) > UNIVERSE_CACHE_SIZE:
+                _UNIVERSE_CACHE.pop(next(iter(_UNIVERSE_CACHE)))
+    return universe
+
+# --- 權重矩陣建構 ---
+def portfolio_weights(portfolio_df, universe):
+    """單一投資組合 (含 Weight 欄位、以 StockID 為索引) -> 1 列的 SparseWeights"""
+    return _long_weights(np.zeros(len(portfolio_df), dtype=np.int64), portfolio_df.index,
+                         portfolio_df['Weight'].to_numpy(dtype=np.float64), 1, universe)
+
+def batch_weights(batch_df, universe, n_portfolios=None):
+    """build_portfolios_batch 的長格式輸出 -> 每筆請求一列的 SparseWeights"""
+    rows = batch_df['request_index'].to_numpy(dtype=np.int64)
+    if n_portfolios is None:
+        n_portfolios = int(rows.max()) + 1 if len(rows) else 0
+    return _long_weights(rows, batch_df['StockID'], batch_df['Weight'].to_numpy(dtype=np.float64), n_portfolios, universe)
+
+def _long_weights(rows, stock_ids, values, n_portfolios, universe):
+    cols = universe.positions(stock_ids)
+    found = cols >= 0
+    if not found.all():
+        print(f"警告：{int((~found).sum())} 筆持股不在標的宇宙中，已略過。")
+    return SparseWeights(rows[found], cols[found], values[found], (n_portfolios, universe.size))
+
+def _to_coo(weights):
+    """任一種權重矩陣 -> (rows, cols, values, 投資組合數)"""
+    if isinstance(weights, np.ndarray):
+        weights = np.atleast_2d(weights)
+        rows, cols = np.nonzero(weights)
+        return rows, cols, weights[rows, cols].astype(np.float64), weights.shape[0]
+    if isinstance(weights, SparseWeights):
+        return weights.rows, weights.cols, weights.values, weights.shape[0]
+    coo = weights.tocoo()
+    return (coo.row.astype(np.int64), coo.col.astype(np.int64), np.asarray(coo.data, dtype=np.float64), coo.shape[0])
+
+# --- 分析 ---
+def compute_analytics(weights, universe):
+    """
+    對權重矩陣的每一列 (一個投資組合) 計算指標，回傳 (summary, exposures)：
+    - summary: 每個投資組合一列，欄位見 SUMMARY_COLUMNS
+      因子為以有資料的持股權重重新正規化後的加權平均 (例如ETF沒有 StdDev_1Y 時不列入)；
+      Volatility 為個別標的年化標準差的加權平均 (未考慮相關性，為投資組合波動率的上限估計)
+    - exposures: {分類欄位: 投資組合 × 類別 的權重 DataFrame}，只保留至少一個投資組合有曝險的類別
+    所有指標皆由同一組 COO 三元組以 np.bincount 彙總，成本與持股總筆數成正比，與標的宇宙大小無關。
+    """
+    rows, cols, values, n_portfolios = _to_coo(weights)
+
+    holdings = np.bincount(rows, weights=(values != 0).astype(np.float64), minlength=n_portfolios)
+    total = np.bincount(rows, weights=values, minlength=n_portfolios)
+    hhi = np.bincount(rows, weights=values ** 2, minlength=n_portfolios)
+
+    summary = pd.DataFrame({'Holdings': holdings.astype(np.int64), 'Total_Weight': total, 'HHI': hhi})
+    with np.errstate(divide='ignore', invalid='ignore'):
+        summary['Effective_N'] = np.where(hhi > 0, 1 / hhi, np.nan)
+        held_factors = universe.factors[cols]
+        known = ~np.isnan(held_factors)
+        for j, name in enumerate(universe.factor_names):
+            covered = np.bincount(rows, weights=values * known[:, j], minlength=n_portfolios)
+            weighted = np.bincount(rows, weights=values * np.where(known[:, j], held_factors[:, j], 0.0),
+                                   minlength=n_portfolios)
+            summary[name] = np.where(covered > 0, weighted / covered, np.nan)
+
+    exposures = {}
+    for col, (codes, categories) in universe.exposures.items():
+        held_codes = codes[cols]
+        valid = held_codes >= 0
+        n_categories = len(categories)
+        matrix = np.bincount(rows[valid] * n_categories + held_codes[valid], weights=values[valid],
+                             minlength=n_portfolios * n_categories).reshape(n_portfolios, n_categories)
+        used = np.flatnonzero(matrix.any(axis=0))
+        exposures[col] = pd.DataFrame(matrix[:, used], columns=pd.Index(categories[used], name=col))
+    return summary, exposures
+
+def analyze_portfolio(portfolio_df, master_df):
+    """單一投資組合的分析 (供 app.py 顯示)：回傳 (指標 Series, {分類欄位: 曝險 Series (由大到小)})"""
+    universe = get_universe(master_df)
+    summary, exposures = compute_analytics(portfolio_weights(portfolio_df, universe), universe)
+    return summary.iloc[0], {col: frame.iloc[0].sort_values(ascending=False) for col, frame in exposures.items()}
+
+def analyze_batch(batch_df, master_df):
+    """批次投資組合的分析：以 build_portfolios_batch 的輸出計算每筆請求的指標與曝險"""
+    universe = get_universe(master_df)
+    summary, exposures = compute_analytics(batch_weights(batch_df, universe), universe)
+    summary.index.name = 'request_index'
+    return summary, exposures
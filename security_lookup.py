@@ -0,0 +1,223 @@
+# security_lookup.py
+# 證券代號與名稱的記憶體查詢索引 (每個資料版本建立一次)，以及聊天調整指令 (加入 / 移除 / 調整權重) 的解析。
+# 查詢順序：代號完全相符 > 名稱 (含變體) 完全相符 > 代號或名稱前綴 > 名稱字元 n-gram 模糊比對。
+# 指令在呼叫 LLM 之前先於本地解析，使「加入台積電」這類不含代號的句子也能直接調整組合。
+
+import re
+import unicodedata
+from bisect import bisect_left
+from collections import defaultdict
+from dataclasses import dataclass, field
+
+import numpy as np
+
+NGRAM_SIZE = 2
+DEFAULT_LIMIT = 5
+MIN_MATCH_SCORE = 0.5          # 低於此分數的模糊比對不視為候選
+CONFIDENT_SCORE = 0.8          # 指令解析時，最佳候選高於此分數 (且領先次佳候選) 才直接採用
+PREFIX_SCAN_LIMIT = 200        # 前綴比對最多檢查的名稱數
+
+# 名稱正規化：全形轉半形、英文小寫、「臺」統一為「台」，去除空白與標記符號 (例如「矽力*-KY」的 *)
+_NAME_REPLACEMENTS = str.maketrans({'臺': '台', '*': None, ' ': None, '　': None})
+# 名稱變體：去掉 -KY 等註記後的簡稱
+_VARIANT_SUFFIXES = re.compile(r'-?ky$')
+
+def normalize_name(text):
+    return unicodedata.normalize('NFKC', str(text)).lower().translate(_NAME_REPLACEMENTS)
+
+def _ngrams(text, n=NGRAM_SIZE):
+    if len(text) <= n:
+        return {text} if text else set()
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+
+@dataclass
+class SecurityMatch:
+    stock_id: str
+    name: str
+    score: float
+    match_type: str             # 'code' | 'name' | 'prefix' | 'fuzzy'
+
+
+class SecurityIndex:
+    """
+    master_df (index 為 StockID，含 '名稱' 欄) 的查詢索引。
+    所有結構在建立時一次算好：代號與名稱變體的雜湊表、排序後的代號與名稱 (前綴以二分搜尋)、名稱 n-gram 的倒排索引。
+    """
+
+    def __init__(self, master_df):
+        self.stock_ids = np.asarray(master_df.index.astype(str), dtype=object)
+        self.names = np.asarray(master_df['名稱'].astype(str), dtype=object)
+        self.version = master_df.attrs.get('data_version')
+
+        # 名稱變體 (alias) -> 證券位置；同一證券可有多個變體
+        aliases, owners = [], []
+        for pos, name in enumerate(self.names):
+            normalized = normalize_name(name)
+            for alias in dict.fromkeys([normalized, _VARIANT_SUFFIXES.sub('', normalized)]):
+                if alias:
+                    aliases.append(alias)
+                    owners.append(pos)
+        self.aliases = aliases
+        self.alias_owner = np.asarray(owners, dtype=np.int64)
+        self.alias_sizes = np.array([len(_ngrams(alias)) for alias in aliases], dtype=np.float64)
+        self.max_alias_length = max(map(len, aliases), default=0)
+
+        self.by_code = {sid.lower(): pos for pos, sid in enumerate(self.stock_ids)}
+        self.by_alias = {}
+        for alias_pos, alias in enumerate(aliases):
+            self.by_alias.setdefault(alias, alias_pos)
+        self.sorted_codes = sorted(self.by_code)
+        self.sorted_aliases = sorted(self.by_alias)
+
+        postings = defaultdict(list)
+        for alias_pos, alias in enumerate(aliases):
+            for gram in _ngrams(alias):
+                postings[gram].append(alias_pos)
+        self.postings = {gram: np.asarray(ids, dtype=np.int64) for gram, ids in postings.items()}
+
+    def __len__(self):
+        return len(self.stock_ids)
+
+    def _match(self, pos, score, match_type):
+        return SecurityMatch(self.stock_ids[pos], self.names[pos], float(score), match_type)
+
+    def _prefixed(self, sorted_keys, prefix):
+        start = bisect_left(sorted_keys, prefix)
+        for key in sorted_keys[start:start + PREFIX_SCAN_LIMIT]:
+            if not key.startswith(prefix):
+                break
+            yield key
+
+    def lookup(self, query, limit=DEFAULT_LIMIT):
+        """依分數由高到低回傳最多 limit 個 SecurityMatch (每個證券只出現一次)"""
+        text = normalize_name(query)
+        if not text:
+            return []
+        best = {}
+
+        def offer(pos, score, match_type):
+            if pos not in best or score > best[pos].score:
+                best[pos] = self._match(pos, score, match_type)
+
+        if text in self.by_code:
+            offer(self.by_code[text], 1.0, 'code')
+        if text in self.by_alias:
+            offer(self.alias_owner[self.by_alias[text]], 1.0, 'name')
+        # 前綴：查詢越接近完整名稱分數越高 (0.8 ~ 0.95)
+        for code in self._prefixed(self.sorted_codes, text):
+            offer(self.by_code[code], 0.8 + 0.15 * len(text) / len(code), 'prefix')
+        for alias in self._prefixed(self.sorted_aliases, text):
+            offer(self.alias_owner[self.by_alias[alias]], 0.8 + 0.15 * len(text) / len(alias), 'prefix')
+
+        # n-gram：Dice 係數 2|A∩B| / (|A|+|B|)
+        grams = [self.postings[gram] for gram in _ngrams(text) if gram in self.postings]
+        if grams:
+            shared = np.bincount(np.concatenate(grams), minlength=len(self.aliases))
+            candidates = np.flatnonzero(shared)
+            scores = 2 * shared[candidates] / (self.alias_sizes[candidates] + len(_ngrams(text)))
+            # 模糊比對分數上限低於前綴比對
+            for alias_pos, score in zip(candidates, 0.8 * scores):
+                if score >= MIN_MATCH_SCORE:
+                    offer(self.alias_owner[alias_pos], score, 'fuzzy')
+
+        return sorted(best.values(), key=lambda m: (-m.score, m.stock_id))[:limit]
+
+    def find_in_text(self, text):
+        """
+        在一段文字中找出第一個出現的完整代號或名稱 (同一起點取最長者)，回傳 (SecurityMatch, 起點, 終點) 或 None。
+        例如「如果我想加入台積電會如何」-> 台積電。
+        """
+        normalized = normalize_name(text)
+        for start in range(len(normalized)):
+            # 代號前後不可緊接英數字 (避免把 20000 元的一部分當成代號)
+            if start > 0 and normalized[start - 1].isascii() and normalized[start - 1].isalnum():
+                continue
+            for end in range(min(len(normalized), start + self.max_alias_length), start, -1):
+                piece = normalized[start:end]
+                if piece in self.by_code and not (end < len(normalized) and normalized[end].isascii()
+                                                  and normalized[end].isalnum()):
+                    return self._match(self.by_code[piece], 1.0, 'code'), start, end
+                if piece in self.by_alias:
+                    return self._match(self.alias_owner[self.by_alias[piece]], 1.0, 'name'), start, end
+        return None
+
+
+_SECURITY_INDEX_CACHE = {}
+SECURITY_INDEX_CACHE_SIZE = 4
+
+def get_security_index(master_df):
+    """依資料版本取得 (或建立) SecurityIndex；同一版本只建立一次"""
+    version = master_df.attrs.get('data_version')
+    key = version if version is not None else id(master_df)
+    index = _SECURITY_INDEX_CACHE.get(key)
+    if index is None or (version is None and len(index) != len(master_df)):
+        index = _SECURITY_INDEX_CACHE[key] = SecurityIndex(master_df)
+        while len(_SECURITY_INDEX_CACHE) > SECURITY_INDEX_CACHE_SIZE:
+            _SECURITY_INDEX_CACHE.pop(next(iter(_SECURITY_INDEX_CACHE)))
+    return index
+
+# --- 聊天調整指令 ---
+# 調整權重必須有明確的調整動詞；單獨出現「配置」「比例」加上百分比 (例如「配置是 60% 股票嗎？」) 只是提問
+_REWEIGHT_VERBS = re.compile(r'(調整|調到|調為|調成|改為|改成|改到|設為|設成|設定為|降到|降為|降低到|提高到|提高為|拉高到|增加到|減少到|減到)')
+_WEIGHT_WORDS = re.compile(r'(權重|比重|比例|配置)')
+_PERCENT_PATTERN = re.compile(r'(\d+(?:\.\d+)?)\s*(%|％|趴|成)')
+_INTENT_VERBS = {
+    'add': re.compile(r'(加入|納入|增加|買進|買入|放入|放進|新增)'),
+    'remove': re.compile(r'(移除|剔除|刪除|拿掉|去掉|賣出|賣掉|出清|排除|移出)'),
+}
+# 徵詢意見的問句 (例如「什麼時候應該賣出？」「我應該加入台積電嗎？」) 交給 LLM 回答，不視為指令
+_QUESTION_PATTERN = re.compile(r'(為什麼|為何|什麼|何時|是否|適合|應該|應不應|該不該|要不要|可不可以|能不能)')
+# 指令目標後常見的語尾，模糊比對前先去除
+_TRAILING_WORDS = re.compile(r'(到|進|至)?(我的)?(投資)?(組合|portfolio)?(中|裡|內)?(的話|會如何|會怎樣|呢|嗎|吧|好了|看看|一下)*[?？!！。.,，\s]*$')
+
+
+@dataclass
+class ChatIntent:
+    action: str                  # 'add' | 'remove' | 'reweight'
+    query: str                   # 使用者指稱標的的原始片段
+    match: SecurityMatch = None  # 可直接採用的標的 (None 代表無法確定)
+    candidates: list = field(default_factory=list)
+    weight: float = None         # reweight 的目標權重 (0~1)
+
+
+def parse_chat_intent(prompt, index):
+    """
+    解析聊天訊息中的調整指令，回傳 ChatIntent；不是調整指令時回傳 None (交給 LLM 回答)。
+    目標標的以 index 解析：先找文字中完整出現的代號或名稱，找不到時以動詞後的片段做模糊查詢；
+    模糊查詢沒有任何候選時同樣回傳 None，避免把一般問題誤判為指令。
+    """
+    if _QUESTION_PATTERN.search(prompt):
+        return None
+    percent = _PERCENT_PATTERN.search(prompt)
+    if percent and _REWEIGHT_VERBS.search(prompt, 0, percent.start()):
+        value = float(percent.group(1))
+        action, verb_end, weight = 'reweight', 0, value / 10 if percent.group(2) == '成' else value / 100
+    else:
+        weight = None
+        for action, pattern in _INTENT_VERBS.items():
+            verb = pattern.search(prompt)
+            if verb:
+                verb_end = verb.end()
+                break
+        else:
+            return None
+
+    target = prompt[verb_end:]
+    if action == 'reweight':
+        # 目標在數字之前 (例如「把台積電的權重調到 20%」)
+        target = prompt[:percent.start()]
+    found = index.find_in_text(target)
+    if found is not None:
+        match = found[0]
+        return ChatIntent(action, match.name, match=match, candidates=[match], weight=weight)
+
+    query = _TRAILING_WORDS.sub('', _WEIGHT_WORDS.sub('', _REWEIGHT_VERBS.sub('', target))).strip('把將 的')
+    candidates = index.lookup(query) if query else []
+    if not candidates:
+        return None
+    match = None
+    if candidates[0].score >= CONFIDENT_SCORE and (
+            len(candidates) == 1 or candidates[0].score - candidates[1].score > 0.05):
+        match = candidates[0]
+    return ChatIntent(action, query, match=match, candidates=candidates, weight=weight)
@@ -0,0 +1,315 @@
+# service.py
+# 無介面的 HTTP/JSON 服務：不需瀏覽器工作階段即可呼叫投資組合建構、分析與報告生成。
+# - 資料常駐記憶體：主行程與每個 worker 各自持有 DataStore (依資料版本共用 ScreenIndex 與投資組合 LRU 快取)
+# - CPU 工作 (篩選、建構、分析) 在 spawn 的行程池中執行，不阻塞事件迴圈
+# - 新聞與 LLM 的 I/O 在 asyncio 事件迴圈上等待 (新聞請求在執行緒中併發)
+# 只使用標準函式庫 (asyncio streams) 實作 HTTP/1.1 (含 keep-alive)。
+# 用法：python service.py --port 8000 --workers 4
+#       python service.py --fake-llm --stub-news   (以本地假模型與假新聞來源執行，供負載測試使用)
+#
+# 端點：
+#   GET  /health
+#   POST /portfolio  {"risk": "穩健型", "type": "混合型", "seed": 0, "forced_include": "2330"}
+#   POST /analytics  {"holdings": [{"StockID": "2330", "Weight": 0.5}, ...]}  或與 /portfolio 相同的建構參數
+#   POST /report     與 /portfolio 相同的建構參數
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import config
+from data_store import DataStore
+from investment_analyzer import build_portfolio_cached, BATCH_OUTPUT_COLUMNS
+from portfolio_analytics import analyze_portfolio
+
+RISK_PROFILES = ['保守型', '穩健型', '積極型']
+PORTFOLIO_TYPES = ['純個股', '純ETF', '混合型']
+HOLDING_COLUMNS = BATCH_OUTPUT_COLUMNS + ['Weight']
+MAX_BODY_BYTES = 1024 * 1024
+
+HTTP_REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 409: 'Conflict',
+                413: 'Payload Too Large', 500: 'Internal Server Error', 503: 'Service Unavailable'}
+
+
+class ServiceError(Exception):
+    """回傳給用戶端的錯誤 (HTTP 狀態碼 + 訊息)；可在 worker 與主行程之間序列化"""
+
+    def __init__(self, status, message):
+        super().__init__(status, message)
+        self.status = status
+        self.message = message
+
+
+# --- Worker (行程池) ---
+_WORKER_STORE = None
+
+def _init_worker():
+    global _WORKER_STORE
+    _WORKER_STORE = DataStore()
+    _WORKER_STORE.refresh_if_stale()
+
+def _worker_screen():
+    screen = _WORKER_STORE.refresh_if_stale()
+    if screen is None:
+        raise ServiceError(503, "資料尚未載入")
+    return screen
+
+def _worker_warm():
+    return os.getpid(), _worker_screen().version
+
+def _worker_build(risk_profile, portfolio_type, seed, forced_include):
+    """建構投資組合，回傳 (資料版本, 持股 DataFrame, HHI)"""
+    screen = _worker_screen()
+    if forced_include is not None and forced_include not in screen.master_df.index:
+        raise ServiceError(400, f"找不到代號 {forced_include}")
+    portfolio_df, hhi_value = build_portfolio_cached(screen.master_df, risk_profile, portfolio_type, seed, forced_include)
+    columns = [col for col in HOLDING_COLUMNS if col in portfolio_df.columns]
+    return screen.version, portfolio_df[columns], float(hhi_value)
+
+def _worker_analytics(holdings, build_args):
+    """分析給定持股 (StockID, Weight) 或依建構參數先建構再分析，回傳 JSON 相容的結果"""
+    screen = _worker_screen()
+    if holdings is None:
+        _, portfolio_df, _ = _worker_build(*build_args)
+    else:
+        portfolio_df = pd.DataFrame(holdings, columns=['StockID', 'Weight']).set_index('StockID')
+        unknown = portfolio_df.index[~portfolio_df.index.isin(screen.master_df.index)]
+        if len(unknown):
+            raise ServiceError(400, f"找不到代號 {', '.join(unknown[:5])}")
+    summary, exposures = analyze_portfolio(portfolio_df, screen.master_df)
+    return {
+        'data_version': screen.version,
+        'summary': _jsonable(summary.to_dict()),
+        'exposures': {col: _jsonable(series.to_dict()) for col, series in exposures.items()},
+    }
+
+def _jsonable(values):
+    """NumPy 純量與 NaN 轉為 JSON 可表示的值"""
+    result = {}
+    for key, value in values.items():
+        if isinstance(value, (np.integer, np.floating)):
+            value = value.item()
+        if isinstance(value, float) and not np.isfinite(value):
+            value = None
+        result[str(key)] = value
+    return result
+
+def _holdings_json(portfolio_df):
+    return [_jsonable(row) for row in portfolio_df.to_dict(orient='records')]
+
+
+# --- 服務 ---
+class PortfolioService:
+    """
+    HTTP 請求的處理邏輯 (與傳輸層分開，方便在同一行程中直接呼叫 handle())。
+    model 為報告用的 LLM (預設為 ai_helper.get_llm())；news_provider 為新聞來源 (預設為 yfinance)。
+    """
+
+    def __init__(self, workers=None, model=None, news_provider=None, store=None):
+        self.workers = workers or config.SERVICE_WORKERS or os.cpu_count()
+        self.model = model
+        self.news_provider = news_provider
+        self.store = store or DataStore()
+        self.executor = None
+        self.started = None
+        self.stats = {'requests': 0, 'errors': 0}
+
+    async def start(self):
+        """載入資料並啟動 (暖機) 所有 worker，讓第一個請求不必等待資料載入"""
+        self.executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'),
+                                            initializer=_init_worker)
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self.store.refresh_if_stale)
+        # 每個 worker 各送一個暖機任務 (同時送出，行程池會啟動所有 worker)
+        warmed = await asyncio.gather(*(loop.run_in_executor(self.executor, _worker_warm) for _ in range(self.workers)))
+        self.started = time.time()
+        print(f"服務已就緒：{len({pid for pid, _ in warmed})} 個 worker，資料版本 {self.store.current().version}。")
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(cancel_futures=True)
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    @staticmethod
+    def _build_args(payload):
+        risk_profile, portfolio_type = payload.get('risk'), payload.get('type')
+        if risk_profile not in RISK_PROFILES:
+            raise ServiceError(400, f"risk 必須為 {'、'.join(RISK_PROFILES)} 之一")
+        if portfolio_type not in PORTFOLIO_TYPES:
+            raise ServiceError(400, f"type 必須為 {'、'.join(PORTFOLIO_TYPES)} 之一")
+        seed = payload.get('seed', 0)
+        if not isinstance(seed, int):
+            raise ServiceError(400, "seed 必須為整數")
+        forced_include = payload.get('forced_include')
+        return risk_profile, portfolio_type, seed, str(forced_include) if forced_include is not None else None
+
+    # --- 端點 ---
+    async def health(self, payload):
+        current = self.store.current()
+        return {'status': 'ok', 'data_version': current.version if current else None, 'workers': self.workers,
+                'uptime_seconds': time.time() - self.started if self.started else 0.0, **self.stats}
+
+    async def portfolio(self, payload):
+        version, portfolio_df, hhi_value = await self._run(_worker_build, *self._build_args(payload))
+        return {'data_version': version, 'hhi': hhi_value, 'holdings': _holdings_json(portfolio_df)}
+
+    async def analytics(self, payload):
+        holdings = payload.get('holdings')
+        if holdings is not None:
+            if not isinstance(holdings, list) or not all(isinstance(h, dict) and 'StockID' in h and 'Weight' in h
+                                                         for h in holdings):
+                raise ServiceError(400, "holdings 必須為包含 StockID 與 Weight 的物件陣列")
+            return await self._run(_worker_analytics, [(str(h['StockID']), float(h['Weight'])) for h in holdings], None)
+        return await self._run(_worker_analytics, None, self._build_args(payload))
+
+    async def report(self, payload):
+        import ai_helper
+
+        args = self._build_args(payload)
+        version, portfolio_df, hhi_value = await self._run(_worker_build, *args)
+        current = await asyncio.to_thread(self.store.refresh_if_stale)
+        if current is None:
+            raise ServiceError(503, "資料尚未載入")
+        # 報告必須以建構組合時的同一資料版本檢索持股數據；主行程已不保留 (或尚未載入) 該版本時不可混用其他版本
+        screen = self.store.snapshot(version)
+        if screen is None:
+            raise ServiceError(409, f"資料版本 {version} 已不在服務的資料儲存中 (目前版本 {current.version})，請重新送出請求")
+        text, retrieval = await ai_helper.agenerate_rag_report(args[0], args[1], portfolio_df, screen.master_df, hhi_value,
+                                                               model=self.model, news_provider=self.news_provider)
+        return {'data_version': version, 'hhi': hhi_value, 'holdings': _holdings_json(portfolio_df),
+                'news': retrieval['news'], 'report': text, 'stats': retrieval['stats']}
+
+    ROUTES = {
+        ('GET', '/health'): 'health',
+        ('POST', '/portfolio'): 'portfolio',
+        ('POST', '/analytics'): 'analytics',
+        ('POST', '/report'): 'report',
+    }
+
+    async def handle(self, method, path, body):
+        """處理一個請求，回傳 (HTTP 狀態碼, JSON 物件)"""
+        self.stats['requests'] += 1
+        try:
+            route = self.ROUTES.get((method, path))
+            if route is None:
+                known = any(route_path == path for _, route_path in self.ROUTES)
+                raise ServiceError(405 if known else 404, f"{method} {path} 不存在")
+            try:
+                payload = json.loads(body) if body else {}
+            except ValueError:
+                raise ServiceError(400, "請求內容不是有效的 JSON")
+            if not isinstance(payload, dict):
+                raise ServiceError(400, "請求內容必須為 JSON 物件")
+            return 200, await getattr(self, route)(payload)
+        except ServiceError as e:
+            self.stats['errors'] += 1
+            return e.status, {'error': e.message}
+        except Exception as e:
+            self.stats['errors'] += 1
+            print(f"處理 {method} {path} 時發生錯誤: {e!r}")
+            return 500, {'error': str(e)}
+
+
+# --- HTTP 傳輸層 ---
+async def _handle_connection(service, reader, writer):
+    """處理一條連線上的請求 (HTTP/1.1 keep-alive：同一連線可依序送出多個請求)"""
+    try:
+        while True:
+            request_line = await reader.readline()
+            if not request_line.strip():
+                break
+            method, target, version = request_line.decode('latin-1').split()
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip()
+
+            length = int(headers.get('content-length') or 0)
+            if length > MAX_BODY_BYTES:
+                status, payload = 413, {'error': '請求內容過大'}
+                headers['connection'] = 'close'
+            else:
+                body = await reader.readexactly(length) if length else b''
+                status, payload = await service.handle(method, target.split('?', 1)[0], body)
+
+            keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+            data = json.dumps(payload, ensure_ascii=False, default=str).encode('utf-8')
+            writer.write((f"HTTP/1.1 {status} {HTTP_REASONS.get(status, '')}\r\n"
+                          f"Content-Type: application/json; charset=utf-8\r\n"
+                          f"Content-Length: {len(data)}\r\n"
+                          f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n").encode('latin-1') + data)
+            await writer.drain()
+            if not keep_alive:
+                break
+    except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+        pass
+    finally:
+        writer.close()
+
+async def serve(service, host=None, port=None, ready=None):
+    """啟動服務並持續處理請求；ready (asyncio.Event) 會在開始接受連線後設定"""
+    await service.start()
+    server = await asyncio.start_server(lambda r, w: _handle_connection(service, r, w),
+                                        host or config.SERVICE_HOST, port or config.SERVICE_PORT)
+    print(f"HTTP 服務監聽於 http://{host or config.SERVICE_HOST}:{port or config.SERVICE_PORT}")
+    if ready is not None:
+        ready.set()
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        service.close()
+
+# --- 本地假後端 (負載測試用) ---
+class StubNewsProvider:
+    """固定回傳三則新聞標題的新聞來源，可設定每次請求的延遲 (模擬網路)"""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+
+    def __call__(self, ticker):
+        time.sleep(self.latency)
+        return [{'title': f"{ticker} 測試新聞 {i}"} for i in range(3)]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='投資組合 HTTP/JSON 服務')
+    parser.add_argument('--host', default=config.SERVICE_HOST)
+    parser.add_argument('--port', type=int, default=config.SERVICE_PORT)
+    parser.add_argument('--workers', type=int, default=None, help='CPU 工作的行程數 (預設為 CPU 核心數)')
+    parser.add_argument('--fake-llm', action='store_true', help='以 fake_llm 取代 Gemini')
+    parser.add_argument('--llm-latency', type=float, default=0.5, help='假模型的回應延遲 (秒)')
+    parser.add_argument('--stub-news', action='store_true', help='以固定內容的假新聞來源取代 yfinance')
+    parser.add_argument('--news-latency', type=float, default=0.05, help='假新聞來源的每次延遲 (秒)')
+    parser.add_argument('--no-llm-cache', action='store_true', help='停用 LLM 回應快取 (負載測試時量測真實生成延遲)')
+    args = parser.parse_args()
+
+    model = news_provider = None
+    if args.fake_llm:
+        from fake_llm import FakeGenerativeModel
+        from llm_client import LLMClient
+        # 假模型不需要速率限制；以 LLMClient 包裝以使用其 async API
+        model = LLMClient(FakeGenerativeModel(first_token_delay=args.llm_latency), rate_per_second=10000, burst=10000,
+                          max_concurrency=256)
+    if args.stub_news:
+        news_provider = StubNewsProvider(args.news_latency)
+    if args.no_llm_cache:
+        config.LLM_CACHE_ENABLED = False
+
+    service = PortfolioService(workers=args.workers, model=model, news_provider=news_provider)
+    try:
+        asyncio.run(serve(service, args.host, args.port))
+    except KeyboardInterrupt:
+        pass
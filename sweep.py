@@ -0,0 +1,287 @@
+# sweep.py
+# 策略參數掃描：以格點或隨機抽樣產生多組 config 策略參數 (規則零門檻、個股池門檻、持股數量、HHI 上限、
+# ETF / 混合型配置藍圖…)，在行程池中平行評估每組參數的標的池大小、投資組合特性與 (選用的) 回測績效，
+# 結果彙整為一張表。master_df 與報酬面板只放進共享記憶體一次，各 worker 直接附加使用，不逐筆任務序列化。
+# 用法：python sweep.py --samples 200 --workers 4 --prices backtest_data/prices.parquet --output sweep.csv
+
+import argparse
+import itertools
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+import config
+from investment_analyzer import ScreenIndex, build_portfolio
+from portfolio_analytics import get_universe, portfolio_weights, compute_analytics
+
+# 可掃描的 config 參數
+SWEEP_PARAMETERS = [
+    'MIN_MARKET_CAP_BILLIONS', 'MIN_LISTING_DAYS',
+    'CONSERVATIVE_STOCK_COUNT', 'MODERATE_STOCK_COUNT', 'AGGRESSIVE_STOCK_COUNT',
+    'CONSERVATIVE_SATELLITE_COUNT', 'MODERATE_SATELLITE_COUNT', 'AGGRESSIVE_SATELLITE_COUNT',
+    'MAX_INDUSTRY_CONCENTRATION', 'HHI_CONSERVATIVE_MAX', 'HHI_MODERATE_MAX', 'HHI_AGGRESSIVE_MAX',
+    'MIN_POSITION_WEIGHT', 'MAX_POSITION_WEIGHT', 'MAX_INDUSTRY_WEIGHT',
+    'LOW_VOL_QUANTILE', 'HIGH_VOL_QUANTILE', 'CONSERVATIVE_MAX_BETA', 'CONSERVATIVE_MIN_DIVIDEND_YEARS',
+    'MODERATE_MIN_ROE', 'MODERATE_MIN_REVENUE_YOY', 'AGGRESSIVE_MIN_BETA', 'AGGRESSIVE_MIN_REVENUE_YOY',
+    'CONSERVATIVE_ETF_ALLOC', 'MODERATE_ETF_ALLOC', 'AGGRESSIVE_ETF_ALLOC',
+    'CONSERVATIVE_HYBRID_ALLOC', 'MODERATE_HYBRID_ALLOC', 'AGGRESSIVE_HYBRID_ALLOC',
+]
+
+# 預設的掃描空間：參數名稱 -> 候選值
+DEFAULT_SWEEP_SPACE = {
+    'MIN_MARKET_CAP_BILLIONS': [30, 50, 100],
+    'LOW_VOL_QUANTILE': [0.20, 0.30, 0.40],
+    'HIGH_VOL_QUANTILE': [0.60, 0.70, 0.80],
+    'CONSERVATIVE_MAX_BETA': [0.8, 1.0],
+    'MODERATE_MIN_ROE': [5, 8, 12],
+    'AGGRESSIVE_MIN_BETA': [1.0, 1.1, 1.2],
+    'AGGRESSIVE_MIN_REVENUE_YOY': [10, 15, 25],
+    'HHI_MODERATE_MAX': [0.20, 0.25, 0.30],
+    'MODERATE_ETF_ALLOC': [{'stocks': 50, 'bonds': 50}, {'stocks': 60, 'bonds': 40}, {'stocks': 70, 'bonds': 30}],
+    'MODERATE_HYBRID_ALLOC': [{'core': 70, 'satellite': 30}, {'core': 60, 'satellite': 40}],
+}
+
+RISK_PROFILES = ['保守型', '穩健型', '積極型']
+PORTFOLIO_TYPES = ['純個股', '純ETF', '混合型']
+ALL_COMBINATIONS = list(itertools.product(RISK_PROFILES, PORTFOLIO_TYPES))
+
+BACKTEST_METRICS = ['CAGR', 'Volatility', 'Sharpe', 'Max_Drawdown', 'Annual_Turnover']
+
+# --- 參數組合 ---
+def parameter_grid(space):
+    """掃描空間的完整格點 (所有候選值的笛卡兒積)"""
+    names = list(space)
+    return [dict(zip(names, values)) for values in itertools.product(*(space[name] for name in names))]
+
+def sample_parameters(space, n, seed=0):
+    """自掃描空間隨機抽出 n 組參數 (每個參數獨立地從候選值中均勻抽樣)"""
+    rng = np.random.default_rng(seed)
+    return [{name: values[rng.integers(len(values))] for name, values in space.items()} for _ in range(n)]
+
+@contextmanager
+def strategy_parameters(params):
+    """
+    暫時以 params 覆寫 config 的策略參數，離開時還原。
+    會修改整個行程共用的 config，只適合在參數掃描的 worker 行程 (或單執行緒腳本) 中使用。
+    """
+    unknown = set(params) - set(SWEEP_PARAMETERS)
+    if unknown:
+        raise ValueError(f"不支援掃描的參數: {', '.join(sorted(unknown))}")
+    previous = {name: getattr(config, name) for name in params}
+    try:
+        for name, value in params.items():
+            setattr(config, name, value)
+        yield
+    finally:
+        for name, value in previous.items():
+            setattr(config, name, value)
+
+# --- 共享記憶體 ---
+class SharedArrays:
+    """
+    把多個 NumPy 陣列放進同一塊共享記憶體 (各自以 64 bytes 對齊)。
+    spec 可傳給其他行程，以 attach_arrays(spec) 取得零複製的唯讀視圖；建立者負責 close() 釋放。
+    """
+
+    def __init__(self, arrays):
+        layout, offset = {}, 0
+        for name, array in arrays.items():
+            array = np.ascontiguousarray(array)
+            layout[name] = (array.dtype.str, array.shape, offset)
+            offset += -(-array.nbytes // 64) * 64
+        self.shm = shared_memory.SharedMemory(create=True, size=max(offset, 1))
+        for name, array in arrays.items():
+            dtype, shape, start = layout[name]
+            np.ndarray(shape, dtype=dtype, buffer=self.shm.buf, offset=start)[...] = array
+        self.spec = {'name': self.shm.name, 'layout': layout}
+
+    @property
+    def nbytes(self):
+        return self.shm.size
+
+    def close(self):
+        self.shm.close()
+        self.shm.unlink()
+
+def attach_arrays(spec):
+    """附加到 SharedArrays 建立的共享記憶體，回傳 (SharedMemory, {名稱: 唯讀陣列})；陣列使用期間須保留 SharedMemory 參照"""
+    shm = shared_memory.SharedMemory(name=spec['name'])
+    arrays = {}
+    for name, (dtype, shape, offset) in spec['layout'].items():
+        array = np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=offset)
+        array.flags.writeable = False
+        arrays[name] = array
+    return shm, arrays
+
+def _frame_arrays(df):
+    """
+    DataFrame -> (陣列字典, 重建資訊)：數值欄原樣保存；分類欄保存類別代碼 (類別清單放在重建資訊)；
+    字串欄編碼為定長 UTF-8 位元組陣列 (缺值存為空字串)。
+    """
+    arrays, columns = {}, []
+    for i, name in enumerate(df.columns):
+        series, key = df[name], f"c{i}"
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            arrays[key] = series.cat.codes.to_numpy()
+            columns.append((name, key, 'category', list(series.cat.categories)))
+        elif pd.api.types.is_numeric_dtype(series):
+            arrays[key] = series.to_numpy()
+            columns.append((name, key, 'numeric', None))
+        else:
+            arrays[key] = np.array([value.encode('utf-8') if isinstance(value, str) else b'' for value in series],
+                                   dtype=bytes)
+            columns.append((name, key, 'text', None))
+    index_column = df.index.name if df.index.name in df.columns else None
+    return arrays, {'columns': columns, 'index_column': index_column, 'attrs': dict(df.attrs)}
+
+def _frame_from_arrays(arrays, meta):
+    data = {}
+    for name, key, kind, categories in meta['columns']:
+        array = arrays[key]
+        if kind == 'category':
+            data[name] = pd.Categorical.from_codes(array, categories=categories)
+        elif kind == 'text':
+            decoded = pd.Series(np.char.decode(array, 'utf-8'), dtype='str')
+            data[name] = decoded.where(decoded != '')
+        else:
+            data[name] = array
+    frame = pd.DataFrame(data, copy=False)
+    if meta['index_column'] is not None:
+        frame = frame.set_index(meta['index_column'], drop=False)
+    frame.attrs.update(meta['attrs'])
+    return frame
+
+# --- 評估 ---
+def evaluate_parameters(params, master_df, returns=None, combinations=None, seed=0, frequency=None, cost_bps=None):
+    """
+    以一組參數重新篩選並建構每種 (風險偏好, 組合類型) 的投資組合，回傳每種組合一列的結果 (list of dict)：
+    標的池大小、持股數、HHI、有效持股數、加權 Beta / 波動率 / 殖利率；提供 returns 時另含回測績效 (BT_ 開頭)。
+    """
+    import backtest
+
+    combinations = combinations or ALL_COMBINATIONS
+    frequency = frequency or config.BACKTEST_FREQUENCY
+    universe = get_universe(master_df)
+    rows = []
+    with strategy_parameters(params):
+        # 不使用 get_screen_index：其快取以資料版本為鍵，無法區分不同的策略參數
+        screen = ScreenIndex(master_df)
+        pool_sizes = {'Filtered': len(screen.positions['filtered'])}
+        pool_sizes.update({f"Pool_{name}": len(pos) if pos is not None else 0
+                           for name, pos in {**screen.stock_pool_positions, **screen.etf_pool_positions}.items()})
+        for risk_profile, portfolio_type in combinations:
+            row = {'Risk': risk_profile, 'Type': portfolio_type, **pool_sizes}
+            portfolio_df, _ = build_portfolio(risk_profile, portfolio_type, screen.stock_pools, screen.etf_pools, seed=seed)
+            if portfolio_df.empty:
+                rows.append({**row, 'Holdings': 0})
+                continue
+            summary, _ = compute_analytics(portfolio_weights(portfolio_df, universe), universe)
+            row.update(summary.iloc[0].drop('Total_Weight').to_dict())
+            if returns is not None:
+                result = backtest.run_backtest(returns, risk_profile, portfolio_type, snapshots=pd.Series(dtype=object),
+                                               screen=screen, builder=lambda *args: portfolio_df,
+                                               frequency=frequency, seed=seed, cost_bps=cost_bps)
+                metrics = result.summary()
+                row.update({f"BT_{name}": metrics[name] for name in BACKTEST_METRICS})
+            rows.append(row)
+    return rows
+
+# --- Worker ---
+_WORKER_STATE = {}
+
+def _init_worker(frame_spec, frame_meta, panel_spec, panel_meta, options):
+    """worker 啟動時附加共享記憶體並重建 master_df 與報酬面板 (每個 worker 只做一次)"""
+    shm, arrays = attach_arrays(frame_spec)
+    _WORKER_STATE['handles'] = [shm]
+    _WORKER_STATE['master_df'] = _frame_from_arrays(arrays, frame_meta)
+    _WORKER_STATE['returns'] = None
+    if panel_spec is not None:
+        panel_shm, panel_arrays = attach_arrays(panel_spec)
+        _WORKER_STATE['handles'].append(panel_shm)
+        _WORKER_STATE['returns'] = pd.DataFrame(panel_arrays['returns'], index=panel_meta['index'],
+                                                columns=panel_meta['columns'], copy=False)
+    _WORKER_STATE['options'] = options
+
+def _run_task(task):
+    set_id, params = task
+    rows = evaluate_parameters(params, _WORKER_STATE['master_df'], _WORKER_STATE['returns'], **_WORKER_STATE['options'])
+    return [{'Param_Set': set_id, **row} for row in rows]
+
+def _param_columns(param_sets):
+    """參數值 (可能為 tuple 或 dict) 轉為表格欄位"""
+    table = pd.DataFrame([{name: (value if np.isscalar(value) else str(value)) for name, value in params.items()}
+                          for params in param_sets])
+    table.index.name = 'Param_Set'
+    return table
+
+def run_sweep(param_sets, master_df, returns=None, combinations=None, workers=None, seed=0, frequency=None,
+              cost_bps=None, chunksize=None):
+    """
+    平行評估多組參數，回傳一張表：每列為 (參數組, 風險偏好, 組合類型)，欄位為參數值與 evaluate_parameters 的結果。
+    workers=1 時直接在本行程中依序執行 (不建立共享記憶體)，方便除錯與比較。
+    worker 以 spawn 啟動 (Windows / macOS 的預設)，與 Streamlit 等多執行緒行程並用時也安全。
+    """
+    workers = workers or config.SWEEP_WORKERS or os.cpu_count()
+    options = {'combinations': combinations, 'seed': seed, 'frequency': frequency, 'cost_bps': cost_bps}
+    tasks = list(enumerate(param_sets))
+    start = time.perf_counter()
+
+    if workers == 1:
+        results = [[{'Param_Set': set_id, **row} for row in evaluate_parameters(params, master_df, returns, **options)]
+                   for set_id, params in tasks]
+        shared_mb = 0.0
+    else:
+        frame_arrays, frame_meta = _frame_arrays(master_df)
+        shared = [SharedArrays(frame_arrays)]
+        panel_spec = panel_meta = None
+        if returns is not None:
+            shared.append(SharedArrays({'returns': returns.to_numpy(dtype=np.float64)}))
+            panel_spec, panel_meta = shared[-1].spec, {'index': returns.index, 'columns': returns.columns}
+        shared_mb = sum(block.nbytes for block in shared) / 1024 ** 2
+        try:
+            with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                                     initializer=_init_worker,
+                                     initargs=(shared[0].spec, frame_meta, panel_spec, panel_meta, options)) as executor:
+                chunksize = chunksize or max(1, len(tasks) // (workers * 4))
+                results = list(executor.map(_run_task, tasks, chunksize=chunksize))
+        finally:
+            for block in shared:
+                block.close()
+
+    table = pd.DataFrame([row for rows in results for row in rows])
+    if table.empty:
+        return table
+    table['Holdings'] = table['Holdings'].astype('int64')
+    table = _param_columns(param_sets).join(table.set_index('Param_Set'), how='right').reset_index()
+    print(f"參數掃描完成：{len(param_sets)} 組參數 × {len(combinations or ALL_COMBINATIONS)} 種組合，"
+          f"{workers} 個 worker，共享記憶體 {shared_mb:.2f} MB，耗時 {time.perf_counter() - start:.2f} 秒。")
+    return table
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='策略參數掃描')
+    parser.add_argument('--grid', action='store_true', help='評估 DEFAULT_SWEEP_SPACE 的完整格點')
+    parser.add_argument('--samples', type=int, default=50, help='隨機抽樣的參數組數 (未指定 --grid 時)')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--prices', help='價格或報酬面板 (提供時計算回測績效)')
+    parser.add_argument('--output', default='sweep_results.csv')
+    args = parser.parse_args()
+
+    from data_loader import load_and_preprocess_data
+    master_df = load_and_preprocess_data()
+    returns = None
+    if args.prices:
+        from backtest import load_price_panel
+        returns = load_price_panel(args.prices)
+    param_sets = (parameter_grid(DEFAULT_SWEEP_SPACE) if args.grid
+                  else sample_parameters(DEFAULT_SWEEP_SPACE, args.samples, seed=args.seed))
+    table = run_sweep(param_sets, master_df, returns=returns, workers=args.workers, seed=args.seed)
+    table.to_csv(args.output, index=False, encoding='utf-8-sig')
+    print(f"結果已寫入 {args.output} ({len(table)} 列)。")
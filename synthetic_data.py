@@ -0,0 +1,155 @@
+# synthetic_data.py
+# 合成標的清單產生器：依真實來源檔的欄位格式 (中文欄名、"1,763" 千分位、'--' / 'NA' / 空白缺值、'24%' 百分比字串)
+# 產生任意筆數的 ETF 檔與上市、上櫃個股檔，供離線測試大型標的清單 (例如加入海外掛牌與基金後的數十萬筆) 的載入與篩選。
+# 數值分佈大致貼近原始資料，讓規則零與各標的池在合成資料上仍會篩出合理數量的標的。
+# 用法：python synthetic_data.py --rows 100000 --out synthetic_data
+#       python synthetic_data.py --rows 100000 --etf-csv      (ETF 檔改寫為 CSV，大量列數時寫入 Excel 很慢)
+
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+ETF_FRACTION = 0.15            # ETF 佔全部標的的比例
+LISTED_FRACTION = 0.55         # 個股中上市的比例 (其餘為上櫃)
+BLANK_RATE = 0.03              # 數值欄位隨機留空的比例
+
+STOCK_INDUSTRIES = ['半導體業', '電子零組件業', '電腦及週邊設備業', '光電業', '通信網路業', '其他電子業', '金融保險業',
+                    '航運業', '生技醫療業', '建材營造業', '食品工業', '水泥工業', '塑膠工業', '鋼鐵工業', '觀光餐旅',
+                    '文化創意業', '綠能環保', '數位雲端']
+ETF_INDUSTRIES = ['國內成分股ETF', '國外成分股ETF', '債券ETF', '槓桿反向ETF']
+ETF_ISSUERS = ['元大', '富邦', '國泰', '群益', '中信', '復華', '永豐', '台新', '凱基', '統一']
+ETF_THEMES = ['台灣50', '高股息', '高息低波', '半導體', '科技', 'AI', '電動車', '綠能', '公司治理', '市值',
+              '美債20年', '公債', '政府債', '投資級公司債', '公司債', '台灣50正2', '台灣50反1', '槓桿', 'S&P 500']
+NAME_CHARS = list('台華國泰宏聯電光科技精密興業發展金屬化工通訊網路生醫藥建設食品紡織鋼鐵航運能源環保材料資訊晶創新')
+
+# 真實來源檔的欄位順序
+LISTED_COLUMNS = ['代號', '名稱', '市場', '產業別', '一年(β)', '市值(億)', '成立年數', '近3年平均ROE(%)',
+                  '近3年加權平均ROE(%)', '最新單季ROE(%)', 'PER', '累月營收年增(%)', '最新季度負債總額佔比(%)',
+                  '現金股利連配次數', '成交價現金殖利率', '一年(σ年)', '僑外投資持股(%)', '本國法人持股(%)',
+                  '最新近4Q每股自由金流(元)']
+ETF_COLUMNS = ['名稱', '代碼.x', '市場', '產業別', '一年.β.', '市值.億.', '成交價現金殖利率', '三年.σ年.', '五年.σ年.',
+               '排行', '代碼.y', '市價', '漲跌...', '折溢價...', '五日均量.張.', '資產規模.億.', '近四季殖利率',
+               '年報酬率.含息.', '內扣費用.保管.管理.', '交易幣別', '受益人數', '成立年齡', '本月月增率']
+
+
+def _format(values, fmt, rng, blank='', blank_rate=BLANK_RATE):
+    """數值陣列 -> 字串欄位 (fmt 例如 '{:,.1f}' 產生千分位)，並隨機以 blank 留空"""
+    text = np.array([fmt.format(v) for v in values], dtype=object)
+    text[rng.random(len(values)) < blank_rate] = blank
+    return text
+
+def _names(n, rng, low=2, high=4):
+    lengths = rng.integers(low, high + 1, size=n)
+    chars = rng.choice(NAME_CHARS, size=(n, high))
+    return [''.join(row[:length]) for row, length in zip(chars, lengths)]
+
+def _stock_frame(codes, market, rng):
+    n = len(codes)
+    market_cap = rng.lognormal(mean=3.5, sigma=1.6, size=n)
+    frame = pd.DataFrame({
+        '代號': codes,
+        '名稱': _names(n, rng),
+        '市場': market,
+        '產業別': rng.choice(STOCK_INDUSTRIES, size=n),
+        '一年(β)': _format(rng.normal(0.8, 0.4, n), '{:.2f}', rng),
+        # 市值大於 1000 億時出現千分位，例如 "1,763"
+        '市值(億)': _format(market_cap, '{:,.1f}', rng),
+        '成立年數': _format(rng.uniform(0.5, 70, n), '{:.1f}', rng),
+        '近3年平均ROE(%)': _format(rng.normal(8, 9, n), '{:.2f}', rng),
+        '近3年加權平均ROE(%)': _format(rng.normal(8, 9, n), '{:.2f}', rng),
+        '最新單季ROE(%)': _format(rng.normal(2, 3, n), '{:.2f}', rng),
+        'PER': _format(rng.lognormal(2.8, 0.6, n), '{:.1f}', rng),
+        '累月營收年增(%)': _format(rng.normal(5, 25, n), '{:.2f}', rng),
+        '最新季度負債總額佔比(%)': _format(rng.uniform(5, 90, n), '{:.1f}', rng),
+        '現金股利連配次數': _format(rng.integers(0, 35, n), '{:d}', rng),
+        '成交價現金殖利率': _format(rng.gamma(2.0, 1.5, n), '{:.2f}', rng),
+        '一年(σ年)': _format(rng.lognormal(3.4, 0.35, n), '{:.1f}', rng),
+        '僑外投資持股(%)': _format(rng.uniform(0, 60, n), '{:.1f}', rng),
+        '本國法人持股(%)': _format(rng.uniform(0, 60, n), '{:.1f}', rng),
+        '最新近4Q每股自由金流(元)': _format(rng.normal(1.5, 4, n), '{:.2f}', rng),
+    })
+    return frame[LISTED_COLUMNS]
+
+def _etf_frame(codes, rng):
+    n = len(codes)
+    themes = rng.choice(ETF_THEMES, size=n)
+    is_bond = np.char.find(themes.astype(str), '債') >= 0
+    is_leveraged = pd.Series(themes).str.contains('正2|反1|槓桿').to_numpy()
+    codes = np.where(is_bond, np.char.add(codes.astype(str), 'B'), codes)
+    size = rng.lognormal(3.5, 1.5, n)
+    price = rng.lognormal(3.0, 0.7, n)
+    annual_return = np.array([f"{v:.0f}%" for v in rng.normal(8, 15, n)], dtype=object)
+    annual_return[rng.random(n) < 0.1] = '--'
+    frame = pd.DataFrame({
+        '名稱': [f"{issuer}{theme}{i % 97 or ''}" for i, (issuer, theme)
+               in enumerate(zip(rng.choice(ETF_ISSUERS, size=n), themes))],
+        # 代碼.x 為數值化後失去前導零的代號 (與原始檔相同)，實際使用的是 代碼.y
+        '代碼.x': [code.lstrip('0') for code in codes],
+        '市場': rng.choice(['市', '櫃'], size=n, p=[0.7, 0.3]),
+        '產業別': np.select([is_bond, is_leveraged], ['債券ETF', '槓桿反向ETF'], rng.choice(ETF_INDUSTRIES[:2], size=n)),
+        '一年.β.': _format(rng.normal(0.8, 0.3, n), '{:.2f}', rng, blank='NA', blank_rate=0.1),
+        '市值.億.': _format(size, '{:,.2f}', rng),
+        '成交價現金殖利率': _format(rng.gamma(2.0, 1.5, n), '{:.2f}', rng),
+        '三年.σ年.': _format(rng.lognormal(2.9, 0.4, n), '{:.1f}', rng, blank='NA', blank_rate=0.3),
+        '五年.σ年.': _format(rng.lognormal(2.9, 0.4, n), '{:.1f}', rng, blank='NA', blank_rate=0.5),
+        '排行': np.arange(1, n + 1),
+        '代碼.y': codes,
+        '市價': _format(price, '{:,.2f}', rng),
+        '漲跌...': _format(rng.normal(0, 1, n), '{:.2f}', rng),
+        '折溢價...': _format(rng.normal(0, 0.5, n), '{:.2f}', rng),
+        '五日均量.張.': _format(rng.lognormal(6, 2, n), '{:,.1f}', rng),
+        '資產規模.億.': _format(size, '{:,.2f}', rng),
+        '近四季殖利率': _format(rng.gamma(2.0, 1.5, n), '{:.2f}', rng),
+        '年報酬率.含息.': annual_return,
+        '內扣費用.保管.管理.': _format(rng.uniform(0.1, 1.2, n), '{:.3f}', rng),
+        '交易幣別': '新臺幣',
+        '受益人數': _format(rng.lognormal(9, 2, n), '{:,.0f}', rng),
+        '成立年齡': _format(rng.uniform(0.1, 20, n), '{:.2f}', rng),
+        '本月月增率': _format(rng.normal(0, 3, n), '{:.2f}', rng),
+    })
+    return frame[ETF_COLUMNS]
+
+def _stock_codes(n, start):
+    """個股代號：四碼用完後改用五、六碼 (不會與 ETF 的 00 開頭代號重複)"""
+    numbers = np.arange(start, start + n)
+    return np.array([f"{x:04d}" if x < 10000 else f"{x}" for x in numbers], dtype=object)
+
+def generate_universe(rows, out_dir, seed=0, etf_csv=False, etf_fraction=ETF_FRACTION):
+    """
+    產生共 rows 筆標的的三個來源檔，回傳 (etf_file, listed_file, otc_file)。
+    個股檔為 CSV，ETF 檔預設為 Excel (與原始檔相同)；etf_csv=True 時寫為 CSV (data_loader 依副檔名讀取)。
+    """
+    rng = np.random.default_rng(seed)
+    os.makedirs(out_dir, exist_ok=True)
+    n_etf = max(1, int(rows * etf_fraction))
+    n_listed = int((rows - n_etf) * LISTED_FRACTION)
+    n_otc = rows - n_etf - n_listed
+
+    etf_codes = np.array([f"00{x:04d}" for x in range(50, 50 + n_etf)], dtype=object)
+    listed = _stock_frame(_stock_codes(n_listed, 1101), '市', rng)
+    otc = _stock_frame(_stock_codes(n_otc, 1101 + n_listed), '櫃', rng)
+    etf = _etf_frame(etf_codes, rng)
+
+    etf_file = os.path.join(out_dir, 'ETFALL.csv' if etf_csv else 'ETFALL.xlsx')
+    listed_file = os.path.join(out_dir, 'listed stock. without etf.csv')
+    otc_file = os.path.join(out_dir, 'OTC without etf.csv')
+    if etf_csv:
+        etf.to_csv(etf_file, index=False)
+    else:
+        etf.to_excel(etf_file, index=False)
+    listed.to_csv(listed_file, index=False)
+    otc.to_csv(otc_file, index=False)
+    return etf_file, listed_file, otc_file
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='產生合成的標的清單來源檔')
+    parser.add_argument('--rows', type=int, default=100000, help='標的總數')
+    parser.add_argument('--out', default='synthetic_data', help='輸出目錄')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--etf-csv', action='store_true', help='ETF 檔寫為 CSV (大量列數時寫入 Excel 很慢)')
+    args = parser.parse_args()
+    for path in generate_universe(args.rows, args.out, seed=args.seed, etf_csv=args.etf_csv):
+        print(f"{path}: {os.path.getsize(path) / 1024 ** 2:.1f} MB")
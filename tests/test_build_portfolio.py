@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+
+import data_loader
+from investment_analyzer import build_portfolio, build_portfolios_batch, get_screen_index
+
+RISK_PROFILES = ['保守型', '穩健型', '積極型']
+PORTFOLIO_TYPES = ['純個股', '純ETF', '混合型']
+
+
+@pytest.fixture(scope='module')
+def screen():
+    return get_screen_index(data_loader.load_and_preprocess_data())
+
+
+def _build(screen, risk_profile, portfolio_type, seed):
+    portfolio_df, hhi_value = build_portfolio(risk_profile, portfolio_type, screen.stock_pools, screen.etf_pools,
+                                              seed=seed)
+    return portfolio_df, hhi_value
+
+
+@pytest.mark.parametrize('portfolio_type', PORTFOLIO_TYPES)
+@pytest.mark.parametrize('risk_profile', RISK_PROFILES)
+def test_same_seed_is_bitwise_reproducible(screen, risk_profile, portfolio_type):
+    first, first_hhi = _build(screen, risk_profile, portfolio_type, seed=7)
+    # 中間穿插其他建構，結果不可依賴先前的求解歷史
+    for other_risk in RISK_PROFILES:
+        for other_type in PORTFOLIO_TYPES:
+            _build(screen, other_risk, other_type, seed=11)
+    second, second_hhi = _build(screen, risk_profile, portfolio_type, seed=7)
+
+    assert list(first.index) == list(second.index)
+    assert np.array_equal(first['Weight'].to_numpy(), second['Weight'].to_numpy())
+    assert first_hhi == second_hhi
+
+
+@pytest.fixture(scope='module')
+def master_df(screen):
+    return screen.master_df
+
+
+def test_batch_accepts_stock_id_forced_include(screen, master_df):
+    requests = [
+        {'risk': '積極型', 'type': '純個股', 'forced_include': '2330', 'seed': 1},
+        {'risk': '穩健型', 'type': '混合型', 'forced_include': ['2330', '0050'], 'seed': 2},
+    ]
+    result = build_portfolios_batch(requests, screen.stock_pools, screen.etf_pools, master_df=master_df)
+
+    first = result[result['request_index'] == 0]
+    assert '2330' in set(first['StockID'])
+    assert first['Weight'].sum() == pytest.approx(1.0)
+    expected, _ = build_portfolio('積極型', '純個股', screen.stock_pools, screen.etf_pools, forced_include='2330',
+                                  seed=1, master_df=master_df)
+    assert list(first['StockID']) == list(expected.index)
+    assert {'2330', '0050'} <= set(result.loc[result['request_index'] == 1, 'StockID'])
+
+
+def test_unknown_forced_include_raises_key_error(screen, master_df):
+    with pytest.raises(KeyError, match='NOPE'):
+        build_portfolios_batch([{'risk': '積極型', 'type': '純個股', 'forced_include': 'NOPE'}],
+                               screen.stock_pools, screen.etf_pools, master_df=master_df)
+    with pytest.raises(ValueError):
+        build_portfolio('積極型', '純個股', screen.stock_pools, screen.etf_pools, forced_include='2330')
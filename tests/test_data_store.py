@@ -0,0 +1,30 @@
+import pandas as pd
+
+from data_store import DataStore
+
+
+def _frame(close):
+    df = pd.DataFrame({'名稱': ['台積電'], 'AssetType': ['個股'], 'Close': [close]},
+                      index=pd.Index(['2330'], name='StockID'))
+    df.attrs['data_version'] = f"v{close}"
+    return df
+
+
+class _Screen:
+    def __init__(self, master_df):
+        self.master_df = master_df
+        self.version = master_df.attrs['data_version']
+
+
+def test_evicted_version_is_not_replaced_by_current(monkeypatch):
+    monkeypatch.setattr('data_store.get_screen_index', _Screen)
+    frames = iter([_frame(1), _frame(2), _frame(3)])
+    store = DataStore(max_versions=2, loader=lambda: next(frames))
+    for _ in range(3):
+        store.load()
+
+    assert store.versions == ['v2', 'v3']
+    assert store.snapshot('v1') is None
+    assert store.snapshot('v2').master_df['Close'].iloc[0] == 2
+    assert store.pool('v1', '篩選前的所有名單') is None
+    assert store.pool(None, '篩選前的所有名單')['Close'].iloc[0] == 3
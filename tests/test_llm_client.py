@@ -0,0 +1,64 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from llm_client import LLMClient
+
+
+class _Response:
+    def __init__(self, text):
+        self.text = text
+
+
+class SlowBackend:
+    """每次呼叫阻塞 delay 秒，並記錄同時執行中的呼叫數峰值"""
+    model_name = 'slow'
+
+    def __init__(self, delay):
+        self.delay = delay
+        self.active = 0
+        self.peak = 0
+        self._lock = threading.Lock()
+
+    def generate_content(self, prompt, stream=False):
+        with self._lock:
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+        try:
+            time.sleep(self.delay)
+            return _Response('ok')
+        finally:
+            with self._lock:
+                self.active -= 1
+
+
+def test_client_works_on_several_event_loops():
+    client = LLMClient(SlowBackend(0.01), rate_per_second=1000, burst=1000, max_concurrency=1, timeout=5)
+
+    async def contended():
+        # 呼叫數超過併發上限，才會實際在 semaphore 上等待
+        return await asyncio.gather(*(client.agenerate(str(i)) for i in range(3)))
+
+    # 同步 API 走背景迴圈，其後在兩個不同的 asyncio.run 迴圈中使用同一個 client
+    assert client.generate_content('a').text == 'ok'
+    assert asyncio.run(contended()) == ['ok'] * 3
+    assert asyncio.run(contended()) == ['ok'] * 3
+
+
+def test_timed_out_calls_keep_their_concurrency_slot():
+    backend = SlowBackend(0.3)
+    client = LLMClient(backend, rate_per_second=1000, burst=1000, max_concurrency=1, max_retries=2,
+                       base_delay=0.01, max_delay=0.01, timeout=0.05)
+
+    async def run():
+        with pytest.raises(TimeoutError):
+            await client.agenerate('x')
+        while backend.active:
+            await asyncio.sleep(0.01)
+
+    asyncio.run(run())
+    assert client.stats['timeouts'] == 3
+    # 逾時後的重試必須等前一個工作執行緒結束，阻塞呼叫不會疊加
+    assert backend.peak == 1
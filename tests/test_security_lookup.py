@@ -0,0 +1,50 @@
+import pandas as pd
+import pytest
+
+from security_lookup import SecurityIndex, parse_chat_intent
+
+
+@pytest.fixture(scope='module')
+def index():
+    master_df = pd.DataFrame(
+        {'名稱': ['台積電', '聯發科', '矽力*-KY', '元大台灣50', '元大高股息', '元大美債20年', '台泥乙特']},
+        index=pd.Index(['2330', '2454', '6415', '0050', '0056', '00679B', '1101B'], name='StockID'),
+    )
+    return SecurityIndex(master_df)
+
+
+@pytest.mark.parametrize('prompt', [
+    '什麼時候應該賣出？',
+    '這個組合適合買入嗎',
+    '為什麼要排除高風險的股票？',
+    '這個組合的配置是 60% 股票嗎？',
+    '組合中股票比例 60% 合理嗎',
+    '我應該加入台積電嗎？',
+    '加入台雞電',
+])
+def test_questions_fall_through_to_llm(index, prompt):
+    assert parse_chat_intent(prompt, index) is None
+
+
+@pytest.mark.parametrize('prompt, action, stock_id, weight', [
+    ('加入台積電', 'add', '2330', None),
+    ('如果我想加入台積電會如何', 'add', '2330', None),
+    ('加入 2330 吧', 'add', '2330', None),
+    ('移除 0050', 'remove', '0050', None),
+    ('移除矽力', 'remove', '6415', None),
+    ('加入台積', 'add', '2330', None),
+    ('把台積電的權重調到 20%', 'reweight', '2330', 0.2),
+    ('聯發科權重改為3成', 'reweight', '2454', 0.3),
+])
+def test_commands(index, prompt, action, stock_id, weight):
+    intent = parse_chat_intent(prompt, index)
+    assert intent.action == action
+    assert intent.match.stock_id == stock_id
+    assert intent.weight == weight
+
+
+def test_ambiguous_target_returns_candidates(index):
+    intent = parse_chat_intent('加入元大', index)
+    assert intent.match is None
+    assert intent.query == '元大'
+    assert {c.stock_id for c in intent.candidates} >= {'0050', '0056'}
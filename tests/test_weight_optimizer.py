@@ -0,0 +1,28 @@
+import numpy as np
+import pytest
+
+from weight_optimizer import HHI_TOLERANCE, WeightOptimizer
+
+
+@pytest.mark.parametrize('offset', [-HHI_TOLERANCE / 2, -HHI_TOLERANCE, 0.0, 1e-15, 1e-12])
+def test_hhi_cap_near_most_dispersed_solution(offset):
+    # 10 檔無其他限制時最分散的解為等權重 (HHI = 0.1)；上限落在其容許誤差附近時不可因搜尋區間無限擴大而溢位
+    hhi_max = 0.1 + offset
+    weights, info = WeightOptimizer().solve(np.arange(10.0), hhi_max=hhi_max)
+    assert weights.sum() == pytest.approx(1.0)
+    if offset < 0:
+        assert info['status'] == 'hhi_infeasible'
+        np.testing.assert_allclose(weights, 0.1)
+    else:
+        assert info['status'] == 'optimal'
+        assert info['hhi'] <= hhi_max + HHI_TOLERANCE
+
+
+def test_hhi_cap_binding():
+    scores = np.linspace(0.0, 5.0, 20)
+    weights, info = WeightOptimizer().solve(scores, hhi_max=0.08, max_weight=0.3)
+    assert info['status'] == 'optimal'
+    assert info['hhi'] == pytest.approx(0.08, abs=HHI_TOLERANCE)
+    assert weights.max() <= 0.3 + 1e-12
+    # 分數越高權重不低於分數較低者
+    assert np.all(np.diff(weights) >= -1e-12)
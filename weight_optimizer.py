@@ -0,0 +1,197 @@
+# weight_optimizer.py
+# 有限制條件的權重最佳化 (純 NumPy，不依賴外部求解器)：
+#   最大化  s·w                         (s 為因子分數，例如殖利率、ROE、營收成長)
+#   限制    Σw = 1、min_weight ≤ w ≤ max_weight、各產業權重 ≤ industry_max、HHI = Σw² ≤ hhi_max
+# 作法：對 HHI 限制取拉格朗日乘數 γ，固定 γ 時最佳解為 s/γ 在其餘 (線性) 限制所構成多面體上的歐氏投影，
+# 投影以分段線性方程式的斷點精確求解；再以 Illinois 法搜尋讓 HHI 恰好等於上限的 γ。
+# 上一次的 γ 可作為下一次求解的起點 (warm start)，重複求解相似問題時只需少量迭代。
+
+import math
+import time
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+HHI_TOLERANCE = 1e-7
+MAX_ITERATIONS = 60
+MAX_LOG_RANGE = 25           # 搜尋 log γ 時偏離 log(分數全距) 的上限，超過後 s/γ 會失去浮點精度或使 exp 溢位
+WARM_START_CACHE_SIZE = 256
+
+# --- 投影 ---
+def _crossings(breaks, values, targets):
+    """
+    values[k, g] 為第 g 個非遞增分段線性函數在 breaks[k] 的值；回傳各函數等於 targets[g] 的位置。
+    函數在 breaks[0] 之前已不大於目標時回傳 breaks[0] (限制未生效)。
+    """
+    below = values < targets
+    k = np.where(below.any(axis=0), below.argmax(axis=0), len(breaks) - 1)
+    k_prev = np.maximum(k - 1, 0)
+    cols = np.arange(values.shape[1])
+    f_prev, f_next = values[k_prev, cols], values[k, cols]
+    span = np.where(f_prev > f_next, f_prev - f_next, 1.0)
+    t = breaks[k_prev] + (f_prev - targets) * (breaks[k] - breaks[k_prev]) / span
+    return np.where(k == 0, breaks[0], t)
+
+def project_weights(y, lower, upper, groups=None, group_caps=None):
+    """
+    y 在 {Σw = 1, lower ≤ w ≤ upper, 各群組權重和 ≤ group_caps} 上的歐氏投影。
+    groups 為每個元素的群組編號 (-1 代表不受群組限制)。
+    最佳解形式為 w = clip(y - max(τ, ν_g), lower, upper)：ν_g 讓觸及上限的群組恰好等於上限，τ 讓總和為 1。
+    """
+    y = np.asarray(y, dtype=np.float64)
+    floor = np.full(len(y), -np.inf)
+    if groups is not None and group_caps is not None and len(group_caps):
+        member = (groups[:, None] == np.arange(len(group_caps))[None, :]).astype(np.float64)
+        breaks = np.sort(np.concatenate([y - upper, y - lower]))
+        sums = np.clip(y[None, :] - breaks[:, None], lower, upper) @ member
+        nu = _crossings(breaks, sums, group_caps)
+        # 上限未生效的群組不設下限
+        nu = np.where(sums[0] > group_caps, nu, -np.inf)
+        floor = np.where(groups >= 0, nu[np.maximum(groups, 0)], -np.inf)
+
+    finite_floor = floor[np.isfinite(floor)]
+    breaks = np.sort(np.concatenate([y - upper, y - lower, finite_floor]))
+    totals = np.clip(y[None, :] - np.maximum(breaks[:, None], floor[None, :]), lower, upper).sum(axis=1)
+    tau = _crossings(breaks, totals[:, None], np.array([1.0]))[0]
+    return np.clip(y - np.maximum(tau, floor), lower, upper)
+
+def greedy_weights(scores, lower, upper, groups=None, group_caps=None):
+    """
+    不含 HHI 限制時的最佳解 (線性規劃)：每檔先給 lower，再依分數由高到低在單檔上限、群組上限與剩餘權重內盡量加碼。
+    群組互不重疊，限制構成層狀 (laminar) 結構，貪婪法即為最佳解。
+    """
+    weights = np.full(len(scores), lower, dtype=np.float64)
+    remaining = 1.0 - weights.sum()
+    room = None if group_caps is None else group_caps - np.bincount(groups[groups >= 0], weights=weights[groups >= 0],
+                                                                     minlength=len(group_caps))
+    for i in np.argsort(-scores, kind='stable'):
+        if remaining <= 0:
+            break
+        add = min(upper - lower, remaining)
+        if room is not None and groups[i] >= 0:
+            add = min(add, room[groups[i]])
+            room[groups[i]] -= add
+        weights[i] += add
+        remaining -= add
+    return weights
+
+
+class WeightOptimizer:
+    """
+    因子加權的最佳化器。solve() 回傳 (權重陣列, 求解資訊)；
+    以 warm_key 區分問題類型 (例如風險偏好與持股數)，同一 warm_key 的下一次求解從上次的 γ 附近開始搜尋。
+    """
+
+    def __init__(self, tolerance=None, max_iterations=None):
+        self.tolerance = tolerance or HHI_TOLERANCE
+        self.max_iterations = max_iterations or MAX_ITERATIONS
+        self._warm_gamma = OrderedDict()
+
+    def solve(self, scores, hhi_max=None, min_weight=0.0, max_weight=1.0, groups=None, group_max=None, warm_key=None):
+        start = time.perf_counter()
+        scores = np.asarray(scores, dtype=np.float64)
+        n = len(scores)
+        if n == 0:
+            return np.empty(0), {'status': 'empty', 'iterations': 0, 'hhi': 0.0, 'gamma': None, 'relaxed': [], 'seconds': 0.0}
+        # 缺值的因子分數視為最差
+        if np.isnan(scores).all():
+            scores = np.zeros(n)
+        else:
+            scores = np.where(np.isnan(scores), np.nanmin(scores), scores)
+
+        lower, upper, groups, caps, relaxed = self._feasible_bounds(n, min_weight, max_weight, groups, group_max)
+        project = lambda gamma: project_weights(scores / gamma, lower, upper, groups, caps)
+        hhi = lambda w: float(np.dot(w, w))
+        info = {'relaxed': relaxed, 'iterations': 0, 'gamma': None}
+
+        spread = float(scores.max() - scores.min())
+        weights = project_weights(np.zeros(n), lower, upper, groups, caps)
+        greedy = greedy_weights(scores, lower, upper, groups, caps)
+        # 與 _search 使用同一個門檻：最分散的解只要超過上限就無法以提高 γ 達成
+        if spread == 0 or (hhi_max is not None and hhi(weights) > hhi_max):
+            # 因子無差異：取最分散的可行解；或連最分散的可行解都超過 HHI 上限
+            info['status'] = 'uniform' if spread == 0 else 'hhi_infeasible'
+        elif hhi_max is None or hhi(greedy) <= hhi_max:
+            # HHI 限制未生效：線性規劃的解即為最佳解
+            weights = greedy
+            info['status'] = 'hhi_inactive'
+        else:
+            weights, info = self._search(project, hhi, hhi_max, spread, warm_key, info)
+        info['hhi'] = hhi(weights)
+        info['seconds'] = time.perf_counter() - start
+        return weights, info
+
+    def _feasible_bounds(self, n, min_weight, max_weight, groups, group_max):
+        """調整互相矛盾的限制 (例如持股太少而單檔上限乘以檔數小於 1)，並記錄被放寬的項目"""
+        relaxed = []
+        lower, upper = min_weight, max_weight
+        if lower * n > 1:
+            lower = 0.0
+            relaxed.append('min_weight')
+        if upper * n < 1:
+            upper = 1.0 / n
+            relaxed.append('max_weight')
+
+        caps = None
+        if groups is not None and group_max is not None:
+            # 群組標籤轉為 0..G-1 的編號；缺值 (例如產業別空白) 不受群組限制
+            groups, labels = pd.factorize(pd.Series(groups, dtype=object))
+            sizes = np.bincount(groups[groups >= 0], minlength=len(labels))
+            caps = np.maximum(np.full(len(sizes), float(group_max)), sizes * lower)
+            if np.minimum(caps, sizes * upper).sum() < 1:
+                groups, caps = None, None
+                relaxed.append('group_max')
+        else:
+            groups = None
+        return lower, upper, groups, caps, relaxed
+
+    def _search(self, project, hhi, hhi_max, spread, warm_key, info):
+        """在 x = log γ 上以 Illinois 法求解 HHI(x) = hhi_max；HHI 隨 γ 遞減，回傳可行側 (HHI ≤ 上限) 的解"""
+        g = lambda x: hhi(project(math.exp(x))) - hhi_max
+        x0 = math.log(self._warm_gamma[warm_key]) if warm_key in self._warm_gamma else math.log(spread)
+        step = 0.1 if warm_key in self._warm_gamma else 4.0
+        x_a, x_b = x0 - step, x0 + step
+        g_a, g_b = g(x_a), g(x_b)
+        iterations = 2
+        # 擴大搜尋區間直到兩端異號；γ 夠大時解趨近最分散的可行解 (HHI 不超過上限)，故設上限
+        while g_b > 0 and x_b < math.log(spread) + MAX_LOG_RANGE:
+            x_a, g_a = x_b, g_b
+            x_b += step
+            step *= 2
+            g_b = g(x_b)
+            iterations += 1
+        while g_a <= 0 and x_a > math.log(spread) - MAX_LOG_RANGE:
+            # 線性規劃解的 HHI 超過上限，因此 γ 夠小時必定超過；過小的 γ 會讓 s/γ 失去浮點精度，故設下限
+            x_b, g_b = x_a, g_a
+            x_a -= step
+            step *= 2
+            g_a = g(x_a)
+            iterations += 1
+
+        # Illinois：同一端點連續保留兩次時將其函數值減半，避免 regula falsi 單側收斂過慢
+        # (gap 為 x_b 處真正的 HHI 差距，作為停止條件)
+        side, gap = 0, g_b
+        while g_a > 0 and -gap > self.tolerance and iterations < self.max_iterations:
+            x = (x_a * g_b - x_b * g_a) / (g_b - g_a)
+            g_x = g(x)
+            iterations += 1
+            if g_x > 0:
+                x_a, g_a = x, g_x
+                if side == -1:
+                    g_b /= 2
+                side = -1
+            else:
+                x_b, g_b, gap = x, g_x, g_x
+                if side == 1:
+                    g_a /= 2
+                side = 1
+
+        gamma = math.exp(x_b)
+        if warm_key is not None:
+            self._warm_gamma[warm_key] = gamma
+            self._warm_gamma.move_to_end(warm_key)
+            while len(self._warm_gamma) > WARM_START_CACHE_SIZE:
+                self._warm_gamma.popitem(last=False)
+        info.update(status='optimal', iterations=iterations, gamma=gamma)
+        return project(gamma), info